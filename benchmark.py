@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+"""Micro-benchmarks for parts of rapidsms-nutrition.
+
+Each benchmark runs locally against the test settings. Pass its name,
+followed by its options::
+
+    python benchmark.py lookups --patients 50 --latency 0.02
+
+Run ``python benchmark.py`` to list the available benchmarks.
+"""
+from contextlib import contextmanager
+import optparse
+import subprocess
+import sys
+import time
+
+import runtests  # Configures the test settings.
+
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+        teardown_test_environment)
+
+
+@contextmanager
+def test_database():
+    """Runs the enclosed code against a temporary test database."""
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+def timed(func, repeat):
+    """Returns the best time, in seconds, of repeat calls to func."""
+    best = None
+    for i in range(repeat):
+        start = time.time()
+        func()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def lookups(args):
+    """Serial vs. concurrent patient lookups against a slow backend."""
+    parser = optparse.OptionParser(usage='%prog lookups [options]')
+    parser.add_option('--patients', type='int', default=50,
+            help='Number of patients to retrieve.')
+    parser.add_option('--latency', type='float', default=0.02,
+            help='Seconds each backend lookup takes.')
+    parser.add_option('--concurrency', type='int', default=8,
+            help='Maximum number of concurrent lookups.')
+    options, _ = parser.parse_args(args)
+
+    import mock
+    from healthcare.api import client
+    from nutrition.lookups import get_patients
+    from nutrition.tests.backends import SlowStorage
+
+    backend = SlowStorage(latency=options.latency)
+    ids = [unicode(backend.create_patient({})['id'])
+            for i in range(options.patients)]
+    with mock.patch.object(client.patients, 'backend', backend):
+        for concurrency in (1, options.concurrency):
+            start = time.time()
+            patients = get_patients(ids, concurrency=concurrency)
+            elapsed = time.time() - start
+            print('concurrency {0:3d}: {1} patients in {2:.3f} s'.format(
+                    concurrency, len(patients), elapsed))
+
+
+def exports(args):
+    """CSV export rows via django_tables2 vs. values_list()."""
+    parser = optparse.OptionParser(usage='%prog exports [options]')
+    parser.add_option('--reports', type='int', default=2000,
+            help='Number of reports to export.')
+    parser.add_option('--patients', type='int', default=100,
+            help='Number of patients the reports are for.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each export.')
+    options, _ = parser.parse_args(args)
+
+    from loadtest import LoadTestFixtures
+    from nutrition.exports import ReportRows
+    from nutrition.models import Report
+    from nutrition.tables import CSVNutritionReportTable
+
+    def table_rows():
+        table = CSVNutritionReportTable(Report.objects.all())
+        Report.prefetch_patients(table.data.queryset)
+        return [list(row) for row in table.rows]
+
+    def values_rows():
+        return list(ReportRows(Report.objects.all()))
+
+    with test_database():
+        fixtures = LoadTestFixtures()
+        fixtures.clear_healthcare_backends()
+        patients = [fixtures.create_patient()
+                for i in range(options.patients)]
+        for i in range(options.reports):
+            patient_id, _, patient = patients[i % len(patients)]
+            Report.objects.create(patient_id=patient_id,
+                    global_patient_id=patient['id'], weight=12, height=90,
+                    status=Report.ANALYZED)
+        for name, func in (('django_tables2', table_rows),
+                ('values_list', values_rows)):
+            elapsed = timed(func, options.repeat)
+            print('{0:15s}: {1} rows in {2:.3f} s ({3:.1f} us/row)'.format(
+                    name, options.reports, elapsed,
+                    elapsed * 1e6 / options.reports))
+
+
+STARTUP_SCRIPT = """
+import resource, sys, time
+import runtests
+before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+start = time.time()
+import {module}
+elapsed = time.time() - start
+after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+print('{{0:.1f}} {{1}} {{2}} {{3}}'.format(elapsed * 1000, after - before,
+        int('pygrowup' in sys.modules), int('django_tables2' in sys.modules)))
+"""
+
+
+def startup(args):
+    """Import time and memory of nutrition.handlers in a fresh process."""
+    parser = optparse.OptionParser(usage='%prog startup [options]')
+    parser.add_option('--module', default='nutrition.handlers',
+            help='Module to import.')
+    parser.add_option('--repeat', type='int', default=5,
+            help='Number of processes to start.')
+    options, _ = parser.parse_args(args)
+
+    script = STARTUP_SCRIPT.format(module=options.module)
+    results = []
+    for i in range(options.repeat):
+        output = subprocess.check_output([sys.executable, '-c', script])
+        results.append(output.split())
+    times = sorted(float(result[0]) for result in results)
+    memory = sorted(int(result[1]) for result in results)
+    print('import {0}: median {1:.1f} ms, +{2} KB max RSS'.format(
+            options.module, times[len(times) // 2], memory[len(memory) // 2]))
+    print('pygrowup loaded: {0}, django_tables2 loaded: {1}'.format(
+            results[0][2] == '1', results[0][3] == '1'))
+
+    from nutrition import growth
+    start = time.time()
+    growth.warm_up()
+    print('growth.warm_up(): {0:.1f} ms'.format((time.time() - start) * 1000))
+
+
+def search(args):
+    """Substring ID search with and without the trigram index."""
+    parser = optparse.OptionParser(usage='%prog search [options]')
+    parser.add_option('--reports', type='int', default=50000,
+            help='Number of reports to search.')
+    parser.add_option('--term', default='7A3',
+            help='Part of a patient ID to search for.')
+    parser.add_option('--repeat', type='int', default=5,
+            help='Number of times to time each search.')
+    options, _ = parser.parse_args(args)
+
+    import random
+    from nutrition import search
+    from nutrition.models import Report
+
+    with test_database():
+        reports = [Report(patient_id='{0:08X}'.format(random.getrandbits(32)),
+                reporter_id='{0:06d}'.format(i % 500), global_patient_id='1')
+                for i in range(options.reports)]
+        Report.objects.bulk_create(reports, batch_size=500)
+        ids = Report.objects.values_list('pk', 'patient_id', 'reporter_id')
+        for start in range(0, options.reports, 1000):
+            search.index_reports(list(ids[start:start + 1000]), replace=False)
+        connection.cursor().execute('ANALYZE')
+
+        def scan():
+            return Report.objects.filter(
+                    patient_id__icontains=options.term).count()
+
+        def trigrams():
+            return search.filter_reports(Report.objects.all(), 'patient_id',
+                    options.term, search.CONTAINS).count()
+
+        for name, func in (('icontains', scan), ('trigrams', trigrams)):
+            elapsed = timed(func, options.repeat)
+            print('{0:10s}: {1} of {2} reports in {3:.2f} ms'.format(name,
+                    func(), options.reports, elapsed * 1000))
+
+
+def months(args):
+    """Month-scoped report queries on a multi-year table."""
+    parser = optparse.OptionParser(usage='%prog months [options]')
+    parser.add_option('--reports', type='int', default=200000,
+            help='Number of reports to create.')
+    parser.add_option('--years', type='int', default=5,
+            help='Number of years the reports span.')
+    parser.add_option('--repeat', type='int', default=5,
+            help='Number of times to time each query.')
+    options, _ = parser.parse_args(args)
+
+    import datetime
+    from nutrition.models import Report
+
+    start = datetime.datetime(2013, 1, 1)
+    step = datetime.timedelta(days=365.25 * options.years) / options.reports
+
+    def ranged():
+        # Bounds on created, which can use its index.
+        return Report.objects.created_between(datetime.date(2015, 6, 1),
+                datetime.date(2015, 6, 30))
+
+    def extracted():
+        # Functions of created, which must be computed for every report.
+        return Report.objects.filter(created__year=2015, created__month=6)
+
+    with test_database():
+        field = Report._meta.get_field('created')
+        field.auto_now_add = False  # Spread the reports over the years.
+        try:
+            for first in range(0, options.reports, 10000):
+                last = min(first + 10000, options.reports)
+                Report.objects.bulk_create([Report(patient_id='1',
+                        global_patient_id='1', created=start + step * i)
+                        for i in range(first, last)], batch_size=500)
+        finally:
+            field.auto_now_add = True
+        connection.cursor().execute('ANALYZE')
+        for name, reports in (('range', ranged), ('year/month', extracted)):
+            def query():
+                queryset = reports()
+                page = list(queryset.order_by('-created')[:20])
+                return queryset.count(), page
+            elapsed = timed(query, options.repeat)
+            print('{0:10s}: {1} of {2} reports in {3:.2f} ms'.format(name,
+                    query()[0], options.reports, elapsed * 1000))
+
+
+def storage(args):
+    """Loading and summing Decimal vs. fixed-point measurement columns."""
+    parser = optparse.OptionParser(usage='%prog storage [options]')
+    parser.add_option('--rows', type='int', default=20000,
+            help='Number of rows of measurements.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each operation.')
+    options, _ = parser.parse_args(args)
+
+    import random
+    from decimal import Decimal
+    from django.db import models
+    from nutrition.fields import FixedPointField
+
+    names = ('height', 'weight', 'muac', 'weight4age', 'height4age',
+            'weight4height')
+
+    def measurements(name, field_class):
+        attrs = {'__module__': __name__, 'Meta': type(str('Meta'), (),
+                {'app_label': 'nutrition'})}
+        for field in names:
+            places = 2 if '4' in field else 1
+            attrs[field] = field_class(max_digits=4, decimal_places=places,
+                    null=True)
+        return type(str(name), (models.Model,), attrs)
+
+    # Defined before the test database is created, so that it has tables.
+    classes = [measurements('DecimalMeasurements', models.DecimalField),
+            measurements('FixedMeasurements', FixedPointField)]
+
+    with test_database():
+        rows = [dict((field, Decimal(random.randint(-300, 999)).scaleb(-2
+                if '4' in field else -1)) for field in names)
+                for i in range(options.rows)]
+        for model in classes:
+            def bulk_create():
+                model.objects.all().delete()
+                model.objects.bulk_create([model(**row) for row in rows],
+                        batch_size=150)
+
+            def load():
+                return [obj.weight for obj in model.objects.all()]
+
+            def aggregate():
+                return model.objects.aggregate(*[models.Avg(field)
+                        for field in names])
+
+            def python_sum():
+                return [sum(v for v in column if v is not None)
+                        for column in zip(*model.objects.values_list(*names))]
+
+            print(model.__name__)
+            for name, func in (('bulk create', bulk_create), ('load', load),
+                    ('aggregate', aggregate), ('python sum', python_sum)):
+                print('  {0:12s}: {1:.1f} ms'.format(name,
+                        timed(func, options.repeat) * 1000))
+
+
+def suggestions(args):
+    """Suggesting a patient ID with the deletion index vs. a linear scan."""
+    parser = optparse.OptionParser(usage='%prog suggestions [options]')
+    parser.add_option('--patients', type='int', default=100000,
+            help='Number of patient IDs to index.')
+    parser.add_option('--queries', type='int', default=1000,
+            help='Number of mistyped IDs to look up.')
+    options, _ = parser.parse_args(args)
+
+    import random
+    import string
+    from nutrition.suggestions import PatientIdIndex, one_edit_apart
+
+    alphabet = string.ascii_uppercase + string.digits
+    ids = list(set(''.join(random.choice(alphabet) for i in range(8))
+            for j in range(options.patients)))
+    typos = []
+    for patient_id in random.sample(ids, min(options.queries, len(ids))):
+        i = random.randrange(len(patient_id))
+        typos.append(patient_id[:i] + random.choice(alphabet) +
+                patient_id[i + 1:])
+
+    with test_database():
+        index = PatientIdIndex()
+        start = time.time()
+        for patient_id in ids:
+            index.add(patient_id)
+        index.refresh(force=True)
+        print('build: {0} IDs in {1:.2f} s'.format(len(ids),
+                time.time() - start))
+
+        def indexed():
+            return [index.suggest(typo) for typo in typos]
+
+        def scan():
+            return [[c for c in ids if one_edit_apart(typo, c)]
+                    for typo in typos[:10]]
+
+        print('index: {0:.3f} ms per ID'.format(
+                timed(indexed, 1) * 1000 / len(typos)))
+        print('scan:  {0:.3f} ms per ID'.format(
+                timed(scan, 1) * 1000 / min(10, len(typos))))
+
+
+def surveys(args):
+    """Loading and summarizing z-scores for survey statistics."""
+    parser = optparse.OptionParser(usage='%prog surveys [options]')
+    parser.add_option('--reports', type='int', default=100000,
+            help='Number of reports to summarize.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each operation.')
+    options, _ = parser.parse_args(args)
+
+    import random
+    from decimal import Decimal
+    from nutrition import surveys
+    from nutrition.models import Report
+
+    def zscore():
+        return Decimal(random.randint(-400, 300)).scaleb(-2)
+
+    with test_database():
+        Report.objects.bulk_create([Report(patient_id='p', weight4age=zscore(),
+                height4age=zscore(), weight4height=zscore())
+                for i in range(options.reports)], batch_size=150)
+        queryset = Report.objects.all()
+        sample = surveys.load_sample(queryset)
+        print('{0} reports'.format(len(sample)))
+        print('  load:      {0:.1f} ms'.format(timed(
+                lambda: surveys.load_sample(queryset), options.repeat) * 1000))
+        print('  summarize: {0:.1f} ms'.format(timed(
+                lambda: surveys.summarize(sample), options.repeat) * 1000))
+
+
+
+def quality(args):
+    """Data quality checks of measurements and z-scores, by reporter."""
+    parser = optparse.OptionParser(usage='%prog quality [options]')
+    parser.add_option('--reports', type='int', default=100000,
+            help='Number of reports to check.')
+    parser.add_option('--reporters', type='int', default=100,
+            help='Number of reporters.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each operation.')
+    options, _ = parser.parse_args(args)
+
+    import random
+    from decimal import Decimal
+    from nutrition import quality
+    from nutrition.models import Report
+
+    def value(low, high, exponent):
+        return Decimal(random.randint(low, high)).scaleb(exponent)
+
+    with test_database():
+        Report.objects.bulk_create([Report(patient_id='p',
+                reporter_id=str(i % options.reporters),
+                height=value(500, 1100, -1), weight=value(30, 250, -1),
+                muac=value(90, 180, -1), weight4age=value(-400, 300, -2),
+                height4age=value(-400, 300, -2),
+                weight4height=value(-400, 300, -2))
+                for i in range(options.reports)], batch_size=100)
+        queryset = Report.objects.all()
+        for count in (options.reports // 2, options.reports):
+            reports = queryset.filter(pk__lte=count)
+            print('{0} reports: {1:.1f} ms'.format(count, timed(
+                    lambda: quality.check_quality(reports),
+                    options.repeat) * 1000))
+
+
+def columns(args):
+    """Loading numeric columns from CSV vs. columnar exports."""
+    parser = optparse.OptionParser(usage='%prog columns [options]')
+    parser.add_option('--reports', type='int', default=20000,
+            help='Number of reports to export.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each export.')
+    options, _ = parser.parse_args(args)
+
+    import csv
+    import io
+    import numpy
+    from nutrition import columnar
+    from nutrition.exports import ReportRows
+    from nutrition.models import Report
+    from nutrition.unicsv import UnicodeCSVWriter
+
+    def load_csv():
+        output = io.BytesIO()
+        UnicodeCSVWriter(output).writerows(ReportRows(Report.objects.all()))
+        output.seek(0)
+        rows = csv.reader(output)
+        headers = next(rows)
+        index = headers.index('Weight')
+        return numpy.array([float(row[index]) if row[index] else numpy.nan
+                for row in rows])
+
+    def load_columns(format):
+        data = b''.join(columnar.export(Report.objects.all(), format))
+        if format == 'npz':
+            return numpy.load(io.BytesIO(data))['weight']
+        import pyarrow.parquet
+        reader = pyarrow.BufferReader(data)
+        if format == 'parquet':
+            table = pyarrow.parquet.read_table(reader)
+        else:
+            table = pyarrow.ipc.open_stream(reader).read_all()
+        return numpy.concatenate([chunk.to_numpy(zero_copy_only=False)
+                for chunk in table.column('weight').chunks])
+
+    with test_database():
+        Report.objects.bulk_create([Report(patient_id='p', height=90,
+                weight=12, muac=13, weight4age=0, height4age=0,
+                weight4height=0, status=Report.ANALYZED)
+                for i in range(options.reports)], batch_size=100)
+        loaders = [('csv', load_csv)] + [(format,
+                lambda format=format: load_columns(format))
+                for format in columnar.get_formats()]
+        for name, func in loaders:
+            elapsed = timed(func, options.repeat)
+            print('{0:8s}: {1} reports in {2:.3f} s ({3:.1f} us/report)'
+                    .format(name, options.reports, elapsed,
+                    elapsed * 1e6 / options.reports))
+
+
+def gzip(args):
+    """Size and speed of gzip-compressed CSV exports by level."""
+    parser = optparse.OptionParser(usage='%prog gzip [options]')
+    parser.add_option('--reports', type='int', default=20000,
+            help='Number of reports to export.')
+    parser.add_option('--repeat', type='int', default=3,
+            help='Number of times to time each export.')
+    options, _ = parser.parse_args(args)
+
+    from nutrition import exports
+    from nutrition.models import Report
+
+    def export(level=None):
+        chunks = exports.stream_csv(exports.ReportRows(Report.objects.all()))
+        if level:
+            chunks = exports.gzip_stream(chunks, level)
+        start = time.time()
+        first = None
+        size = 0
+        for chunk in chunks:
+            if first is None:
+                first = time.time() - start
+            size += len(chunk)
+        return size, first
+
+    with test_database():
+        Report.objects.bulk_create([Report(patient_id=str(i % 500),
+                reporter_id=str(i % 50), height=90, weight=12, muac=13,
+                weight4age=0, height4age=0, weight4height=0,
+                status=Report.ANALYZED)
+                for i in range(options.reports)], batch_size=100)
+        for level in (None, 1, 6, 9):
+            size, first = export(level)
+            elapsed = timed(lambda: export(level), options.repeat)
+            print('{0:5s}: {1:9d} bytes in {2:.3f} s (first bytes after '
+                    '{3:.1f} ms)'.format(str(level or 'none'), size, elapsed,
+                    first * 1000))
+
+BENCHMARKS = [lookups, exports, startup, search, months, storage,
+        suggestions, surveys, quality, columns, gzip]
+
+
+def main():
+    benchmarks = dict((func.__name__, func) for func in BENCHMARKS)
+    if len(sys.argv) < 2 or sys.argv[1] not in benchmarks:
+        print(__doc__.strip())
+        print('')
+        for func in BENCHMARKS:
+            print('  {0:12s} {1}'.format(func.__name__, func.__doc__))
+        sys.exit(1)
+    benchmarks[sys.argv[1]](sys.argv[2:])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+"""Load test the nutrition handlers through the RapidSMS router.
+
+Creates synthetic patients and reporters in the dummy healthcare backend,
+then sends NUTRITION REPORT and NUTRITION CANCEL messages through a
+BlockingRouter (and so through the real handlers app and handler stack),
+optionally from several threads. Handler latency percentiles, throughput
+and database query counts are printed when the run completes.
+
+Everything runs locally, against a temporary test database::
+
+    python loadtest.py --patients 200 --messages 2000 --threads 4
+"""
+import datetime
+import logging
+import optparse
+import random
+import threading
+import time
+
+import runtests  # Configures the test settings.
+
+from django.conf import settings
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+        teardown_test_environment)
+
+from rapidsms.apps.base import AppBase
+from rapidsms.contrib.handlers.app import App as HandlersApp
+from rapidsms.tests.harness import CreateDataMixin
+
+from nutrition.handlers import CancelReportHandler, CreateReportHandler
+from nutrition.tests.base import NutritionTestMixin, REPORTER_LOOKUP
+
+
+class LoadTestFixtures(CreateDataMixin, NutritionTestMixin):
+    """Reuses the test suite's helpers to create synthetic data."""
+
+
+class NutritionHandlersApp(HandlersApp):
+    """The RapidSMS handlers app, limited to the nutrition handlers.
+
+    Handler discovery in RapidSMS 0.12 expects every module in an app's
+    handlers package to define a handler, which nutrition.handlers.base does
+    not, so the handlers are registered explicitly.
+    """
+    name = 'nutrition'
+
+    def __init__(self, router):
+        AppBase.__init__(self, router)
+        self.handlers = [CreateReportHandler, CancelReportHandler]
+
+
+def percentile(values, pct):
+    """Returns the nearest-rank percentile of a sorted list."""
+    if not values:
+        return 0
+    index = int(round(pct / 100.0 * (len(values) - 1)))
+    return values[index]
+
+
+def build_messages(patient_ids, count, cancel_ratio):
+    """Returns a list of count random message texts."""
+    messages = []
+    for i in range(count):
+        patient_id = random.choice(patient_ids)
+        if random.random() < cancel_ratio:
+            text = 'nutrition cancel {0}'.format(patient_id)
+        else:
+            text = 'nutrition report {0} w {1:.1f} h {2:.1f} m {3:.1f} ' \
+                    'o {4}'.format(patient_id, random.uniform(10, 15),
+                    random.uniform(85, 95), random.uniform(13, 16),
+                    random.choice('YN'))
+        messages.append(text)
+    return messages
+
+
+def worker(router_kwargs, jobs, results, errors):
+    """Sends each (connection, text) job through a router of its own."""
+    from rapidsms.messages import IncomingMessage
+    from rapidsms.router.blocking import BlockingRouter
+
+    connection.use_debug_cursor = True
+    try:
+        router = BlockingRouter(**router_kwargs)
+        for conn, text in jobs:
+            del connection.queries[:]
+            msg = IncomingMessage(conn, text, datetime.datetime.now())
+            start = time.time()
+            router.receive_incoming(msg)
+            elapsed = time.time() - start
+            replies = [response.text for response in msg.responses]
+            success = bool(replies) and replies[0].startswith('Thanks')
+            results.append((elapsed, len(connection.queries), success))
+    except Exception as e:
+        errors.append(e)
+    finally:
+        connection.close()
+
+
+def run(options):
+    from rapidsms.models import Backend, Connection
+    from rapidsms.tests.harness.backend import MockBackend
+    from nutrition.reporters import reporters
+
+    fixtures = LoadTestFixtures()
+    fixtures.clear_healthcare_backends()
+    reporters.invalidate()
+    settings.NUTRITION_REPORTER_LOOKUP = REPORTER_LOOKUP
+
+    backend = Backend.objects.create(name='loadtest')
+    connections = []
+    for i in range(options.reporters):
+        phone = '555{0:07d}'.format(i)
+        fixtures.create_provider(phone=phone)
+        connections.append(Connection.objects.create(backend=backend,
+                identity=phone))
+    patient_ids = [fixtures.create_patient()[0]
+            for i in range(options.patients)]
+    messages = build_messages(patient_ids, options.messages,
+            options.cancel_ratio)
+    jobs = [(random.choice(connections), text) for text in messages]
+
+    # BlockingRouter reads INSTALLED_BACKENDS even if backends are given.
+    settings.INSTALLED_BACKENDS = {'loadtest': {'ENGINE': MockBackend}}
+    router_kwargs = {
+        'apps': [NutritionHandlersApp],
+        'backends': settings.INSTALLED_BACKENDS,
+    }
+    results, errors = [], []
+    threads = [threading.Thread(target=worker, args=(router_kwargs,
+            jobs[i::options.threads], results, errors))
+            for i in range(options.threads)]
+    start = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.time() - start
+    if errors:
+        raise errors[0]
+    return results, duration
+
+
+def report(results, duration, options):
+    latencies = sorted(elapsed * 1000 for elapsed, _, _ in results)
+    queries = [count for _, count, _ in results]
+    successes = len([success for _, _, success in results if success])
+    print('Sent {0} messages from {1} thread(s) in {2:.2f} s'.format(
+            len(results), options.threads, duration))
+    print('Throughput: {0:.1f} messages/s'.format(len(results) / duration))
+    print('Latency (ms): p50 {0:.1f}  p95 {1:.1f}  p99 {2:.1f}  '
+            'max {3:.1f}'.format(percentile(latencies, 50),
+            percentile(latencies, 95), percentile(latencies, 99),
+            latencies[-1] if latencies else 0))
+    print('Queries per message: mean {0:.1f}  max {1}'.format(
+            float(sum(queries)) / (len(queries) or 1), max(queries or [0])))
+    print('Replies: {0} successful, {1} other'.format(successes,
+            len(results) - successes))
+
+
+def main():
+    parser = optparse.OptionParser()
+    parser.add_option('--patients', type='int', default=100,
+            help='Number of synthetic patients to create.')
+    parser.add_option('--reporters', type='int', default=20,
+            help='Number of synthetic reporters (connections) to create.')
+    parser.add_option('--messages', type='int', default=1000,
+            help='Number of messages to send.')
+    parser.add_option('--threads', type='int', default=1,
+            help='Number of threads sending messages concurrently.')
+    parser.add_option('--cancel-ratio', type='float', default=0.1,
+            help='Fraction of messages which are NUTRITION CANCEL.')
+    parser.add_option('--seed', type='int', default=None,
+            help='Random seed, for repeatable runs.')
+    parser.add_option('-v', '--verbose', action='store_true', default=False,
+            help='Show handler log messages.')
+    options, _ = parser.parse_args()
+
+    random.seed(options.seed)
+    level = logging.DEBUG if options.verbose else logging.CRITICAL
+    logging.basicConfig(level=level)
+
+    setup_test_environment()
+    old_name = connection.creation.create_test_db(verbosity=0)
+    try:
+        results, duration = run(options)
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+    report(results, duration, options)
+
+
+if __name__ == '__main__':
+    main()
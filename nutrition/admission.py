@@ -0,0 +1,228 @@
+from __future__ import unicode_literals
+from collections import deque
+import logging
+import sys
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from rapidsms.messages import IncomingMessage
+
+
+__all__ = ['AdmissionController', 'get_controller', 'get_metrics']
+
+
+logger = logging.getLogger(__name__)
+
+
+class Job(object):
+
+    def __init__(self, handler, text, key, deferred):
+        self.handler = handler
+        self.text = text
+        self.key = key
+        self.deferred = deferred
+        self.queued = time.time()
+        self.done = threading.Event()
+        self.exc_info = None
+
+
+class AdmissionController(object):
+    """A bounded work queue for nutrition messages.
+
+    At most concurrency messages are handled at the same time, by worker
+    threads. Waiting messages are taken from each connection in turn, so
+    that a reporter who sends many messages at once does not hold up the
+    others, and each connection's messages are handled one at a time, in
+    the order they arrived.
+
+    The thread which submits a message normally waits for it to be handled,
+    so that replies are sent as usual. If defer_depth or more messages are
+    already waiting, the sender is told straight away that their message
+    was received, and the handler's replies are sent once it has been
+    handled. If queue_size messages are waiting, the message is turned away
+    with a reply asking the sender to try again later.
+    """
+    # Number of recent waits used for the wait time metrics.
+    window = 1000
+
+    def __init__(self, concurrency, queue_size=200, defer_depth=20):
+        self.config = (concurrency, queue_size, defer_depth)
+        self.concurrency = max(concurrency, 1)
+        self.queue_size = queue_size
+        self.defer_depth = defer_depth
+        self._condition = threading.Condition()
+        self._queues = {}  # Waiting jobs of each connection.
+        self._ready = deque()  # Connections whose next job may start.
+        self._active = set()  # Connections with a job being handled.
+        self._depth = 0
+        self._waits = deque(maxlen=self.window)
+        self._counts = {'admitted': 0, 'deferred': 0, 'rejected': 0}
+        self._threads = []
+        self._stopped = False
+
+    def submit(self, handler, text):
+        """Handles a message with handler.handle_now(text), in turn."""
+        key = self.get_key(handler.msg)
+        original = handler.msg
+        with self._condition:
+            if self._depth >= self.queue_size:
+                self._counts['rejected'] += 1
+                job = None
+            else:
+                deferred = self._depth >= self.defer_depth
+                if deferred:
+                    self._counts['deferred'] += 1
+                    # The router sends the original message's replies
+                    # straight away, so the handler gets a copy whose
+                    # replies are sent once it has run.
+                    handler.msg = IncomingMessage(
+                            connection=original.connection,
+                            text=original.text,
+                            received_at=original.received_at,
+                            sent_at=original.sent_at, fields=original.fields)
+                job = Job(handler, text, key, deferred)
+                self._enqueue(job)
+        if job is None:
+            logger.warning('Rejected a message from {0}; {1} messages are '
+                    'waiting.'.format(original.connection, self.queue_size))
+            original.respond(handler._message('busy'))
+            return
+        if job.deferred:
+            logger.info('Deferred a message from {0}.'.format(
+                    original.connection))
+            original.respond(handler._message('received'))
+            return
+        job.done.wait()
+        if job.exc_info:
+            raise job.exc_info[0], job.exc_info[1], job.exc_info[2]
+
+    def get_key(self, msg):
+        connection = msg.connection
+        return getattr(connection, 'pk', None) or id(connection)
+
+    def metrics(self):
+        """Returns the current queue depth and recent wait times.
+
+        Wait times, in seconds, are those of the last window messages to
+        start being handled.
+        """
+        with self._condition:
+            waits = list(self._waits)
+            metrics = dict(self._counts)
+            metrics.update({
+                'depth': self._depth,
+                'active': len(self._active),
+                'wait_mean': sum(waits) / len(waits) if waits else 0,
+                'wait_max': max(waits) if waits else 0,
+            })
+        return metrics
+
+    def stop(self):
+        """Stops the worker threads once the waiting messages are handled."""
+        with self._condition:
+            self._stopped = True
+            self._condition.notify_all()
+        for thread in self._threads:
+            thread.join()
+
+    def _enqueue(self, job):
+        # Called with the condition held.
+        if job.key not in self._queues:
+            self._queues[job.key] = deque()
+            if job.key not in self._active:
+                self._ready.append(job.key)
+        self._queues[job.key].append(job)
+        self._depth += 1
+        self._counts['admitted'] += 1
+        if len(self._threads) < self.concurrency:
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+        self._condition.notify()
+
+    def _next(self):
+        """Returns the next job to handle, or None once stopped."""
+        with self._condition:
+            while not self._ready:
+                if self._stopped:
+                    return None
+                self._condition.wait()
+            key = self._ready.popleft()
+            job = self._queues[key].popleft()
+            if not self._queues[key]:
+                del self._queues[key]
+            self._active.add(key)
+            self._depth -= 1
+            self._waits.append(time.time() - job.queued)
+            return job
+
+    def _finish(self, job):
+        with self._condition:
+            self._active.discard(job.key)
+            if job.key in self._queues:
+                self._ready.append(job.key)
+                self._condition.notify()
+        job.done.set()
+
+    def _work(self):
+        # Each thread opens its own database connection, which is kept for
+        # its jobs and closed when the thread exits.
+        try:
+            while True:
+                job = self._next()
+                if job is None:
+                    return
+                try:
+                    job.handler.handle_now(job.text)
+                    if job.deferred:
+                        job.handler.msg.flush_responses()
+                    # End the transaction begun by any reads, as a request
+                    # would.
+                    transaction.commit_unless_managed()
+                except Exception:
+                    logger.exception('An error occurred while handling a '
+                            'queued message')
+                    job.exc_info = sys.exc_info()
+                    # The connection may be broken or in a failed
+                    # transaction, so the next job opens a new one.
+                    connection.close()
+                finally:
+                    self._finish(job)
+        finally:
+            connection.close()
+
+
+_controller = None
+_lock = threading.Lock()
+
+
+def get_controller():
+    """Returns the AdmissionController configured by the settings.
+
+    Returns None if NUTRITION_ADMISSION_CONCURRENCY is not set, in which
+    case messages are handled as soon as they arrive.
+    """
+    global _controller
+    config = (
+        getattr(settings, 'NUTRITION_ADMISSION_CONCURRENCY', 0),
+        getattr(settings, 'NUTRITION_ADMISSION_QUEUE_SIZE', 200),
+        getattr(settings, 'NUTRITION_ADMISSION_DEFER_DEPTH', 20),
+    )
+    with _lock:
+        if _controller is not None and (_controller.config != config or
+                _controller._stopped):
+            _controller.stop()
+            _controller = None
+        if _controller is None and config[0]:
+            _controller = AdmissionController(*config)
+        return _controller
+
+
+def get_metrics():
+    """Returns the metrics of this process's queue, if it has one."""
+    controller = get_controller()
+    return controller.metrics() if controller else {}
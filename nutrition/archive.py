@@ -0,0 +1,97 @@
+from __future__ import unicode_literals
+import datetime
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils.timezone import now
+
+from nutrition import search
+from nutrition.models import ArchivedReport, Report
+
+
+__all__ = ['get_archivable', 'archive_reports', 'restore_reports']
+
+
+logger = logging.getLogger(__name__)
+
+
+# Fields which are copied between Report and ArchivedReport. Attribute
+# names are used so that values are copied as they are stored.
+FIELDS = [f.attname for f in Report._meta.fields]
+
+
+def get_archivable(age=None):
+    """Returns the reports which should be archived.
+
+    Cancelled reports are always archived. Reports created more than age
+    days ago (by default, NUTRITION_ARCHIVE_AFTER_DAYS) are archived too.
+    """
+    if age is None:
+        age = getattr(settings, 'NUTRITION_ARCHIVE_AFTER_DAYS', None)
+    archivable = Q(active=False)
+    if age is not None:
+        cutoff = now() - datetime.timedelta(days=age)
+        archivable |= Q(created__lt=cutoff)
+    return Report.objects.filter(archivable)
+
+
+def archive_reports(reports=None, batch_size=500, pause=0):
+    """Moves reports into the ArchivedReport table.
+
+    reports defaults to get_archivable(). Reports are moved batch_size at a
+    time, each batch in its own short transaction, so that new reports can
+    be created in between; pause is the number of seconds to wait between
+    batches. Returns the number of reports archived.
+    """
+    reports = get_archivable() if reports is None else reports
+    reports = reports.order_by('pk')
+    count = 0
+    while True:
+        with transaction.commit_on_success(using=reports.db):
+            batch = list(reports.select_for_update().values(*FIELDS)[
+                    :batch_size])
+            if not batch:
+                break
+            archived = now()
+            ArchivedReport.objects.using(reports.db).bulk_create([
+                    ArchivedReport(archived=archived, **values)
+                    for values in batch])
+            pks = [values['id'] for values in batch]
+            Report.objects.using(reports.db).filter(pk__in=pks).delete()
+        count += len(batch)
+        logger.debug('Archived {0} report(s).'.format(count))
+        if pause:
+            time.sleep(pause)
+    return count
+
+
+def restore_reports(archived_reports, batch_size=500):
+    """Moves archived reports back into the Report table.
+
+    Reports keep their original primary keys and timestamps. Returns the
+    number of reports restored.
+    """
+    archived_reports = archived_reports.order_by('pk')
+    count = 0
+    while True:
+        with transaction.commit_on_success(using=archived_reports.db):
+            batch = list(archived_reports.values(*FIELDS)[:batch_size])
+            if not batch:
+                break
+            for values in batch:
+                # Raw saves keep the original created and updated times.
+                report = Report(**values)
+                report.save_base(raw=True, force_insert=True,
+                        using=archived_reports.db)
+            if not search.use_trigram_indexes(archived_reports.db):
+                search.index_reports([(values['id'], values['patient_id'],
+                        values['reporter_id']) for values in batch],
+                        replace=False)
+            pks = [values['id'] for values in batch]
+            ArchivedReport.objects.using(archived_reports.db).filter(
+                    pk__in=pks).delete()
+        count += len(batch)
+    return count
@@ -0,0 +1,84 @@
+from __future__ import unicode_literals
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils.translation import ugettext_lazy as _
+
+
+__all__ = ['SEVERE', 'MODERATE', 'NORMAL', 'CLASSIFICATIONS',
+        'WASTING_CLASSIFICATIONS', 'get_cutoffs', 'classify_wasting',
+        'classify_zscore']
+
+
+SEVERE = 'S'
+MODERATE = 'M'
+NORMAL = 'N'
+CLASSIFICATIONS = [
+    (SEVERE, _('Severe')),
+    (MODERATE, _('Moderate')),
+    (NORMAL, _('Normal')),
+]
+# Wasting is better known as acute malnutrition.
+WASTING_CLASSIFICATIONS = [
+    (SEVERE, _('Severe (SAM)')),
+    (MODERATE, _('Moderate (MAM)')),
+    (NORMAL, _('Normal')),
+]
+
+DEFAULT_CUTOFFS = {
+    'severe_zscore': Decimal('-3'),
+    'moderate_zscore': Decimal('-2'),
+    'severe_muac': Decimal('11.5'),
+    'moderate_muac': Decimal('12.5'),
+}
+
+
+def get_cutoffs():
+    """Returns the classification cutoffs.
+
+    Z-scores and MUAC measurements (in cm) below a cutoff are classified
+    as severe or moderate. Projects may override any of DEFAULT_CUTOFFS
+    with NUTRITION_CLASSIFICATION_CUTOFFS.
+    """
+    cutoffs = DEFAULT_CUTOFFS.copy()
+    overrides = getattr(settings, 'NUTRITION_CLASSIFICATION_CUTOFFS', {})
+    cutoffs.update((k, Decimal(str(v))) for k, v in overrides.items())
+    return cutoffs
+
+
+def classify_zscore(zscore, cutoffs=None):
+    """Classifies stunting (height for age) or underweight (weight for age).
+
+    Returns None if zscore is None.
+    """
+    if zscore is None:
+        return None
+    cutoffs = cutoffs or get_cutoffs()
+    if zscore < cutoffs['severe_zscore']:
+        return SEVERE
+    if zscore < cutoffs['moderate_zscore']:
+        return MODERATE
+    return NORMAL
+
+
+def classify_wasting(weight4height, muac, oedema, cutoffs=None):
+    """Classifies acute malnutrition.
+
+    Severe acute malnutrition (SAM) is a weight for height z-score or a
+    MUAC below the severe cutoffs, or oedema. Moderate acute malnutrition
+    (MAM) is either measurement below the moderate cutoffs. Returns None if
+    neither measurement is known and there is no oedema.
+    """
+    cutoffs = cutoffs or get_cutoffs()
+    if (oedema or
+            (weight4height is not None and
+                weight4height < cutoffs['severe_zscore']) or
+            (muac is not None and muac < cutoffs['severe_muac'])):
+        return SEVERE
+    if ((weight4height is not None and
+                weight4height < cutoffs['moderate_zscore']) or
+            (muac is not None and muac < cutoffs['moderate_muac'])):
+        return MODERATE
+    if weight4height is None and muac is None:
+        return None
+    return NORMAL
@@ -0,0 +1,321 @@
+from __future__ import unicode_literals
+from contextlib import closing
+from itertools import islice
+import json
+import os
+import shutil
+import tempfile
+import zipfile
+
+import numpy
+from numpy.lib import format as npy_format
+
+from django.conf import settings
+from django.db.models.query import EmptyQuerySet
+from django.utils import timezone
+from django.utils.datastructures import SortedDict
+
+from nutrition.exports import ReportRecords
+from nutrition.models import Report
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+
+__all__ = ['FORMATS', 'ReportColumns', 'export', 'get_formats',
+        'get_row_group_size']
+
+
+# Format: (file extension, content type, whether pyarrow is required).
+FORMATS = SortedDict([
+    ('parquet', ('parquet', 'application/octet-stream', True)),
+    ('arrow', ('arrows', 'application/vnd.apache.arrow.stream', True)),
+    ('npz', ('npz', 'application/octet-stream', False)),
+])
+
+FLOAT_COLUMNS = ('height', 'weight', 'muac', 'weight4age', 'height4age',
+        'weight4height', 'age')
+DATETIME_COLUMNS = ('created', 'updated')
+BOOLEAN_COLUMNS = ('oedema', 'active')
+
+# Size of the blocks in which a finished file is sent.
+BLOCK_SIZE = 64 * 1024
+
+
+def get_formats():
+    """Returns the names of the formats which can be written, best first."""
+    return [name for name, (_, _, needs_arrow) in FORMATS.items()
+            if pyarrow is not None or not needs_arrow]
+
+
+def get_row_group_size(size=None):
+    """Returns the number of reports to read and write at a time."""
+    if size is None:
+        size = getattr(settings, 'NUTRITION_EXPORT_ROW_GROUP_SIZE', 10000)
+    return max(size, 1)
+
+
+def get_kind(name):
+    if name == 'id':
+        return 'int'
+    if name in FLOAT_COLUMNS:
+        return 'float'
+    if name in DATETIME_COLUMNS:
+        return 'datetime'
+    if name in BOOLEAN_COLUMNS:
+        return 'bool'
+    return 'string'
+
+
+class ReportColumns(ReportRecords):
+    """Iterates over the reports of a queryset in chunks of typed columns.
+
+    Each chunk maps the name of every field of ReportRecords to a NumPy
+    masked array of the values of up to row_group_size reports, ordered by
+    primary key; unknown values are masked. Measurements, z-scores and age
+    (in months) are floats, created and updated are UTC datetime64 values,
+    oedema and active are booleans and anything else, including choices,
+    which are left as codes, is a string. Reports are read with a single
+    streaming query, and patient records are retrieved for one chunk at a
+    time.
+    """
+
+    def __init__(self, queryset, row_group_size=None):
+        super(ReportColumns, self).__init__(queryset,
+                fields=self.fields + self.patient_fields)
+        self.row_group_size = get_row_group_size(row_group_size)
+
+    def __iter__(self):
+        if isinstance(self.queryset, EmptyQuerySet):
+            # Django 1.4's EmptyQuerySet.values_list() returns every row.
+            return
+        columns = list(self.fields)
+        getters = [(name, self.get_getter(name, columns))
+                for name in self.names]
+        patient_index = columns.index('global_patient_id')
+        values_list = self.queryset.order_by('pk').values_list(*columns)
+        rows = values_list.iterator()
+        while True:
+            chunk = list(islice(rows, self.row_group_size))
+            if not chunk:
+                return
+            yield self.get_columns(chunk, getters, patient_index)
+
+    def get_columns(self, chunk, getters, patient_index):
+        records = Report.get_patients([values[patient_index]
+                for values in chunk])
+        patients = [records.get(values[patient_index]) for values in chunk]
+        return SortedDict([(name, to_array(name, [getter(values, patient)
+                for values, patient in zip(chunk, patients)]))
+                for name, getter in getters])
+
+
+def to_array(name, values):
+    """Returns a column's values as a masked array of the column's type."""
+    mask = numpy.array([value is None for value in values], dtype=bool)
+    kind = get_kind(name)
+    if kind == 'int':
+        data = numpy.array(values, dtype=numpy.int64)
+    elif kind == 'float':
+        data = numpy.array([float('nan') if value is None else float(value)
+                for value in values], dtype=numpy.float64)
+    elif kind == 'datetime':
+        data = numpy.array([_utc(value) for value in values],
+                dtype='datetime64[us]')
+    elif kind == 'bool':
+        data = numpy.array([bool(value) for value in values], dtype=bool)
+    else:
+        data = numpy.array(['' if value is None else unicode(value)
+                for value in values], dtype=numpy.unicode_)
+    return numpy.ma.array(data, mask=mask)
+
+
+def _utc(value):
+    if value is not None and timezone.is_aware(value):
+        value = timezone.make_naive(value, timezone.utc)
+    return value
+
+
+def export(queryset, format, row_group_size=None):
+    """Returns an iterator over the bytes of the reports in a format.
+
+    Raises ValueError if the format is unknown or cannot be written. The
+    Parquet and Arrow IPC stream formats, which require pyarrow, are
+    written one row group (or record batch) at a time, and each group's
+    bytes are yielded as soon as it is written. NumPy's .npz format needs
+    the length of each column before its values, so columns are spooled to
+    temporary files and the archive is yielded once it is complete.
+    """
+    if format not in get_formats():
+        raise ValueError('Unknown or unavailable format: {0}.'.format(
+                format))
+    chunks = ReportColumns(queryset, row_group_size)
+    if format == 'npz':
+        return _write_npz(chunks)
+    return _write_arrow(chunks, parquet=format == 'parquet')
+
+
+class _Sink(object):
+    """A write-only file which holds what is written until it is read."""
+    closed = False
+
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.position += len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def read(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+def _arrow_schema(names):
+    types = {
+        'int': pyarrow.int64(),
+        'float': pyarrow.float64(),
+        'datetime': pyarrow.timestamp('us', tz='UTC'),
+        'bool': pyarrow.bool_(),
+        'string': pyarrow.string(),
+    }
+    return pyarrow.schema([pyarrow.field(name, types[get_kind(name)])
+            for name in names])
+
+
+def _arrow_batch(chunk, schema):
+    arrays = []
+    for field in schema:
+        column = chunk[field.name]
+        mask = numpy.ma.getmaskarray(column)
+        if get_kind(field.name) == 'string':
+            values = [None if masked else value
+                    for value, masked in zip(column.data.tolist(), mask)]
+            arrays.append(pyarrow.array(values, type=field.type))
+        else:
+            arrays.append(pyarrow.array(column.data, mask=mask,
+                    type=field.type))
+    return pyarrow.RecordBatch.from_arrays(arrays, schema.names)
+
+
+def _write_arrow(chunks, parquet=False):
+    sink = _Sink()
+    schema = _arrow_schema(chunks.names)
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.RecordBatchStreamWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            batch = _arrow_batch(chunk, schema)
+            if parquet:
+                writer.write_table(pyarrow.Table.from_batches([batch]))
+            else:
+                writer.write_batch(batch)
+            data = sink.read()
+            if data:
+                yield data
+    finally:
+        writer.close()
+    yield sink.read()
+
+
+class _Spool(object):
+    """Appends the chunks of a column to a file, then writes a .npy file.
+
+    Oedema, which may be unknown, is stored as a float (1, 0 or NaN). The
+    width of a string column is that of its longest value, which is only
+    known once every chunk has been read, so strings are spooled as JSON.
+    """
+
+    def __init__(self, path, name):
+        self.path = path
+        self.count = 0
+        self.kind = get_kind(name)
+        if self.kind == 'bool' and Report._meta.get_field(name).null:
+            self.kind = 'float'
+        self.dtype = {
+            'int': numpy.dtype(numpy.int64),
+            'float': numpy.dtype(numpy.float64),
+            'datetime': numpy.dtype('datetime64[us]'),
+            'bool': numpy.dtype(bool),
+        }.get(self.kind)
+        self.width = 1
+        self.file = open(path + '.data', 'wb')
+
+    def append(self, column):
+        self.count += len(column)
+        if self.kind == 'string':
+            self.width = max(self.width, column.dtype.itemsize // 4)
+            self.file.write(json.dumps(column.data.tolist()).encode('utf-8'))
+            self.file.write(b'\n')
+            return
+        data = column.data.astype(self.dtype)
+        if self.kind == 'float':
+            data[numpy.ma.getmaskarray(column)] = numpy.nan
+        self.file.write(data.tobytes())
+
+    def finish(self):
+        """Writes the .npy file and returns its path."""
+        self.file.close()
+        dtype = self.dtype
+        if dtype is None:
+            dtype = numpy.dtype((numpy.unicode_, self.width))
+        path = self.path + '.npy'
+        with open(path, 'wb') as out:
+            npy_format.write_array_header_1_0(out, {
+                'descr': npy_format.dtype_to_descr(dtype),
+                'fortran_order': False,
+                'shape': (self.count,),
+            })
+            with open(self.path + '.data', 'rb') as data:
+                if self.kind == 'string':
+                    for line in data:
+                        values = json.loads(line.decode('utf-8'))
+                        out.write(numpy.array(values, dtype=dtype).tobytes())
+                else:
+                    shutil.copyfileobj(data, out)
+        os.remove(self.path + '.data')
+        return path
+
+
+def _write_npz(chunks):
+    directory = tempfile.mkdtemp(prefix='nutrition-')
+    spools = SortedDict()
+    try:
+        for i, name in enumerate(chunks.names):
+            spools[name] = _Spool(os.path.join(directory, str(i)), name)
+        for chunk in chunks:
+            for name, column in chunk.items():
+                spools[name].append(column)
+        path = os.path.join(directory, 'reports.npz')
+        with closing(zipfile.ZipFile(path, 'w', zipfile.ZIP_STORED,
+                allowZip64=True)) as archive:
+            for name, spool in spools.items():
+                npy = spool.finish()
+                archive.write(npy, str('{0}.npy'.format(name)))
+                os.remove(npy)
+        with open(path, 'rb') as f:
+            while True:
+                block = f.read(BLOCK_SIZE)
+                if not block:
+                    break
+                yield block
+    finally:
+        for spool in spools.values():
+            spool.file.close()
+        shutil.rmtree(directory, ignore_errors=True)
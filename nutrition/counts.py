@@ -0,0 +1,139 @@
+from __future__ import unicode_literals
+import hashlib
+import logging
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import DatabaseError, connections
+
+
+__all__ = ['CountedPaginator', 'ReportCounts', 'report_counts']
+
+
+logger = logging.getLogger(__name__)
+
+
+class CountedPaginator(Paginator):
+    """A paginator which may be given the number of objects in advance."""
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super(CountedPaginator, self).__init__(object_list, per_page,
+                **kwargs)
+        self._count = count
+
+
+class ReportCounts(object):
+    """Cache of the number of reports which match each set of filters.
+
+    Counts are stored in the default cache, keyed by the normalized filters
+    and a version which is bumped whenever a report is created or deleted,
+    or a report's filtered fields change. For multiple processes to see
+    each other's changes, the cache backend must be shared between them;
+    otherwise counts may be stale for up to NUTRITION_COUNT_CACHE_TIMEOUT
+    seconds.
+
+    Unfiltered counts are estimated from database statistics when the
+    estimate is at least NUTRITION_COUNT_ESTIMATE_THRESHOLD.
+    """
+    key_prefix = 'nutrition-report-count'
+    # Changes to these fields may change which filters a report matches.
+    filtered_fields = ('patient_id', 'reporter_id', 'status', 'wasting',
+            'stunting', 'underweight', 'active')
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'NUTRITION_COUNT_CACHE_TIMEOUT', 300)
+
+    @property
+    def estimate_threshold(self):
+        return getattr(settings, 'NUTRITION_COUNT_ESTIMATE_THRESHOLD', 100000)
+
+    @property
+    def version(self):
+        key = '{0}-version'.format(self.key_prefix)
+        version = cache.get(key)
+        if version is None:
+            # Start from the time, so that versions are not reused if the
+            # version itself is evicted from the cache.
+            version = int(time.time() * 1000)
+            cache.add(key, version, 60 * 60 * 24 * 30)
+            version = cache.get(key, version)
+        return version
+
+    def invalidate(self):
+        """Discards all cached counts."""
+        key = '{0}-version'.format(self.key_prefix)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, int(time.time() * 1000), 60 * 60 * 24 * 30)
+
+    def get(self, queryset, filters):
+        """Returns (count, estimated) for queryset, filtered by filters.
+
+        filters is a list of (name, value) pairs which uniquely identifies
+        the queryset. If estimated is True, count is an estimate.
+        """
+        if not filters:
+            estimate = self.estimate(queryset.model, queryset.db)
+            if estimate is not None and estimate >= self.estimate_threshold:
+                return estimate, True
+        key = repr(sorted(filters)).encode('utf-8')
+        key = '{0}-{1}-{2}'.format(self.key_prefix, self.version,
+                hashlib.md5(key).hexdigest())
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, self.timeout)
+        return count, False
+
+    def estimate(self, model, using='default'):
+        """Returns the database's estimate of the number of rows in
+        model's table, or None if no estimate is available.
+        """
+        connection = connections[using]
+        table = model._meta.db_table
+        if connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples FROM pg_class WHERE relname = %s'
+        elif connection.vendor == 'mysql':
+            sql = 'SELECT table_rows FROM information_schema.tables ' \
+                    'WHERE table_schema = DATABASE() AND table_name = %s'
+        elif connection.vendor == 'sqlite':
+            # sqlite_stat1 only exists once ANALYZE has been run.
+            sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s'
+        else:
+            return None
+        try:
+            cursor = connection.cursor()
+            cursor.execute(sql, [table])
+            row = cursor.fetchone()
+        except DatabaseError:
+            logger.debug('No row estimate is available for {0}.'.format(
+                    table))
+            return None
+        if not row or row[0] is None:
+            return None
+        # SQLite statistics begin with the number of rows.
+        return int(float(unicode(row[0]).split()[0]))
+
+    def report_initialized(self, sender, instance, **kwargs):
+        instance._counted = self._get_filtered(instance)
+
+    def report_saved(self, sender, instance, created, **kwargs):
+        filtered = self._get_filtered(instance)
+        if created or filtered != getattr(instance, '_counted', None):
+            self.invalidate()
+        instance._counted = filtered
+
+    def report_deleted(self, sender, instance, **kwargs):
+        self.invalidate()
+
+    def _get_filtered(self, instance):
+        # Deferred fields are not loaded.
+        return tuple([instance.__dict__.get(name)
+                for name in self.filtered_fields])
+
+
+report_counts = ReportCounts()
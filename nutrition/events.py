@@ -0,0 +1,122 @@
+from __future__ import unicode_literals
+from contextlib import contextmanager
+import datetime
+
+from django.conf import settings
+from django.db import transaction
+from django.utils.timezone import now
+
+
+__all__ = ['atomic', 'get_events', 'get_lag', 'get_page', 'get_page_size',
+        'serialize_event']
+
+
+def get_page_size(limit=None):
+    """Returns the number of events to read at a time.
+
+    limit may not exceed NUTRITION_EVENT_PAGE_SIZE.
+    """
+    maximum = getattr(settings, 'NUTRITION_EVENT_PAGE_SIZE', 500)
+    if limit is None:
+        return maximum
+    return max(min(limit, maximum), 1)
+
+
+@contextmanager
+def atomic(using='default'):
+    """Runs the enclosed code in a single transaction.
+
+    If a transaction is already being managed, the code joins it instead,
+    so that it is committed or rolled back with the rest of that
+    transaction.
+    """
+    if transaction.is_managed(using=using):
+        yield
+    else:
+        with transaction.commit_on_success(using=using):
+            yield
+
+
+def get_lag():
+    """Returns the number of seconds before an event may be read."""
+    return max(getattr(settings, 'NUTRITION_EVENT_LAG', 30), 0)
+
+
+def get_events(after=0, limit=None):
+    """Returns the events which follow sequence number after, in order.
+
+    At most limit events (by default, NUTRITION_EVENT_PAGE_SIZE) are
+    returned. Pass the sequence number of the last event returned to
+    retrieve the next page.
+
+    Sequence numbers are assigned when events are inserted, not when they
+    are committed, so the events of a transaction which is still open may
+    be missing from between those of others. Events are only returned once
+    they are NUTRITION_EVENT_LAG seconds old, and the page ends before the
+    first newer event, so no event whose transaction took less time than
+    that is skipped.
+    """
+    from nutrition.models import ReportEvent
+    cutoff = now() - datetime.timedelta(seconds=get_lag())
+    events = []
+    queryset = ReportEvent.objects.filter(pk__gt=after).order_by('pk')
+    for event in queryset[:get_page_size(limit)]:
+        if event.time > cutoff:
+            break
+        events.append(event)
+    return events
+
+
+def get_page(after=0, limit=None):
+    """Returns a JSON-serializable page of the events after a sequence number.
+
+    next is the sequence number to read from next, and more is True if
+    the page is full, in which case more events may follow.
+    """
+    limit = get_page_size(limit)
+    events = get_events(after, limit)
+    return {
+        'events': [serialize_event(event) for event in events],
+        'next': events[-1].pk if events else after,
+        'more': len(events) == limit,
+    }
+
+
+def serialize_event(event):
+    """Returns a JSON-serializable dictionary describing an event."""
+    return {
+        'sequence': event.pk,
+        'report': event.report_id,
+        'type': event.kind,
+        'status': event.status,
+        'time': event.time.isoformat(),
+    }
+
+
+def report_initialized(sender, instance, **kwargs):
+    # Deferred fields are not loaded.
+    instance._logged_status = instance.__dict__.get('status')
+
+
+def report_saved(sender, instance, created, raw=False, **kwargs):
+    """Logs the events of a saved report."""
+    from nutrition.models import ReportEvent
+    if raw:
+        return
+    kinds = []
+    if created:
+        kinds.append(ReportEvent.CREATED)
+    # Every event records the report's status, so an analysis which changes
+    # it is logged once.
+    if getattr(instance, '_analyzed', False):
+        kinds.append(ReportEvent.ANALYZED)
+    elif (not created and
+            instance.status != getattr(instance, '_logged_status', None)):
+        kinds.append(ReportEvent.STATUS_CHANGED)
+    if kinds:
+        ReportEvent.objects.using(kwargs.get('using')).bulk_create([
+                ReportEvent(report_id=instance.pk, kind=kind,
+                        status=instance.status)
+                for kind in kinds])
+    instance._logged_status = instance.status
+    instance._analyzed = False
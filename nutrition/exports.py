@@ -0,0 +1,372 @@
+from __future__ import unicode_literals
+import zlib
+
+from django.conf import settings
+from django.core import signing
+from django.db import models
+from django.utils import formats
+from django.utils.datastructures import SortedDict
+from django.utils.encoding import force_unicode
+
+try:
+    from django.utils.timezone import template_localtime
+except ImportError:  # Django < 1.5
+    from django.utils.timezone import localtime as template_localtime
+
+from nutrition.fields import FixedPointField
+from nutrition.models import Report
+from nutrition.tables import CSVNutritionReportTable
+from nutrition.unicsv import UnicodeCSVWriter
+
+
+__all__ = ['ReportRecords', 'ReportRows', 'accepts_gzip',
+        'get_compression_level', 'get_page_size', 'gzip_stream',
+        'stream_csv']
+
+
+class ReportRows(object):
+    """Iterates over the rows of a report export, starting with the headers.
+
+    Cells match those of CSVNutritionReportTable, but the needed columns are
+    read straight from the database with values_list() instead of building
+    a Report, a bound row and bound cells for every report. Each column's
+    formatter is compiled once, and patient records are retrieved for
+    chunk_size reports at a time.
+    """
+    table_class = CSVNutritionReportTable
+    fields = ('id', 'created', 'updated', 'reporter_id', 'patient_id',
+            'global_patient_id', 'height', 'weight', 'muac', 'oedema',
+            'weight4age', 'height4age', 'weight4height', 'wasting',
+            'stunting', 'underweight', 'status', 'active')
+    patient_fields = ('sex', 'location')
+    chunk_size = 500
+
+    def __init__(self, queryset, order_by=None):
+        self.queryset = queryset
+        self.table = self.table_class(Report.objects.none())
+        self.names = list(self.table.columns.names())
+        self.order_by = self.get_ordering(order_by)
+        self.formatters = [self.get_formatter(name) for name in self.names]
+
+    def __iter__(self):
+        yield self.get_headers()
+        values_list = self.queryset.order_by(*self.order_by)
+        values_list = values_list.values_list(*self.fields)
+        chunk = []
+        for values in values_list.iterator():
+            chunk.append(values)
+            if len(chunk) >= self.chunk_size:
+                for row in self.format_chunk(chunk):
+                    yield row
+                chunk = []
+        for row in self.format_chunk(chunk):
+            yield row
+
+    def get_headers(self):
+        return [name.title() for name in self.names]
+
+    def get_ordering(self, order_by):
+        """Parses the table's sort parameter, ignoring unknown columns."""
+        ordering = []
+        for name in (order_by or '').split(','):
+            name = name.strip()
+            bare = name.lstrip('-')
+            if bare in self.names and self.table.columns[bare].orderable:
+                ordering.append(name)
+        return ordering or ['pk']
+
+    def format_chunk(self, chunk):
+        index = self.fields.index('global_patient_id')
+        patients = Report.get_patients([values[index] for values in chunk])
+        formatters = self.formatters
+        for values in chunk:
+            patient = patients.get(values[index])
+            yield [formatter(values, patient) for formatter in formatters]
+
+    def get_formatter(self, name):
+        """Returns a function which formats a column's cell.
+
+        The function accepts a row of field values and the patient record
+        (or None), and mirrors the way django_tables2 renders the cell: a
+        choice's display value is looked up, empty values are replaced by
+        the column's default and anything else is passed to the column's
+        renderer.
+        """
+        bound_column = self.table.columns[name]
+        empty_values = bound_column.column.empty_values
+        default = bound_column.default
+        get_value = self.get_getter(name)
+        render = self.get_renderer(name)
+
+        def formatter(values, patient):
+            value = get_value(values, patient)
+            if value in empty_values:
+                return default
+            return render(value) if render else value
+        return formatter
+
+    def get_getter(self, name):
+        """Returns a function which retrieves a column's raw value."""
+        if name == 'age':
+            created = self.fields.index('created')
+
+            def getter(values, patient):
+                if patient is not None:
+                    return Report.age_in_months(patient.get('birth_date'),
+                            values[created].date())
+            return getter
+        if name in self.patient_fields:
+            def getter(values, patient):
+                if patient is not None:
+                    return patient.get(name)
+            return getter
+
+        index = self.fields.index(name)
+        field = Report._meta.get_field(name)
+        if field.choices:
+            choices = dict(field.flatchoices)
+
+            def getter(values, patient):
+                value = values[index]
+                return force_unicode(choices.get(value, value),
+                        strings_only=True)
+            return getter
+        if isinstance(field, FixedPointField):
+            # values_list() returns the stored integers.
+            return lambda values, patient: field.to_decimal(values[index])
+        return lambda values, patient: values[index]
+
+    def get_renderer(self, name):
+        """Returns a function which renders a column's non-empty value."""
+        if name == 'oedema':
+            # render_oedema() requires a report, so precompute its output.
+            return dict([(value, Report(oedema=value).get_oedema_display())
+                    for value in (None, True, False)]).get
+        render = getattr(self.table, 'render_{0}'.format(name), None)
+        if render:
+            return render
+        if name in self.fields:
+            field = Report._meta.get_field(name)
+            if isinstance(field, models.DateTimeField):
+                return lambda value: formats.date_format(
+                        template_localtime(value),
+                        'SHORT_DATETIME_FORMAT')
+        return None
+
+
+class _Buffer(object):
+    """A write-only file which holds what is written until it is read."""
+
+    def __init__(self):
+        self.parts = []
+        self.size = 0
+
+    def write(self, data):
+        self.parts.append(data)
+        self.size += len(data)
+
+    def read(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+def stream_csv(rows, buffer_size=16 * 1024):
+    """Yields the bytes of rows written as CSV, about buffer_size at a time.
+
+    The first row (e.g., the headers) is yielded on its own, so that a
+    response starts straight away.
+    """
+    buffer = _Buffer()
+    writer = UnicodeCSVWriter(buffer)
+    for i, row in enumerate(rows):
+        writer.writerow(row)
+        if not i or buffer.size >= buffer_size:
+            yield buffer.read()
+    data = buffer.read()
+    if data:
+        yield data
+
+
+def get_compression_level(level=None):
+    """Returns a gzip compression level, from 1 (fastest) to 9 (smallest).
+
+    By default, NUTRITION_EXPORT_GZIP_LEVEL is used. Raises ValueError if
+    level is not a whole number between 1 and 9.
+    """
+    if level is None:
+        level = getattr(settings, 'NUTRITION_EXPORT_GZIP_LEVEL', 6)
+    try:
+        level = int(level)
+    except (TypeError, ValueError):
+        level = None
+    if level not in range(1, 10):
+        raise ValueError('The compression level must be between 1 and 9.')
+    return level
+
+
+def accepts_gzip(accept_encoding):
+    """Returns whether an Accept-Encoding header allows gzip.
+
+    gzip (or x-gzip) is accepted unless its q-value is 0. If neither is
+    listed, the q-value of * applies.
+    """
+    qualities = {}
+    for coding in accept_encoding.split(','):
+        params = coding.split(';')
+        name = params[0].strip().lower()
+        quality = 1.0
+        for param in params[1:]:
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        if name:
+            qualities[name] = quality
+    for name in ('gzip', 'x-gzip', '*'):
+        if name in qualities:
+            return qualities[name] > 0
+    return False
+
+
+def gzip_stream(chunks, level=None, flush_size=64 * 1024):
+    """Compresses an iterator of bytes (or text) with gzip, as it is read.
+
+    Compressed data is flushed after the first chunk, so that the first
+    bytes are sent at once, and after every flush_size bytes of input, so
+    that a slow export keeps sending data. Only zlib's window and the
+    current chunk are held in memory.
+    """
+    compressor = zlib.compressobj(get_compression_level(level),
+            zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    first = True
+    pending = 0
+    for chunk in chunks:
+        if isinstance(chunk, unicode):
+            chunk = chunk.encode('utf-8')
+        data = compressor.compress(chunk)
+        pending += len(chunk)
+        if first or pending >= flush_size:
+            data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            first = False
+            pending = 0
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def get_page_size(limit=None):
+    """Returns the number of reports to return in a page of records.
+
+    limit may not exceed NUTRITION_API_PAGE_SIZE.
+    """
+    maximum = getattr(settings, 'NUTRITION_API_PAGE_SIZE', 1000)
+    if limit is None:
+        return maximum
+    return max(min(limit, maximum), 1)
+
+
+class ReportRecords(object):
+    """Iterates over a page of reports as dictionaries of the chosen fields.
+
+    Reports are ordered by primary key and the page starts after the report
+    encoded in cursor. Like ReportRows, values are read with values_list(),
+    but they are left unformatted, and patient records are only retrieved
+    (chunk_size reports at a time) if a patient field is chosen. Once the
+    page has been iterated over, next is the cursor of the following page,
+    or None if this is the last one.
+    """
+    fields = ReportRows.fields
+    patient_fields = ('age', 'sex', 'location')
+    chunk_size = 500
+    salt = 'nutrition.exports.ReportRecords'
+
+    def __init__(self, queryset, fields=None, cursor=None, limit=None):
+        """Raises ValueError if a field or the cursor is invalid."""
+        fields = list(fields or self.fields)
+        unknown = set(fields) - set(self.fields + self.patient_fields)
+        if unknown:
+            raise ValueError('Unknown field(s): {0}.'.format(
+                    ', '.join(sorted(unknown))))
+        # The id is always included.
+        self.names = ['id'] + [name for name in fields if name != 'id']
+        self.queryset = queryset
+        self.after = self.decode_cursor(cursor) if cursor else None
+        self.limit = get_page_size(limit)
+        self.next = None
+
+    def __iter__(self):
+        queryset = self.queryset.order_by('pk')
+        if self.after is not None:
+            queryset = queryset.filter(pk__gt=self.after)
+        columns = [name for name in self.names if name in self.fields]
+        patient_index = None
+        if any(name in self.patient_fields for name in self.names):
+            columns += [name for name in ('created', 'global_patient_id')
+                    if name not in columns]
+            patient_index = columns.index('global_patient_id')
+        getters = [(name, self.get_getter(name, columns))
+                for name in self.names]
+        # One extra report is read to learn whether there is a next page.
+        values_list = queryset.values_list(*columns)[:self.limit + 1]
+        chunk = []
+        count = 0
+        for values in values_list.iterator():
+            if count == self.limit:
+                self.next = self.encode_cursor(last_pk)
+                break
+            count += 1
+            last_pk = values[0]
+            chunk.append(values)
+            if len(chunk) >= self.chunk_size:
+                for record in self.get_records(chunk, getters, patient_index):
+                    yield record
+                chunk = []
+        for record in self.get_records(chunk, getters, patient_index):
+            yield record
+
+    def get_records(self, chunk, getters, patient_index=None):
+        patients = {}
+        if patient_index is not None and chunk:
+            patients = Report.get_patients([values[patient_index]
+                    for values in chunk])
+        for values in chunk:
+            patient = None
+            if patient_index is not None:
+                patient = patients.get(values[patient_index])
+            yield SortedDict([(name, getter(values, patient))
+                    for name, getter in getters])
+
+    def get_getter(self, name, columns):
+        """Returns a function which retrieves a field's raw value."""
+        if name == 'age':
+            created = columns.index('created')
+
+            def getter(values, patient):
+                if patient is not None:
+                    return Report.age_in_months(patient.get('birth_date'),
+                            values[created].date())
+            return getter
+        if name in self.patient_fields:
+            def getter(values, patient):
+                if patient is not None:
+                    return patient.get(name)
+            return getter
+        index = columns.index(name)
+        field = Report._meta.get_field(name)
+        if isinstance(field, FixedPointField):
+            # values_list() returns the stored integers.
+            return lambda values, patient: field.to_decimal(values[index])
+        return lambda values, patient: values[index]
+
+    def encode_cursor(self, pk):
+        return signing.dumps(pk, salt=self.salt)
+
+    def decode_cursor(self, cursor):
+        try:
+            return int(signing.loads(cursor, salt=self.salt))
+        except (signing.BadSignature, TypeError, ValueError):
+            raise ValueError('Invalid cursor.')
@@ -1,6 +1,10 @@
 from __future__ import unicode_literals
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
 
 from django import forms
+from django.conf import settings
+from django.core import exceptions
+from django.db import models
 from django.utils.encoding import force_unicode
 
 
@@ -78,3 +82,124 @@ class PlainErrorList(forms.util.ErrorList):
         if not self:
             return ''
         return ' '.join(['%s' % force_unicode(e) for e in self])
+
+
+class _Units(int):
+    """A FixedPointField's stored integer, which is saved without scaling."""
+
+
+class FixedPointField(models.IntegerField):
+    """Stores a decimal number as an integer count of its smallest units.
+
+    With decimal_places=1, for example, Decimal('12.5') is stored as 125.
+    Like a ForeignKey, the field has two attributes: the field's name holds
+    the Decimal value, and <name>_fixed holds the stored integer. Rows are
+    loaded into the integer attribute, so no Decimal is built until the
+    value is used. Lookups and update() take numbers, which are scaled, but
+    values(), values_list() and aggregates return the stored integers;
+    to_decimal() converts them.
+    """
+    description = 'Decimal number stored as an integer'
+
+    def __init__(self, *args, **kwargs):
+        self.max_digits = kwargs.pop('max_digits', None)
+        self.decimal_places = kwargs.pop('decimal_places', 0)
+        self.unit = Decimal(1).scaleb(-self.decimal_places)
+        super(FixedPointField, self).__init__(*args, **kwargs)
+
+    def get_attname(self):
+        return '{0}_fixed'.format(self.name)
+
+    def get_attname_column(self):
+        attname = self.get_attname()
+        return attname, self.db_column or self.name
+
+    def contribute_to_class(self, cls, name):
+        super(FixedPointField, self).contribute_to_class(cls, name)
+        # A property, so that the model accepts the name as a keyword.
+        setattr(cls, name, property(self.value_from_object,
+                self.set_decimal))
+
+    def to_decimal(self, value):
+        """Converts a stored integer to a Decimal."""
+        if value is None:
+            return None
+        return Decimal(value).scaleb(-self.decimal_places)
+
+    def to_fixed(self, value):
+        """Converts a number to the integer which stores it."""
+        if value is None or value == '':
+            return None
+        value = Decimal(force_unicode(value)) / self.unit
+        return int(value.quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+    def value_from_object(self, obj):
+        return self.to_decimal(getattr(obj, self.attname))
+
+    def set_decimal(self, obj, value):
+        value = self.to_fixed(value)
+        # Raw saves, e.g., by loaddata, read the attribute without pre_save().
+        setattr(obj, self.attname, None if value is None else _Units(value))
+
+    def _get_val_from_obj(self, obj):
+        # Serialize the Decimal value, which to_python() reads back.
+        if obj is not None:
+            return self.value_from_object(obj)
+        return self.get_default()
+
+    def to_python(self, value):
+        if value is None or isinstance(value, (int, long)):
+            return value  # The stored integer, e.g., when cleaning a model.
+        try:
+            return Decimal(force_unicode(value).strip())
+        except InvalidOperation:
+            raise exceptions.ValidationError(self.error_messages['invalid'])
+
+    def pre_save(self, model_instance, add):
+        value = getattr(model_instance, self.attname)
+        return None if value is None else _Units(value)
+
+    def get_prep_value(self, value):
+        if isinstance(value, _Units):
+            return int(value)
+        return self.to_fixed(value)
+
+    def get_prep_lookup(self, lookup_type, value):
+        # IntegerField would round floats, which are not stored integers.
+        return models.Field.get_prep_lookup(self, lookup_type, value)
+
+    def formfield(self, **kwargs):
+        defaults = {
+            'form_class': forms.DecimalField,
+            'max_digits': self.max_digits,
+            'decimal_places': self.decimal_places,
+        }
+        defaults.update(kwargs)
+        return super(models.IntegerField, self).formfield(**defaults)
+
+
+def decimal_field(*args, **kwargs):
+    """Returns a field for a decimal number, as configured by the project.
+
+    A FixedPointField if NUTRITION_FIXED_POINT_STORAGE is set, otherwise a
+    DecimalField. The setting is read when the model is defined, as it
+    decides the type of the database column, so it cannot be changed while
+    the project runs; run the tests with the NUTRITION_FIXED_POINT_STORAGE
+    environment variable set to test fixed-point storage.
+    """
+    if getattr(settings, 'NUTRITION_FIXED_POINT_STORAGE', False):
+        return FixedPointField(*args, **kwargs)
+    return models.DecimalField(*args, **kwargs)
+
+
+try:
+    from south.modelsinspector import add_introspection_rules
+except ImportError:
+    pass
+else:
+    add_introspection_rules([
+        ([FixedPointField], [], {
+            'max_digits': ['max_digits', {'default': None}],
+            'decimal_places': ['decimal_places', {'default': 0}],
+        }),
+    ], [r'^nutrition\.fields\.FixedPointField'])
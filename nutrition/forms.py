@@ -8,7 +8,10 @@ from django.utils.translation import ugettext_lazy as _
 from healthcare.api import client
 from healthcare.exceptions import PatientDoesNotExist, ProviderDoesNotExist
 
-from nutrition.models import Report
+from nutrition import classification, search
+from nutrition.models import ArchivedReport, Report
+from nutrition.reporters import reporters
+from nutrition.suggestions import patient_ids
 from nutrition.fields import NullDecimalField, NullYesNoField, PlainErrorList
 
 
@@ -25,24 +28,43 @@ class NutritionFormBase(object):
         return super(NutritionFormBase, self).clean()
 
     def clean_connection(self):
-        """Validate that the reporter is registered and active."""
-        self.reporter = None  # TODO
+        """Retrieve the active provider, if any, who sent the message."""
+        self.reporter = reporters.get(self.connection)
 
     def clean_patient_id(self):
         """Validate that the patient is registered and active."""
         patient_id = self.cleaned_data['patient_id']
         source = getattr(settings, 'NUTRITION_PATIENT_HEALTHCARE_SOURCE', None)
+        msg = self.fields['patient_id'].error_messages['invalid']
         try:
             patient = client.patients.get(patient_id, source=source)
         except PatientDoesNotExist:
-            msg = self.fields['patient_id'].error_messages['invalid']
+            if getattr(settings, 'NUTRITION_SUGGEST_PATIENT_IDS', False):
+                suggestion = patient_ids.suggest(patient_id)
+                if suggestion and self._is_active(suggestion, source):
+                    msg = '{0} {1}'.format(msg,
+                            _('Did you mean {0}?').format(suggestion))
             raise forms.ValidationError(msg)
         if patient['status'] != 'A':
-            msg = self.fields['patient_id'].error_messages['invalid']
+            patient_ids.discard(patient_id)  # Not worth suggesting.
             raise forms.ValidationError(msg)
         self.patient = patient
         return patient_id
 
+    def _is_active(self, patient_id, source):
+        """Returns whether a suggested patient ID is that of an active
+        patient. Other IDs are removed from the index, so each is looked up
+        at most once.
+        """
+        try:
+            patient = client.patients.get(patient_id, source=source)
+            active = patient['status'] == 'A'
+        except PatientDoesNotExist:
+            active = False
+        if not active:
+            patient_ids.discard(patient_id)
+        return active
+
     @property
     def error(self):
         """Condense form errors into a single error message."""
@@ -79,23 +101,17 @@ class CancelReportForm(NutritionFormBase, forms.Form):
                 field.error_messages[msg_type] = self.messages[field_name]
 
     def cancel(self):
-        """Cancels the patient's most recently created report.
+        """Cancels the patient's most recently created active report.
 
-        Raises Report.DoesNotExist if the patient has no reports.
-        """
-        # TODO: filter to only reports created by our connection, to
-        # prevent a text-message race condition.
+        Only reports sent by the same reporter are considered, to prevent a
+        text-message race condition between reporters.
 
-        # We do not filter on report status. It is possible that the most
-        # recent report is already cancelled, but that's okay for now because
-        # this feature is not intended to allow reporters to cancel all
-        # reports to the beginning of time.
+        Raises Report.DoesNotExist if the patient has no such report.
+        """
         patient_id = self.cleaned_data['patient_id']
+        reporter_id = self.reporter['id'] if self.reporter else None
         # Report.DoesNotExist should be handled by the caller.
-        report = Report.objects.filter(patient_id=patient_id)\
-                                .latest('created')
-        report.cancel()
-        return report
+        return Report.objects.cancel_latest(patient_id, reporter_id)
 
 
 class CreateReportForm(NutritionFormBase, forms.ModelForm):
@@ -149,18 +165,84 @@ class CreateReportForm(NutritionFormBase, forms.ModelForm):
     def save(self, *args, **kwargs):
         self.instance.raw_text = self.raw_text
         self.instance.global_patient_id = self.patient['id']
-        return super(CreateReportForm, self).save(*args, **kwargs)
+        if self.reporter:
+            # Reporters do not yet have source-specific identifiers, so the
+            # local identifier is equivalent to the global identifier.
+            self.instance.global_reporter_id = self.reporter['id']
+            self.instance.reporter_id = self.reporter['id']
+        commit = kwargs.pop('commit', True)
+        report = super(CreateReportForm, self).save(commit=False)
+        # Spare the report from retrieving records we have already fetched.
+        report._patient = self.patient
+        report._reporter = self.reporter
+        if commit:
+            report.save()
+        return report
 
 
 class ReportFilterForm(forms.Form):
     patient_id = forms.CharField(label='Patient ID', required=False)
     reporter_id = forms.CharField(label='Reporter ID', required=False)
+    match = forms.ChoiceField(label='Match IDs', choices=search.MATCH_MODES,
+            required=False)
     status = forms.ChoiceField(choices=[('', '')] + Report.STATUSES,
             required=False)
+    wasting = forms.ChoiceField(label='Acute malnutrition',
+            choices=[('', '')] + classification.WASTING_CLASSIFICATIONS,
+            required=False)
+    stunting = forms.ChoiceField(
+            choices=[('', '')] + classification.CLASSIFICATIONS,
+            required=False)
+    underweight = forms.ChoiceField(
+            choices=[('', '')] + classification.CLASSIFICATIONS,
+            required=False)
+    active = forms.ChoiceField(label='Active or cancelled',
+            choices=[('', ''), ('yes', 'Active'), ('no', 'Cancelled')],
+            required=False)
+    start_date = forms.DateField(label='Created from', required=False)
+    end_date = forms.DateField(label='Created to', required=False)
+    archived = forms.BooleanField(label='Archived reports only',
+            required=False)
+
+    def clean(self):
+        start_date = self.cleaned_data.get('start_date')
+        end_date = self.cleaned_data.get('end_date')
+        if start_date and end_date and start_date > end_date:
+            raise forms.ValidationError('The start date must not be after '
+                    'the end date.')
+        return self.cleaned_data
+
+    def clean_match(self):
+        return self.cleaned_data.get('match') or search.EXACT
+
+    def get_filters(self):
+        """Returns a sorted list of the (name, value) filters in use.
+
+        Equivalent filters produce the same list. The form must be valid.
+        """
+        filters = dict([(k, v) for k, v in self.cleaned_data.iteritems()
+                if v])
+        if not (filters.get('patient_id') or filters.get('reporter_id')):
+            del filters['match']  # Only applies to IDs.
+        return sorted(filters.items())
 
     def get_items(self):
         if self.is_valid():
-            filters = dict([(k, v) for k, v in self.cleaned_data.iteritems()
-                    if v])
-            return Report.objects.filter(**filters)
+            model = ArchivedReport if self.cleaned_data['archived'] else Report
+            reports = model.objects.created_between(
+                    self.cleaned_data['start_date'],
+                    self.cleaned_data['end_date'])
+            for field in ('status', 'wasting', 'stunting', 'underweight'):
+                if self.cleaned_data[field]:
+                    reports = reports.filter(
+                            **{field: self.cleaned_data[field]})
+            if self.cleaned_data['active']:
+                reports = reports.filter(
+                        active=self.cleaned_data['active'] == 'yes')
+            for field in ('patient_id', 'reporter_id'):
+                if self.cleaned_data[field]:
+                    reports = search.filter_reports(reports, field,
+                            self.cleaned_data[field],
+                            self.cleaned_data['match'])
+            return reports
         return Report.objects.none()
@@ -0,0 +1,49 @@
+from __future__ import unicode_literals
+import copy
+import decimal
+import threading
+
+
+__all__ = ['get_calculator', 'warm_up']
+
+
+_calculator = None
+_lock = threading.Lock()
+_local = threading.local()
+
+
+def _load_calculator():
+    global _calculator
+    if _calculator is None:
+        with _lock:
+            if _calculator is None:
+                from pygrowup.pygrowup import Calculator
+                _calculator = Calculator(False, False, False)
+    return _calculator
+
+
+def get_calculator():
+    """Returns this thread's pygrowup Calculator.
+
+    pygrowup is imported, and its growth tables are loaded, on first use
+    rather than when nutrition is imported, so that processes which never
+    analyze a report do not pay for them. The tables are loaded once and
+    shared, as they do not change, but a Calculator computes in the decimal
+    context of the thread which created it, so each thread is given its own
+    copy, which uses that thread's context.
+    """
+    shared = _load_calculator()
+    if getattr(_local, 'shared', None) is not shared:
+        calculator = copy.copy(shared)
+        calculator.context = decimal.getcontext()
+        _local.shared, _local.calculator = shared, calculator
+    return _local.calculator
+
+
+def warm_up():
+    """Loads pygrowup and its growth tables ahead of the first report.
+
+    This may be called when a process starts, e.g., from a RapidSMS app's
+    start() method, so that the first report is not delayed.
+    """
+    get_calculator()
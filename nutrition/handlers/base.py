@@ -1,9 +1,12 @@
 from __future__ import unicode_literals
+import cProfile
 import logging
 import re
 
 from django.utils.translation import ugettext_lazy as _
 
+from nutrition import admission, profiling
+
 
 __all__ = ['NutritionHandlerBase']
 
@@ -23,6 +26,12 @@ class NutritionHandlerBase(object):
         'error': _('Sorry, an unexpected error occurred while processing your '
                 'message. Please contact your administrator if this '
                 'continues to occur.'),
+
+        'received': _('Thanks, your message was received and is being '
+                'processed. You will receive a reply shortly.'),
+
+        'busy': _('Sorry, the system is too busy to process your message '
+                'right now. Please send it again later.'),
     }
     _messages = {}  # Handler-specific messages.
 
@@ -53,23 +62,64 @@ class NutritionHandlerBase(object):
         """Validate and act upon parsed message data."""
         raise NotImplemented('Subclass must define _process method.')
 
-    def _respond(self, msg_type, **kwargs):
-        """Shortcut to retrieve and format a message."""
+    def _message(self, msg_type, **kwargs):
+        """Retrieve and format a message."""
         data = {  # Some common data.
             'prefix': self.prefix.upper(),
             'keyword': self._colloquial_keyword().upper(),
         }
         data.update(**kwargs)
         if msg_type in self._messages:
-            return self.respond(self._messages[msg_type].format(**data))
+            return self._messages[msg_type].format(**data)
         if msg_type in self._common_messages:
-            return self.respond(self._common_messages[msg_type].format(**data))
+            return self._common_messages[msg_type].format(**data)
         raise KeyError('Message type {0} not found.'.format(msg_type))
 
+    def _respond(self, msg_type, **kwargs):
+        """Shortcut to retrieve, format and send a message."""
+        text = self._message(msg_type, **kwargs)
+        self.outcome = msg_type
+        return self.respond(text)
+
     def handle(self, text):
         """
-        Entry point of the handler. This method takes care of a few common
-        tasks then calls the subclass-specific process method.
+        Entry point of the handler. If NUTRITION_ADMISSION_CONCURRENCY is
+        set, the message waits its turn in the work queue of
+        nutrition.admission before it is handled.
+        """
+        controller = admission.get_controller()
+        if controller is None:
+            return self.handle_now(text)
+        return controller.submit(self, text)
+
+    def handle_now(self, text):
+        """
+        Handles the message straight away. A sample of messages is profiled
+        if NUTRITION_PROFILE_RATE is set.
+        """
+        if not profiling.should_profile():
+            return self._handle(text)
+
+        self.outcome = 'none'
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            return self._handle(text)
+        except:
+            self.outcome = 'exception'
+            raise
+        finally:
+            profile.disable()
+            try:
+                profiling.save_profile(profile, self._colloquial_keyword(),
+                        self.outcome)
+            except Exception:
+                logger.exception('Unable to save the handler profile')
+
+    def _handle(self, text):
+        """
+        Takes care of a few common tasks then calls the subclass-specific
+        process method.
         """
         self.raw_text = self.msg.text
         # The reporter will be determined from the message connection.
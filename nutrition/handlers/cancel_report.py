@@ -27,8 +27,8 @@ class CancelReportHandler(NutritionHandlerBase, KeywordHandler):
         'success': _('Thanks {reporter}. The most recent nutrition report for '
                 '{patient} ({patient_id}) has been cancelled.'),
 
-        'no_report': _('Sorry, {patient_id} does not have any reports in the '
-                'system.'),
+        'no_report': _('Sorry, {patient_id} does not have any active reports '
+                'from you in the system.'),
 
         'format_error': _('Sorry, the system could not understand whose '
                 'report you would like to cancel. To cancel the most recent '
@@ -65,7 +65,7 @@ class CancelReportHandler(NutritionHandlerBase, KeywordHandler):
             # Send a success message to the reporter.
             logger.debug('Successfully cancelled a report!')
             data = {}
-            if form.reporter:  # TODO
+            if form.reporter:
                 name = form.reporter.get('name', '')
                 data['reporter'] = name or form.reporter['id']
             else:
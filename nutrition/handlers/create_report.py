@@ -1,8 +1,6 @@
 from __future__ import unicode_literals
 import logging
 
-from pygrowup.exceptions import InvalidMeasurement
-
 from django.utils.translation import ugettext_lazy as _
 
 from rapidsms.contrib.handlers import KeywordHandler
@@ -88,10 +86,17 @@ class CreateReportHandler(NutritionHandlerBase, KeywordHandler):
             self._respond('form_error', **data)
             return
 
+        # pygrowup is only imported once a report is created.
+        from pygrowup.exceptions import InvalidMeasurement
+
         # Create the new report.
         try:
-            self.report = form.save()
-            self.report.analyze()  # Calculates z-scores and re-saves.
+            self.report = form.save(commit=False)
+            try:
+                self.report.analyze(save=False)  # Calculates z-scores.
+            finally:
+                # Save the report once, whether or not analysis succeeded.
+                self.report.save()
         except InvalidMeasurement as e:
             # This may be thrown by pygrowup when calculating z-scores if
             # the measurements provided are beyond reasonable limits.
@@ -111,7 +116,7 @@ class CreateReportHandler(NutritionHandlerBase, KeywordHandler):
                 name = self.report.reporter.get('name', '')
                 data['reporter'] = name or self.report.reporter['id']
             else:
-                data['reporter'] = 'anonymous'  # TODO
+                data['reporter'] = 'anonymous'
             data['patient'] = self.report.patient.get('name', '')
             data['patient_id'] = self.report.patient_id
             self._respond('success', **data)
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+import logging
+import Queue
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from healthcare.api import client
+
+
+__all__ = ['get_concurrency', 'get_many', 'get_patients', 'get_providers']
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_concurrency():
+    """Returns the maximum number of concurrent healthcare lookups."""
+    return max(getattr(settings, 'NUTRITION_HEALTHCARE_CONCURRENCY', 8), 1)
+
+
+def get_many(category, ids, concurrency=None):
+    """Retrieves many patient or provider records from healthcare at once.
+
+    category is either 'patient' or 'provider'. Each record is retrieved
+    with its own backend call, but up to concurrency calls (by default,
+    NUTRITION_HEALTHCARE_CONCURRENCY) are made at the same time so that the
+    latencies of a slow backend overlap rather than add up. This is meant
+    for backends which cannot retrieve many records in a single call.
+
+    Returns a dictionary mapping each id to its record. Ids which do not
+    exist, or whose lookup fails, are omitted.
+    """
+    backend = getattr(client, '{0}s'.format(category)).backend
+    method = getattr(backend, 'get_{0}'.format(category))
+    ids = list(set(ids))
+    concurrency = min(concurrency or get_concurrency(), len(ids))
+    results = {}
+    if concurrency <= 1:
+        for id in ids:
+            _lookup(method, id, results)
+        return results
+
+    queue = Queue.Queue()
+    for id in ids:
+        queue.put(id)
+
+    def worker():
+        try:
+            while True:
+                try:
+                    id = queue.get_nowait()
+                except Queue.Empty:
+                    return
+                _lookup(method, id, results)
+        finally:
+            # Database-backed storage opens a connection in each thread.
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def get_patients(ids, concurrency=None):
+    """Retrieves many patient records. See get_many."""
+    return get_many('patient', ids, concurrency)
+
+
+def get_providers(ids, concurrency=None):
+    """Retrieves many provider records. See get_many."""
+    return get_many('provider', ids, concurrency)
+
+
+def _lookup(method, id, results):
+    try:
+        record = method(id)
+    except Exception:
+        logger.exception('Healthcare lookup of {0} failed.'.format(id))
+        return
+    if record is not None:
+        results[id] = record
@@ -0,0 +1,28 @@
+from __future__ import unicode_literals
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from nutrition import archive
+
+
+class Command(BaseCommand):
+    help = ('Moves cancelled reports, and reports older than '
+            'NUTRITION_ARCHIVE_AFTER_DAYS, into the archive.')
+    option_list = BaseCommand.option_list + (
+        make_option('--older-than', dest='age', type='int', default=None,
+                help='Also archive reports created more than this many days '
+                'ago (default: NUTRITION_ARCHIVE_AFTER_DAYS).'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                default=500,
+                help='Number of reports to move per transaction '
+                '(default: 500).'),
+        make_option('--pause', type='float', default=0,
+                help='Seconds to wait between batches (default: 0).'),
+    )
+
+    def handle(self, *args, **options):
+        reports = archive.get_archivable(options['age'])
+        count = archive.archive_reports(reports,
+                batch_size=options['batch_size'], pause=options['pause'])
+        self.stdout.write('Archived {0} report(s).'.format(count))
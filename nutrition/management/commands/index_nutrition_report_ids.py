@@ -0,0 +1,34 @@
+from __future__ import unicode_literals
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from nutrition import search
+from nutrition.models import Report
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the trigrams used to search for reports by part of a '
+            'patient or reporter ID.')
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int',
+                default=1000,
+                help='Number of reports to index at a time (default: 1000).'),
+    )
+
+    def handle(self, *args, **options):
+        if search.use_trigram_indexes():
+            self.stdout.write('The database trigram indexes are in use; '
+                    'nothing to do.')
+            return
+        reports = Report.objects.order_by('pk')
+        reports = reports.values_list('pk', 'patient_id', 'reporter_id')
+        last, count = 0, 0
+        while True:
+            chunk = list(reports.filter(pk__gt=last)[:options['batch_size']])
+            if not chunk:
+                break
+            search.index_reports(chunk)
+            count += len(chunk)
+            last = chunk[-1][0]
+        self.stdout.write('Indexed {0} report(s).'.format(count))
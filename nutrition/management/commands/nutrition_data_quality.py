@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nutrition.forms import ReportFilterForm
+
+
+class Command(BaseCommand):
+    args = '[filter=value ...]'
+    help = ('Prints measurement quality checks (terminal digits, digit '
+            'preference, heaping and z-score flags) of each reporter, for '
+            'the reports which match the filters of the reports list.')
+    option_list = BaseCommand.option_list + (
+        make_option('--group-by', dest='group_by', default='reporter',
+                help='Comma-separated groups: reporter (default) and/or '
+                'location.'),
+        make_option('--problems', action='store_true', default=False,
+                help='Only print groups which fail a check.'),
+        make_option('--json', action='store_true', default=False,
+                help='Print the statistics as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from nutrition import quality
+        except ImportError:
+            raise CommandError('NumPy is required for data quality checks.')
+        try:
+            data = dict(arg.split('=', 1) for arg in args)
+        except ValueError:
+            raise CommandError('Filters must be given as name=value.')
+        form = ReportFilterForm(data)
+        if not form.is_valid():
+            raise CommandError('Invalid filters: {0}'.format(
+                    form.errors.as_text()))
+        group_by = [name.strip() for name in options['group_by'].split(',')
+                if name.strip()]
+        try:
+            results = quality.check_quality(form.get_items(),
+                    group_by=group_by)
+        except ValueError as e:
+            raise CommandError(unicode(e))
+        if options['problems']:
+            results = [result for result in results if result['problems']]
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.write_result(result, quality)
+
+    def write_result(self, result, quality):
+        group = ', '.join('{0}: {1}'.format(name, value)
+                for name, value in sorted(result['group'].items()))
+        # Django 1.4's stdout does not end lines.
+        self.stdout.write('{0}{1} report(s)\n'.format(
+                '{0}; '.format(group) if group else '', result['reports']))
+        for field in quality.MEASUREMENTS:
+            stats = result[field]
+            if not stats['n']:
+                continue
+            self.stdout.write('  {0}: n={1}, digits {2}, preference {3:.1f}, '
+                    'heaping {4:.0%}\n'.format(field, stats['n'],
+                    ' '.join(str(count) for count in stats['digits']),
+                    stats['preference'], stats['heaping']))
+        for field in quality.ZSCORES:
+            stats = result[field]
+            if not stats['n']:
+                continue
+            line = '  {0}: n={1}, flagged {2} ({3:.0%})'.format(field,
+                    stats['n'], stats['flagged'], stats['flagged_share'])
+            if stats['sd'] is not None:
+                line += ', SD {0:.2f}'.format(stats['sd'])
+            self.stdout.write(line + '\n')
+        for problem in result['problems']:
+            self.stdout.write('  Problem: {0}\n'.format(problem))
@@ -0,0 +1,24 @@
+from __future__ import unicode_literals
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from nutrition import events
+
+
+class Command(BaseCommand):
+    help = ('Prints a page of report events, as JSON, following sequence '
+            'number AFTER.')
+    option_list = BaseCommand.option_list + (
+        make_option('--after', type='int', default=0,
+                help='Sequence number of the last event already read '
+                '(default: 0).'),
+        make_option('--limit', type='int', default=None,
+                help='Maximum number of events to print (default and '
+                'maximum: NUTRITION_EVENT_PAGE_SIZE).'),
+    )
+
+    def handle(self, *args, **options):
+        page = events.get_page(options['after'], options['limit'])
+        self.stdout.write(json.dumps(page))
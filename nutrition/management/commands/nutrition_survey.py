@@ -0,0 +1,76 @@
+from __future__ import unicode_literals
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nutrition.forms import ReportFilterForm
+
+
+class Command(BaseCommand):
+    args = '[filter=value ...]'
+    help = ('Prints the prevalence of malnutrition, with confidence '
+            'intervals, and z-score statistics of the reports which match '
+            'the filters of the reports list, e.g. status=A.')
+    option_list = BaseCommand.option_list + (
+        make_option('--group-by', dest='group_by', default='',
+                help='Comma-separated groups: location and/or month.'),
+        make_option('--flags', default='who',
+                help='Flagged z-scores to exclude: who (default) or smart.'),
+        make_option('--design-effect', dest='design_effect', type='float',
+                default=1.0,
+                help='Design effect of a cluster survey (default: 1).'),
+        make_option('--json', action='store_true', default=False,
+                help='Print the statistics as JSON.'),
+    )
+
+    def handle(self, *args, **options):
+        try:
+            from nutrition import surveys
+        except ImportError:
+            raise CommandError('NumPy is required for survey statistics.')
+        try:
+            data = dict(arg.split('=', 1) for arg in args)
+        except ValueError:
+            raise CommandError('Filters must be given as name=value.')
+        form = ReportFilterForm(data)
+        if not form.is_valid():
+            raise CommandError('Invalid filters: {0}'.format(
+                    form.errors.as_text()))
+        if options['flags'] not in (surveys.WHO, surveys.SMART):
+            raise CommandError('--flags must be who or smart.')
+        group_by = [name.strip() for name in options['group_by'].split(',')
+                if name.strip()]
+        try:
+            results = surveys.survey(form.get_items(), group_by=group_by,
+                    flags=options['flags'],
+                    design_effect=options['design_effect'])
+        except ValueError as e:
+            raise CommandError(unicode(e))
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        for result in results:
+            self.write_result(result, surveys.INDICATORS)
+
+    def write_result(self, result, indicators):
+        group = ', '.join('{0}: {1}'.format(name, value)
+                for name, value in sorted(result['group'].items()))
+        # Django 1.4's stdout does not end lines.
+        self.stdout.write('{0}{1} report(s)\n'.format(
+                '{0}; '.format(group) if group else '', result['reports']))
+        for name, _, _ in indicators:
+            stats = result[name]
+            line = '  {0}: n={1}, flagged={2}'.format(name, stats['n'],
+                    stats['flagged'])
+            for key in ('global', 'severe'):
+                prevalence = stats[key]
+                if prevalence['prevalence'] is not None:
+                    line += ', {0} {1:.1%} ({2:.1%}-{3:.1%})'.format(key,
+                            prevalence['prevalence'], prevalence['lower'],
+                            prevalence['upper'])
+            if stats['mean'] is not None:
+                line += ', mean {0:.2f}'.format(stats['mean'])
+            if stats['sd'] is not None:
+                line += ', SD {0:.2f}'.format(stats['sd'])
+            self.stdout.write(line + '\n')
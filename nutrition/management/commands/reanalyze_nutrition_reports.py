@@ -0,0 +1,32 @@
+from __future__ import unicode_literals
+import datetime
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.utils.timezone import now
+
+from nutrition import reanalysis
+
+
+class Command(BaseCommand):
+    help = ('Re-analyzes reports whose patient birth date or sex has '
+            'changed since they were analyzed.')
+    option_list = BaseCommand.option_list + (
+        make_option('--hours', type='float', default=None,
+                help='Only check patients updated in the last HOURS hours, '
+                'if the healthcare backend can filter by update time.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                default=100,
+                help='Number of reports to analyze per transaction '
+                '(default: 100).'),
+    )
+
+    def handle(self, *args, **options):
+        since = None
+        if options['hours'] is not None:
+            since = now() - datetime.timedelta(hours=options['hours'])
+        count = 0
+        for patients in reanalysis.iter_patients(since):
+            count += reanalysis.reanalyze_patients(patients,
+                    batch_size=options['batch_size'])
+        self.stdout.write('Re-analyzed {0} report(s).'.format(count))
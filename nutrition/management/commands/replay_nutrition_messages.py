@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+import sys
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nutrition import replay
+
+
+class Command(BaseCommand):
+    args = '<log file>'
+    help = ('Feeds logged messages through the nutrition handlers, without '
+            'the router or sending replies, and summarizes their timing. '
+            'Use - to read the log from standard input.')
+    option_list = BaseCommand.option_list + (
+        make_option('--dry-run', action='store_true', dest='dry_run',
+                default=False,
+                help='Roll back the changes made by each message.'),
+        make_option('--workers', type='int', default=1,
+                help='Number of messages to handle at the same time '
+                '(default: 1).'),
+        make_option('--backend', dest='backend_name', default='replay',
+                help='Name of the backend the messages are sent from '
+                '(default: replay).'),
+        make_option('--identity', default='replay',
+                help='Identity of the sender of messages which do not name '
+                'one (default: replay).'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the path of one message log.')
+        verbosity = int(options.get('verbosity', 1))
+
+        # Django 1.4's stdout does not end lines.
+        def show(identity, text, outcome, replies):
+            self.stdout.write('{0}: {1} -> {2}\n'.format(identity, text,
+                    outcome))
+            for reply in replies:
+                self.stdout.write('    {0}\n'.format(reply))
+
+        log = sys.stdin if args[0] == '-' else open(args[0], 'rb')
+        try:
+            messages = replay.read_messages(log, identity=options['identity'])
+            summary = replay.replay(messages, workers=options['workers'],
+                    dry_run=options['dry_run'],
+                    backend_name=options['backend_name'],
+                    callback=show if verbosity > 1 else None)
+        finally:
+            if log is not sys.stdin:
+                log.close()
+        for line in summary.lines():
+            self.stdout.write(line + '\n')
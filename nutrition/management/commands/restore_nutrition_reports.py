@@ -0,0 +1,36 @@
+from __future__ import unicode_literals
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nutrition import archive
+from nutrition.models import ArchivedReport
+
+
+class Command(BaseCommand):
+    args = '[report id ...]'
+    help = 'Moves archived reports back into the current reports.'
+    option_list = BaseCommand.option_list + (
+        make_option('--patient', dest='patient_id', default=None,
+                help='Restore all archived reports for this patient.'),
+        make_option('--batch-size', dest='batch_size', type='int',
+                default=500,
+                help='Number of reports to move per transaction '
+                '(default: 500).'),
+    )
+
+    def handle(self, *args, **options):
+        if not (args or options['patient_id']):
+            raise CommandError('Give the IDs of the reports to restore, or '
+                    'a patient with --patient.')
+        reports = ArchivedReport.objects.all()
+        if args:
+            try:
+                reports = reports.filter(pk__in=[int(arg) for arg in args])
+            except ValueError:
+                raise CommandError('Report IDs must be integers.')
+        if options['patient_id']:
+            reports = reports.filter(patient_id=options['patient_id'])
+        count = archive.restore_reports(reports,
+                batch_size=options['batch_size'])
+        self.stdout.write('Restored {0} report(s).'.format(count))
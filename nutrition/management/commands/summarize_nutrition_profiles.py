@@ -0,0 +1,39 @@
+from __future__ import unicode_literals
+from optparse import make_option
+import pstats
+from StringIO import StringIO
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nutrition import profiling
+
+
+class Command(BaseCommand):
+    help = ('Merges sampled nutrition handler profiles and prints the '
+            'functions which took the most time.')
+    option_list = BaseCommand.option_list + (
+        make_option('--dir', dest='directory', default=None,
+                help='Profile directory (default: NUTRITION_PROFILE_DIR).'),
+        make_option('--keyword', default=None,
+                help='Only include profiles of this handler keyword.'),
+        make_option('--outcome', default=None,
+                help='Only include profiles with this outcome, e.g. success.'),
+        make_option('--sort', default='cumulative',
+                help='pstats sort key (default: cumulative).'),
+        make_option('--limit', type='int', default=25,
+                help='Number of functions to show (default: 25).'),
+    )
+
+    def handle(self, *args, **options):
+        paths = profiling.list_profiles(options['directory'],
+                keyword=options['keyword'], outcome=options['outcome'])
+        if not paths:
+            raise CommandError('No profiles were found.')
+        output = StringIO()
+        stats = pstats.Stats(paths[0], stream=output)
+        for path in paths[1:]:
+            stats.add(path)
+        stats.strip_dirs().sort_stats(options['sort'])
+        stats.print_stats(options['limit'])
+        self.stdout.write('Merged {0} profile(s).\n'.format(len(paths)))
+        self.stdout.write(output.getvalue())
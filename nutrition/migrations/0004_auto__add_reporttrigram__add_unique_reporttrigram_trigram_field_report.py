@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.conf import settings
+from django.db import models
+
+
+TRIGRAM_INDEXES = [
+    ('nutrition_report_patient_id_trgm', 'patient_id'),
+    ('nutrition_report_reporter_id_trgm', 'reporter_id'),
+]
+
+
+def use_trigram_indexes():
+    return (getattr(settings, 'NUTRITION_TRIGRAM_INDEXES', False) and
+            db.backend_name == 'postgres')
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        # Adding model 'ReportTrigram'
+        db.create_table(u'nutrition_reporttrigram', (
+            (u'id', self.gf('django.db.models.fields.AutoField')(primary_key=True)),
+            ('report', self.gf('django.db.models.fields.related.ForeignKey')(related_name=u'trigrams', to=orm['nutrition.Report'])),
+            ('field', self.gf('django.db.models.fields.CharField')(max_length=1)),
+            ('trigram', self.gf('django.db.models.fields.CharField')(max_length=3)),
+        ))
+        db.send_create_signal(u'nutrition', ['ReportTrigram'])
+
+        # Adding unique constraint on 'ReportTrigram', fields ['trigram', 'field', 'report']
+        db.create_unique(u'nutrition_reporttrigram', ['trigram', 'field', 'report_id'])
+
+        # Adding index on 'Report', fields ['reporter_id']
+        db.create_index(u'nutrition_report', ['reporter_id'])
+
+        if use_trigram_indexes():
+            # Index the expression used by Django's case-insensitive lookups.
+            db.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+            for name, column in TRIGRAM_INDEXES:
+                db.execute('CREATE INDEX {0} ON nutrition_report USING gin '
+                        '(UPPER({1}::text) gin_trgm_ops)'.format(name, column))
+
+    def backwards(self, orm):
+        if use_trigram_indexes():
+            for name, column in TRIGRAM_INDEXES:
+                db.execute('DROP INDEX IF EXISTS {0}'.format(name))
+
+        # Removing index on 'Report', fields ['reporter_id']
+        db.delete_index(u'nutrition_report', ['reporter_id'])
+
+        # Removing unique constraint on 'ReportTrigram', fields ['trigram', 'field', 'report']
+        db.delete_unique(u'nutrition_reporttrigram', ['trigram', 'field', 'report_id'])
+
+        # Deleting model 'ReportTrigram'
+        db.delete_table(u'nutrition_reporttrigram')
+
+
+    models = {
+        u'nutrition.report': {
+            'Meta': {'object_name': 'Report'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'global_patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'global_reporter_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'height4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'muac': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'oedema': ('django.db.models.fields.NullBooleanField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'raw_text': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'reporter_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "u'U'", 'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'weight': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'weight4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            'weight4height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'})
+        },
+        u'nutrition.reporttrigram': {
+            'Meta': {'unique_together': "[(u'trigram', u'field', u'report')]", 'object_name': 'ReportTrigram'},
+            'field': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'report': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'trigrams'", 'to': u"orm['nutrition.Report']"}),
+            'trigram': ('django.db.models.fields.CharField', [], {'max_length': '3'})
+        }
+    }
+
+    complete_apps = ['nutrition']
\ No newline at end of file
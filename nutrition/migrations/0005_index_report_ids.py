@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import DataMigration
+from django.db import models
+
+from nutrition.search import FIELDS, get_trigrams, use_trigram_indexes
+
+
+class Migration(DataMigration):
+
+    def forwards(self, orm):
+        "Stores the trigrams of existing reports' patient and reporter IDs."
+        if use_trigram_indexes():
+            return
+        reports = orm.Report.objects.order_by('pk')
+        reports = reports.values_list('pk', 'patient_id', 'reporter_id')
+        last = 0
+        while True:
+            chunk = list(reports.filter(pk__gt=last)[:1000])
+            if not chunk:
+                break
+            trigrams = []
+            for pk, patient_id, reporter_id in chunk:
+                for field, value in (('patient_id', patient_id),
+                        ('reporter_id', reporter_id)):
+                    for trigram in get_trigrams(value):
+                        trigrams.append(orm.ReportTrigram(report_id=pk,
+                                field=FIELDS[field], trigram=trigram))
+            orm.ReportTrigram.objects.bulk_create(trigrams)
+            last = chunk[-1][0]
+
+    def backwards(self, orm):
+        "Deletes all report trigrams."
+        orm.ReportTrigram.objects.all().delete()
+
+    models = {
+        u'nutrition.report': {
+            'Meta': {'object_name': 'Report'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'blank': 'True'}),
+            'global_patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'global_reporter_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'height4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'muac': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'oedema': ('django.db.models.fields.NullBooleanField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'raw_text': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'reporter_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "u'U'", 'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'weight': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'weight4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            'weight4height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'})
+        },
+        u'nutrition.reporttrigram': {
+            'Meta': {'unique_together': "[(u'trigram', u'field', u'report')]", 'object_name': 'ReportTrigram'},
+            'field': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'report': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'trigrams'", 'to': u"orm['nutrition.Report']"}),
+            'trigram': ('django.db.models.fields.CharField', [], {'max_length': '3'})
+        }
+    }
+
+    complete_apps = ['nutrition']
+    symmetrical = True
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+from south.utils import datetime_utils as datetime
+from south.db import db
+from south.v2 import SchemaMigration
+from django.conf import settings
+from django.db import models
+
+
+TABLES = [u'nutrition_report', u'nutrition_archivedreport']
+
+# (column, decimal places) of each field which may use fixed-point storage.
+COLUMNS = [
+    ('height', 1),
+    ('weight', 1),
+    ('muac', 1),
+    ('weight4age', 2),
+    ('height4age', 2),
+    ('weight4height', 2),
+]
+
+
+def use_fixed_point_storage():
+    return getattr(settings, 'NUTRITION_FIXED_POINT_STORAGE', False)
+
+
+class Migration(SchemaMigration):
+
+    def forwards(self, orm):
+        "Converts measurements and z-scores to fixed-point integers."
+        if not use_fixed_point_storage():
+            return
+        for table in TABLES:
+            for column, places in COLUMNS:
+                field = self.gf('django.db.models.fields.IntegerField')(
+                        null=True, blank=True)
+                self._replace_column(table, column, field,
+                        'ROUND({0} * {1})'.format(column, 10 ** places))
+
+    def backwards(self, orm):
+        "Converts fixed-point integers back to decimal numbers."
+        if not use_fixed_point_storage():
+            return
+        for table in TABLES:
+            for column, places in COLUMNS:
+                field = self.gf('django.db.models.fields.DecimalField')(
+                        null=True, max_digits=4, decimal_places=places,
+                        blank=True)
+                self._replace_column(table, column, field,
+                        '{0} / {1}.0'.format(column, 10 ** places))
+
+    def _replace_column(self, table, column, field, expression):
+        temporary = '{0}_tmp'.format(column)
+        db.add_column(table, temporary, field, keep_default=False)
+        db.execute('UPDATE {0} SET {1} = {2}'.format(db.quote_name(table),
+                db.quote_name(temporary), expression))
+        db.delete_column(table, column)
+        db.rename_column(table, temporary, column)
+
+    models = {
+        u'nutrition.archivedreport': {
+            'Meta': {'object_name': 'ArchivedReport'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'archived': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'db_index': 'True'}),
+            'global_patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'global_reporter_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'height4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            'id': ('django.db.models.fields.IntegerField', [], {'primary_key': 'True'}),
+            'muac': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'oedema': ('django.db.models.fields.NullBooleanField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'raw_text': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'reporter_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "u'U'", 'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {}),
+            'weight': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'weight4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            'weight4height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'})
+        },
+        u'nutrition.report': {
+            'Meta': {'object_name': 'Report'},
+            'active': ('django.db.models.fields.BooleanField', [], {'default': 'True'}),
+            'created': ('django.db.models.fields.DateTimeField', [], {'auto_now_add': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'global_patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255'}),
+            'global_reporter_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'height4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'muac': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'oedema': ('django.db.models.fields.NullBooleanField', [], {'default': 'None', 'null': 'True', 'blank': 'True'}),
+            'patient_id': ('django.db.models.fields.CharField', [], {'max_length': '255', 'db_index': 'True'}),
+            'raw_text': ('django.db.models.fields.CharField', [], {'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'reporter_id': ('django.db.models.fields.CharField', [], {'db_index': 'True', 'max_length': '255', 'null': 'True', 'blank': 'True'}),
+            'status': ('django.db.models.fields.CharField', [], {'default': "u'U'", 'max_length': '1', 'null': 'True', 'blank': 'True'}),
+            'updated': ('django.db.models.fields.DateTimeField', [], {'auto_now': 'True', 'db_index': 'True', 'blank': 'True'}),
+            'weight': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '1', 'blank': 'True'}),
+            'weight4age': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'}),
+            'weight4height': ('django.db.models.fields.DecimalField', [], {'null': 'True', 'max_digits': '4', 'decimal_places': '2', 'blank': 'True'})
+        },
+        u'nutrition.reporttrigram': {
+            'Meta': {'unique_together': "[(u'trigram', u'field', u'report')]", 'object_name': 'ReportTrigram'},
+            'field': ('django.db.models.fields.CharField', [], {'max_length': '1'}),
+            u'id': ('django.db.models.fields.AutoField', [], {'primary_key': 'True'}),
+            'report': ('django.db.models.fields.related.ForeignKey', [], {'related_name': "u'trigrams'", 'to': u"orm['nutrition.Report']"}),
+            'trigram': ('django.db.models.fields.CharField', [], {'max_length': '3'})
+        }
+    }
+
+    complete_apps = ['nutrition']
\ No newline at end of file
@@ -1,17 +1,133 @@
 from __future__ import unicode_literals
 import datetime
 from decimal import Decimal
-from pygrowup.exceptions import InvalidMeasurement
-from pygrowup.pygrowup import Calculator
+import hashlib
 
-from django.db import models
+from django.conf import settings
+from django.db import connections, models, router, transaction
+from django.utils import timezone
+from django.utils.encoding import force_unicode
+from django.utils.timezone import now
 from django.utils.translation import ugettext_lazy as _
 
 from healthcare.api import client
+from healthcare.backends import comparisons
 from healthcare.exceptions import PatientDoesNotExist, ProviderDoesNotExist
 
+from nutrition import classification, events, growth, lookups, search
+from nutrition.counts import report_counts
+from nutrition.fields import decimal_field
 
-class Report(models.Model):
+
+class BaseReportManager(models.Manager):
+
+    def created_between(self, start_date=None, end_date=None):
+        """Returns reports created from start_date through end_date.
+
+        Either date may be None to leave that end of the range open. Dates
+        are interpreted in the current time zone, and the range is converted
+        to bounds on the indexed created column.
+        """
+        reports = self.all()
+        if start_date:
+            reports = reports.filter(created__gte=self._midnight(start_date))
+        if end_date:
+            end_date += datetime.timedelta(days=1)
+            reports = reports.filter(created__lt=self._midnight(end_date))
+        return reports
+
+    def _midnight(self, date):
+        value = datetime.datetime.combine(date, datetime.time())
+        if settings.USE_TZ:
+            value = timezone.make_aware(value,
+                    timezone.get_current_timezone())
+        return value
+
+
+class ReportManager(BaseReportManager):
+
+    def get_version(self):
+        """Returns a cheap version of the reports table.
+
+        The version is a (last_updated, last_id, counts_version) tuple,
+        which changes whenever a report is created, updated or deleted.
+        last_updated is None if there are no reports.
+        """
+        version = self.aggregate(last_updated=models.Max('updated'),
+                last_id=models.Max('pk'))
+        return (version['last_updated'], version['last_id'],
+                report_counts.version)
+
+    def cancel_latest(self, patient_id, global_reporter_id=None):
+        """Cancels the patient's most recently created active report.
+
+        Only reports sent by the given reporter (or anonymously, if
+        global_reporter_id is None) are considered. The report is chosen
+        and cancelled by a single UPDATE, whose condition selects the most
+        recent active report with the index on (patient_id, active,
+        created), so concurrent requests never cancel the same report
+        twice. On PostgreSQL, the UPDATE returns the report; elsewhere, the
+        report is read by its new updated time within the same transaction.
+
+        Raises Report.DoesNotExist if there is no active report to cancel.
+        """
+        using = router.db_for_write(self.model)
+        connection = connections[using]
+        qn = connection.ops.quote_name
+        opts = self.model._meta
+        columns = dict((name, qn(opts.get_field(name).column))
+                for name in ('active', 'updated', 'created', 'patient_id',
+                        'global_reporter_id'))
+        prep = lambda name, value: opts.get_field(name).get_db_prep_value(
+                value, connection)
+        updated = now()
+        params = [prep('active', False), prep('updated', updated),
+                prep('patient_id', patient_id)]
+        if global_reporter_id is None:
+            reporter = '{global_reporter_id} IS NULL'
+        else:
+            reporter = '{global_reporter_id} = %s'
+            params.append(prep('global_reporter_id', global_reporter_id))
+        params.extend([prep('active', True)] * 2)
+        # MySQL only selects from the table being updated through a
+        # derived table.
+        sql = ('UPDATE {table} SET {active} = %s, {updated} = %s '
+                'WHERE {pk} = (SELECT {pk} FROM (SELECT {pk} FROM {table} '
+                'WHERE {patient_id} = %s AND ' + reporter + ' AND '
+                '{active} = %s ORDER BY {created} DESC, {pk} DESC LIMIT 1) '
+                'latest) AND {active} = %s').format(
+                table=qn(opts.db_table), pk=qn(opts.pk.column), **columns)
+        returning = connection.vendor == 'postgresql'
+        if returning:
+            sql += ' RETURNING {0}'.format(', '.join(qn(field.column)
+                    for field in opts.fields))
+        with events.atomic(using):
+            cursor = connection.cursor()
+            cursor.execute(sql, params)
+            transaction.set_dirty(using=using)
+            report = None
+            if returning:
+                row = cursor.fetchone()
+                if row:
+                    report = self.model(*row)
+                    report._state.db = using
+                    report._state.adding = False
+            elif cursor.rowcount:
+                report = self.using(using).filter(patient_id=patient_id,
+                        global_reporter_id=global_reporter_id, active=False,
+                        updated=updated).order_by('-created', '-pk')[0]
+            if report is None:
+                msg = 'Patient {0} has no active reports.'.format(patient_id)
+                raise self.model.DoesNotExist(msg)
+            ReportEvent.objects.using(using).create(report_id=report.pk,
+                    kind=ReportEvent.CANCELLED, status=report.status)
+        # UPDATE sends no post_save signal.
+        report_counts.invalidate()
+        return report
+
+
+class ReportBase(models.Model):
+    """Fields and patient details shared by current and archived reports."""
     UNANALYZED = 'U'  # The report has not yet been analyzed.
     ANALYZED = 'A'  # The report analysis ran completely.
     SUSPECT = 'S'  # Measurements are beyond reasonable limits.
@@ -25,11 +141,8 @@ class Report(models.Model):
         (ERROR, _('Error')),
     ]
 
-    # Meta data.
+    # Meta data. Subclasses define when the report was created and updated.
     raw_text = models.CharField(max_length=255, null=True, blank=True)
-    created = models.DateTimeField(auto_now_add=True,
-            verbose_name='report date')
-    updated = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=1, blank=True, null=True,
             choices=STATUSES, default=UNANALYZED)
     active = models.BooleanField(default=True)
@@ -37,36 +150,45 @@ class Report(models.Model):
     # Local identifiers, unique to the nutrition healthcare sources defined in
     # the project settings.
     # If source is None, these will be equivalent to the global identifiers.
-    reporter_id = models.CharField(max_length=255, blank=True, null=True)
-    patient_id = models.CharField(max_length=255)
+    reporter_id = models.CharField(max_length=255, blank=True, null=True,
+            db_index=True)
+    patient_id = models.CharField(max_length=255, db_index=True)
 
     # Global identifiers, created by rapidsms-healthcare.
     global_reporter_id = models.CharField(max_length=255, blank=True,
             null=True)
-    global_patient_id = models.CharField(max_length=255)
+    global_patient_id = models.CharField(max_length=255, db_index=True)
 
     # Indicators, gathered from the reporter.
-    height = models.DecimalField(max_digits=4, decimal_places=1, blank=True,
+    height = decimal_field(max_digits=4, decimal_places=1, blank=True,
             null=True, verbose_name='Height (CM)')
-    weight = models.DecimalField(max_digits=4, decimal_places=1, blank=True,
+    weight = decimal_field(max_digits=4, decimal_places=1, blank=True,
             null=True, verbose_name='Weight (KG)')
-    muac = models.DecimalField(max_digits=4, decimal_places=1, blank=True,
+    muac = decimal_field(max_digits=4, decimal_places=1, blank=True,
             null=True, verbose_name='MUAC (CM)')
     oedema = models.NullBooleanField(default=None)
 
     # Nutrition z-scores, calcuated from indicators.
-    weight4age = models.DecimalField(max_digits=4, decimal_places=2,
+    weight4age = decimal_field(max_digits=4, decimal_places=2,
             blank=True, null=True, verbose_name='Weight for Age')
-    height4age = models.DecimalField(max_digits=4, decimal_places=2,
+    height4age = decimal_field(max_digits=4, decimal_places=2,
             blank=True, null=True, verbose_name='Height for Age')
-    weight4height = models.DecimalField(max_digits=4, decimal_places=2,
+    weight4height = decimal_field(max_digits=4, decimal_places=2,
             blank=True, null=True, verbose_name='Weight for Height')
 
+    # Fingerprint of the patient details used by the last analysis.
+    demographics = models.CharField(max_length=32, blank=True, null=True)
+
+    # Classifications, derived from indicators and z-scores.
+    wasting = models.CharField(max_length=1, blank=True, null=True,
+            choices=classification.WASTING_CLASSIFICATIONS, db_index=True)
+    stunting = models.CharField(max_length=1, blank=True, null=True,
+            choices=classification.CLASSIFICATIONS, db_index=True)
+    underweight = models.CharField(max_length=1, blank=True, null=True,
+            choices=classification.CLASSIFICATIONS, db_index=True)
+
     class Meta:
-        permissions = (
-            ('view_report', 'Can View Nutrition Reports'),
-        )
-        verbose_name = 'nutrition report'
+        abstract = True
 
     def __unicode__(self):
         return 'Patient {0} on {1}'.format(self.patient_id,
@@ -79,16 +201,185 @@ class Report(models.Model):
         the nearest full month.
         """
         birth_date = self.patient.get('birth_date', None)
+        # An unsaved report is treated as being created today.
+        created = self.created.date() if self.created else now().date()
+        return self.age_in_months(birth_date, created)
+
+    @staticmethod
+    def age_in_months(birth_date, date):
+        """Returns the age on date, rounded down to the nearest full month.
+
+        Returns None if birth_date is not set.
+        """
         if birth_date:
-            diff = self.created.date() - birth_date
+            diff = date - birth_date
             return int(diff.days / 30.475)
 
+    def classify(self, cutoffs=None):
+        """Sets the wasting, stunting and underweight classifications.
+
+        See nutrition.classification. The report is not saved.
+        """
+        cutoffs = cutoffs or classification.get_cutoffs()
+        self.wasting = classification.classify_wasting(self.weight4height,
+                self.muac, self.oedema, cutoffs)
+        self.stunting = classification.classify_zscore(self.height4age,
+                cutoffs)
+        self.underweight = classification.classify_zscore(self.weight4age,
+                cutoffs)
+        return self
+
+    @staticmethod
+    def get_demographics(patient):
+        """Returns a fingerprint of the patient details used by analysis.
+
+        Reports whose stored fingerprint differs from their patient's
+        current one were analyzed with out-of-date details.
+        """
+        patient = patient or {}
+        values = [patient.get('birth_date'), patient.get('sex')]
+        values = '|'.join([force_unicode(v) if v is not None else ''
+                for v in values])
+        return hashlib.md5(values.encode('utf-8')).hexdigest()
+
+    def get_oedema_display(self):
+        if self.oedema is None:
+            return 'Unknown'
+        return 'Yes' if self.oedema else 'No'
+
+    @property
+    def reporter(self):
+        """Retrieves the provider record associated with this report.
+
+        If a caller requires that the provider record actually exist, it must
+        ensure that reporter is not None.
+        """
+        if not hasattr(self, '_reporter'):
+            if not self.global_reporter_id:
+                self._reporter = None
+            else:
+                try:
+                    self._reporter = client.providers.get(
+                            self.global_reporter_id)
+                except ProviderDoesNotExist:
+                    self._reporter = None
+        return self._reporter
+
+    @property
+    def indicators(self):
+        return {
+            'height': self.height,
+            'weight': self.weight,
+            'muac': self.muac,
+            'oedema': self.get_oedema_display(),
+        }
+
+    @property
+    def location(self):
+        """Returns the patient's location."""
+        return self.patient.get('location', None)
+
+    @property
+    def patient(self):
+        """Retrieves the patient record associated with this report.
+
+        If a caller requires that the patient record actually exist, it must
+        ensure that patient is not None.
+        """
+        if not hasattr(self, '_patient'):
+            try:
+                self._patient = client.patients.get(self.global_patient_id)
+            except PatientDoesNotExist:
+                self._patient = None
+        return self._patient
+
+    @classmethod
+    def prefetch_patients(cls, reports):
+        """Retrieves the patient records for many reports at once.
+
+        Patients are fetched with a single healthcare backend query, rather
+        than one query per report when each report's patient is accessed.
+        If the backend cannot filter patients, they are instead retrieved
+        with concurrent lookups. Reports whose patient has already been
+        retrieved are skipped.
+        """
+        reports = [r for r in reports if not hasattr(r, '_patient')]
+        patients = cls.get_patients([r.global_patient_id for r in reports])
+        for report in reports:
+            report._patient = patients.get(report.global_patient_id)
+
+    @classmethod
+    def get_patients(cls, global_patient_ids):
+        """Returns a dictionary mapping global patient ids to their records.
+
+        See prefetch_patients. Patients which do not exist are omitted.
+        """
+        ids = set(global_patient_ids)
+        if not ids:
+            return {}
+        try:
+            return cls._filter_patients(ids)
+        except NotImplementedError:
+            return lookups.get_patients(ids)
+
+    @staticmethod
+    def _filter_patients(ids):
+        """Returns a dictionary of patient records retrieved by filtering."""
+        # Global identifiers are stored as strings, but the backend may use
+        # integers.
+        values = set(ids)
+        for patient_id in ids:
+            try:
+                values.add(int(patient_id))
+            except (TypeError, ValueError):
+                pass
+        # The client's filter() does not pass lookups through to the backend
+        # correctly in rapidsms-healthcare 0.1.0, so we query it directly.
+        lookup = ('id', comparisons.IN, list(values))
+        patients = client.patients.backend.filter_patients(lookup)
+        return dict([(unicode(p['id']), p) for p in patients])
+
+    @property
+    def sex(self):
+        """Returns the patient's sex."""
+        return self.patient.get('sex', None)
+
+    @property
+    def zscores(self):
+        return {
+            'weight4age': self.weight4age,
+            'height4age': self.height4age,
+            'weight4height': self.weight4height,
+        }
+
+
+class Report(ReportBase):
+    created = models.DateTimeField(auto_now_add=True, db_index=True,
+            verbose_name='report date')
+    updated = models.DateTimeField(auto_now=True, db_index=True)
+
+    objects = ReportManager()
+
+    class Meta:
+        # The indexes on (patient_id, active, created), which finds a
+        # patient's latest active report, and on each classification and
+        # active, which lists active cases, are created by migrations, as
+        # Django 1.4 has no index_together.
+        permissions = (
+            ('view_report', 'Can View Nutrition Reports'),
+        )
+        verbose_name = 'nutrition report'
+
     def analyze(self, save=True, calculator=None):
         """Uses pygrowup to calculate z-scores from indicator data.
 
         If save is True, then the Report will be saved in its updated state.
         """
-        calculator = calculator or Calculator(False, False, False)
+        # pygrowup is only imported once it is needed.
+        from pygrowup.exceptions import InvalidMeasurement
+        calculator = calculator or growth.get_calculator()
+        self._analyzed = True  # Logged when the report is next saved.
+        self.demographics = self.get_demographics(self.patient)
 
         # If the patient's birth_date or sex is not present, pygrowup
         # cannot analyze the measurements. If neither weight nor height is
@@ -99,6 +390,7 @@ class Report(models.Model):
             self.height4age = None
             self.weight4height = None
             self.status = Report.INCOMPLETE
+            self.classify()
             if save:
                 self.save()
             return self
@@ -130,6 +422,7 @@ class Report(models.Model):
             # all calculations and set the status to suspect.
             self.reset_zscores(save=False)
             self.status = Report.SUSPECT
+            self.classify()
             if save:
                 self.save()
             raise e
@@ -141,86 +434,119 @@ class Report(models.Model):
             # propagating.
             self.reset_zscores(save=False)
             self.status = Report.ERROR
+            self.classify()
             if save:
                 self.save()
             raise e
 
+        self.classify()
         if save:
             self.save()
         return self
 
     def cancel(self, save=True):
+        """Marks the report as cancelled.
+
+        If save is True, only the active and updated columns are written, and
+        only if the report is still active in the database. Returns False if
+        the report had already been cancelled.
+        """
         self.active = False
+        if save:
+            self.updated = now()
+            reports = Report.objects.filter(pk=self.pk, active=True)
+            with events.atomic(reports.db):
+                if not reports.update(active=False, updated=self.updated):
+                    return False
+                ReportEvent.objects.using(reports.db).create(
+                        report_id=self.pk, kind=ReportEvent.CANCELLED,
+                        status=self.status)
+            # update() sends no post_save signal.
+            report_counts.invalidate()
+        return True
+
+    def save(self, *args, **kwargs):
+        # Events are logged in the same transaction as the change.
+        using = kwargs.get('using') or router.db_for_write(Report,
+                instance=self)
+        with events.atomic(using):
+            super(Report, self).save(*args, **kwargs)
+
+    def reset_zscores(self, save=True):
+        self.weight4age = None
+        self.height4age = None
+        self.weight4height = None
         if save:
             self.save()
 
-    def get_oedema_display(self):
-        if self.oedema is None:
-            return 'Unknown'
-        return 'Yes' if self.oedema else 'No'
 
-    @property
-    def reporter(self):
-        """Retrieves the provider record associated with this report.
+class ArchivedReport(ReportBase):
+    """A report which has been moved out of the Report table.
 
-        If a caller requires that the provider record actually exist, it must
-        ensure that reporter is not None.
-        """
-        if not hasattr(self, '_reporter'):
-            if not self.global_reporter_id:
-                self._reporter = None
-            else:
-                try:
-                    self._reporter = client.providers.get(
-                            self.global_reporter_id)
-                except ProviderDoesNotExist:
-                    self._reporter = None
-        return self._reporter
+    Cancelled and old reports are archived so that they no longer weigh on
+    the queries and indexes of current reports. See nutrition.archive.
+    """
+    # The report's original primary key, which is kept on restore.
+    id = models.IntegerField(primary_key=True)
+    created = models.DateTimeField(db_index=True, verbose_name='report date')
+    updated = models.DateTimeField()
+    archived = models.DateTimeField(db_index=True)
 
-    @property
-    def indicators(self):
-        return {
-            'height': self.height,
-            'weight': self.weight,
-            'muac': self.muac,
-            'oedema': self.get_oedema_display(),
-        }
+    objects = BaseReportManager()
 
-    @property
-    def location(self):
-        """Returns the patient's location."""
-        return self.patient.get('location', None)
+    class Meta:
+        verbose_name = 'archived nutrition report'
 
-    @property
-    def patient(self):
-        """Retrieves the patient record associated with this report.
 
-        If a caller requires that the patient record actually exist, it must
-        ensure that patient is not None.
-        """
-        if not hasattr(self, '_patient'):
-            try:
-                self._patient = client.patients.get(self.global_patient_id)
-            except PatientDoesNotExist:
-                self._patient = None
-        return self._patient
+class ReportEvent(models.Model):
+    """An entry in the append-only log of changes to reports.
 
-    def reset_zscores(self, save=True):
-        self.weight4age = None
-        self.height4age = None
-        self.weight4height = None
-        if save:
-            self.save()
+    The primary key is the event's sequence number. See nutrition.events.
+    """
+    CREATED = 'created'
+    ANALYZED = 'analyzed'
+    STATUS_CHANGED = 'status_changed'
+    CANCELLED = 'cancelled'
+    KINDS = [
+        (CREATED, _('Created')),
+        (ANALYZED, _('Analyzed')),
+        (STATUS_CHANGED, _('Status changed')),
+        (CANCELLED, _('Cancelled')),
+    ]
 
-    @property
-    def sex(self):
-        """Returns the patient's sex."""
-        return self.patient.get('sex', None)
+    # Not a foreign key, so that events outlive archived reports.
+    report_id = models.IntegerField()
+    kind = models.CharField(max_length=16, choices=KINDS)
+    status = models.CharField(max_length=1, blank=True, null=True,
+            choices=Report.STATUSES)
+    time = models.DateTimeField(auto_now_add=True)
 
-    @property
-    def zscores(self):
-        return {
-            'weight4age': self.weight4age,
-            'height4age': self.height4age,
-            'weight4height': self.weight4height,
-        }
+
+class ReportTrigram(models.Model):
+    """A trigram of a report's patient or reporter ID.
+
+    Used to search for IDs by prefix or substring on databases without
+    trigram indexes of their own. See nutrition.search.
+    """
+    FIELDS = [
+        (search.FIELDS['patient_id'], _('Patient ID')),
+        (search.FIELDS['reporter_id'], _('Reporter ID')),
+    ]
+
+    report = models.ForeignKey(Report, related_name='trigrams')
+    field = models.CharField(max_length=1, choices=FIELDS)
+    trigram = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = [('trigram', 'field', 'report')]
+
+
+models.signals.post_init.connect(report_counts.report_initialized,
+        sender=Report)
+models.signals.post_save.connect(report_counts.report_saved, sender=Report)
+models.signals.post_delete.connect(report_counts.report_deleted,
+        sender=Report)
+models.signals.post_init.connect(search.report_initialized, sender=Report)
+models.signals.post_save.connect(search.report_saved, sender=Report)
+models.signals.post_init.connect(events.report_initialized, sender=Report)
+models.signals.post_save.connect(events.report_saved, sender=Report)
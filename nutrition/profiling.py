@@ -0,0 +1,108 @@
+from __future__ import unicode_literals
+import datetime
+import glob
+import logging
+import os
+import random
+import tempfile
+
+from django.conf import settings
+
+
+__all__ = ['get_profile_dir', 'get_profile_rate', 'list_profiles',
+        'save_profile', 'should_profile']
+
+
+logger = logging.getLogger(__name__)
+
+
+def get_profile_dir():
+    """Returns the directory in which handler profiles are stored."""
+    default = os.path.join(tempfile.gettempdir(), 'nutrition-profiles')
+    return getattr(settings, 'NUTRITION_PROFILE_DIR', None) or default
+
+
+def get_profile_rate():
+    """Returns N, where 1 in N messages should be profiled.
+
+    The NUTRITION_PROFILE_RATE environment variable takes precedence over
+    the setting of the same name, so that profiling can be switched on for
+    a single process. Returns 0 if profiling is disabled.
+    """
+    rate = os.environ.get('NUTRITION_PROFILE_RATE')
+    if rate is None:
+        rate = getattr(settings, 'NUTRITION_PROFILE_RATE', 0)
+    try:
+        return max(int(rate or 0), 0)
+    except ValueError:
+        logger.warning('Invalid NUTRITION_PROFILE_RATE: {0}'.format(rate))
+        return 0
+
+
+def should_profile():
+    """Randomly selects 1 in NUTRITION_PROFILE_RATE messages."""
+    rate = get_profile_rate()
+    return bool(rate) and random.randint(1, rate) == 1
+
+
+def parse_profile_name(path):
+    """Returns the keyword and outcome of a saved profile's file name.
+
+    Returns None if the file was not saved by save_profile.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    parts = name.split('-', 3)
+    if len(parts) != 4 or not (parts[0].isdigit() and parts[1].isdigit()):
+        return None
+    return parts[2], parts[3]
+
+
+def list_profiles(directory=None, keyword=None, outcome=None):
+    """Returns the paths of saved profiles, oldest first.
+
+    Profiles may be filtered by the handler keyword and by the outcome, i.e.,
+    the type of message the handler responded with. Other .prof files in the
+    directory are ignored.
+    """
+    directory = directory or get_profile_dir()
+    paths = []
+    for path in sorted(glob.glob(os.path.join(directory, '*.prof'))):
+        tags = parse_profile_name(path)
+        if tags is None:
+            continue
+        if keyword and tags[0] != keyword:
+            continue
+        if outcome and tags[1] != outcome:
+            continue
+        paths.append(path)
+    return paths
+
+
+def save_profile(profile, keyword, outcome):
+    """Writes profile stats to the profile directory.
+
+    File names are tagged with the time, process, keyword and outcome. Only
+    the most recent NUTRITION_PROFILE_KEEP profiles are kept; with 0, the
+    profile is not written and None is returned.
+    """
+    keep = max(getattr(settings, 'NUTRITION_PROFILE_KEEP', 100), 0)
+    if not keep:
+        return None
+    directory = get_profile_dir()
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            pass  # Another process may have created it.
+    timestamp = datetime.datetime.now().strftime('%Y%m%d%H%M%S%f')
+    name = '{0}-{1}-{2}-{3}.prof'.format(timestamp, os.getpid(), keyword,
+            outcome)
+    path = os.path.join(directory, name)
+    profile.dump_stats(path)
+
+    for old in list_profiles(directory)[:-keep]:
+        try:
+            os.remove(old)
+        except OSError:
+            pass  # Another process may have removed it.
+    return path
@@ -0,0 +1,191 @@
+from __future__ import unicode_literals
+from array import array
+from itertools import islice
+import math
+
+import numpy
+
+from nutrition.models import Report
+from nutrition.surveys import WHO_FLAGS, ZSCORES, select_floats, to_numpy
+
+
+__all__ = ['GROUPS', 'MEASUREMENTS', 'check_quality', 'digit_preference']
+
+
+GROUPS = ('reporter', 'location')
+
+# Measurements are recorded to one decimal place; the terminal digit is the
+# tenths digit.
+MEASUREMENTS = ['height', 'weight', 'muac']
+
+# Groups are judged once they have at least this many values of a field.
+MINIMUM_VALUES = 20
+# SMART rates digit preference scores above 20 as problematic.
+DIGIT_PREFERENCE_LIMIT = 20
+# The standard deviation of z-scores should be close to 1.
+SD_RANGE = (0.8, 1.2)
+# Share of WHO-flagged z-scores above which a group is problematic.
+FLAGGED_LIMIT = 0.075
+
+
+def digit_preference(digits):
+    """Returns the digit preference score of counts of terminal digits.
+
+    The score, as defined by SMART, is 0 if each digit is equally common
+    and 100 if every value ends in the same digit.
+    """
+    digits = numpy.asarray(digits, dtype=numpy.float64)
+    n = digits.sum()
+    if not n:
+        return None
+    expected = n / len(digits)
+    chi2 = ((digits - expected) ** 2 / expected).sum()
+    return 100 * math.sqrt(chi2 / ((len(digits) - 1) * n))
+
+
+class _Totals(object):
+    """Sums of per-group counts over chunks of reports.
+
+    Groups are numbered in the order they are first seen, so a chunk's
+    counts cover at least as many groups as those of earlier chunks.
+    """
+
+    def __init__(self):
+        self.labels = {}
+        self.sums = {}
+
+    def add(self, key, counts):
+        total = self.sums.get(key)
+        if total is not None:
+            counts[:len(total)] += total
+        self.sums[key] = counts
+
+    def get(self, key, i):
+        total = self.sums.get(key)
+        if total is None or i >= len(total):
+            return 0
+        return total[i]
+
+
+def check_quality(queryset, group_by=('reporter',), chunk_size=10000):
+    """Returns data quality statistics of each group of reports.
+
+    Cancelled reports are left out. group_by may include 'reporter' and
+    'location', which requires patient records. Reports are read
+    chunk_size at a time, and only the per-group totals are kept, so
+    memory use does not grow with the number of reports.
+
+    For each measurement, the distribution of terminal digits, the digit
+    preference score and the share of values which end in 0 or 5 (heaping)
+    are computed. For each z-score, the share of values flagged as
+    implausible by WHO (see nutrition.surveys.WHO_FLAGS) and the standard
+    deviation of the remaining values are computed. problems lists the
+    checks a group fails, e.g., to find reporters who need retraining.
+    """
+    group_by = list(group_by)
+    unknown = set(group_by) - set(GROUPS)
+    if unknown:
+        raise ValueError('Unknown group(s): {0}.'.format(
+                ', '.join(sorted(unknown))))
+    fields = MEASUREMENTS + ZSCORES
+    queryset = queryset.filter(active=True)
+    queryset, names = select_floats(queryset, fields)
+    rows = queryset.values_list(*(names + ['reporter_id',
+            'global_patient_id'])).iterator()
+    totals = _Totals()
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            break
+        _add_chunk(totals, chunk, fields, group_by)
+    labels = sorted(totals.labels, key=totals.labels.get)
+    return [_result(totals, i, dict(zip(group_by, label)))
+            for i, label in enumerate(labels)]
+
+
+def _add_chunk(totals, chunk, fields, group_by):
+    locations = {}
+    if 'location' in group_by:
+        patients = Report.get_patients([row[-1] for row in chunk])
+        locations = dict((global_patient_id, patient.get('location'))
+                for global_patient_id, patient in patients.items())
+    group = numpy.empty(len(chunk), dtype=numpy.intp)
+    values = [array(str('d')) for field in fields]
+    nan = float('nan')
+    for i, row in enumerate(chunk):
+        for column, value in zip(values, row):
+            column.append(nan if value is None else value)
+        label = tuple(row[-2] if name == 'reporter' else
+                locations.get(row[-1]) for name in group_by)
+        group[i] = totals.labels.setdefault(label, len(totals.labels))
+    groups = len(totals.labels)
+    totals.add('reports', numpy.bincount(group, minlength=groups))
+    columns = dict((field, to_numpy(column, field))
+            for field, column in zip(fields, values))
+    for field in MEASUREMENTS:
+        column = columns[field]
+        known = ~numpy.isnan(column)
+        digits = numpy.round(numpy.abs(column[known]) * 10).astype(
+                numpy.intp) % 10
+        counts = numpy.bincount(group[known] * 10 + digits,
+                minlength=groups * 10)
+        totals.add((field, 'digits'), counts.reshape(groups, 10))
+    for field in ZSCORES:
+        column = columns[field]
+        known = ~numpy.isnan(column)
+        low, high = WHO_FLAGS[field]
+        with numpy.errstate(invalid='ignore'):
+            flagged = known & ((column < low) | (column > high))
+        valid = known & ~flagged
+        totals.add((field, 'n'), numpy.bincount(group[known],
+                minlength=groups))
+        totals.add((field, 'flagged'), numpy.bincount(group[flagged],
+                minlength=groups))
+        totals.add((field, 'valid'), numpy.bincount(group[valid],
+                minlength=groups))
+        totals.add((field, 'sum'), numpy.bincount(group[valid],
+                weights=column[valid], minlength=groups))
+        totals.add((field, 'squares'), numpy.bincount(group[valid],
+                weights=column[valid] ** 2, minlength=groups))
+
+
+def _result(totals, i, group):
+    result = {'group': group, 'reports': int(totals.get('reports', i)),
+            'problems': []}
+    problems = result['problems']
+    for field in MEASUREMENTS:
+        digits = totals.sums[(field, 'digits')][i]
+        n = int(digits.sum())
+        preference = digit_preference(digits)
+        result[field] = {
+            'n': n,
+            'digits': [int(count) for count in digits],
+            'preference': preference,
+            'heaping': float(digits[0] + digits[5]) / n if n else None,
+        }
+        if n >= MINIMUM_VALUES and preference > DIGIT_PREFERENCE_LIMIT:
+            problems.append('{0} digit preference score is {1:.0f}'.format(
+                    field, preference))
+    for field in ZSCORES:
+        n = int(totals.get((field, 'n'), i))
+        flagged = int(totals.get((field, 'flagged'), i))
+        valid = int(totals.get((field, 'valid'), i))
+        sd = None
+        if valid > 1:
+            mean = totals.get((field, 'sum'), i) / valid
+            variance = (totals.get((field, 'squares'), i) -
+                    valid * mean * mean) / (valid - 1)
+            sd = math.sqrt(max(variance, 0.0))
+        share = float(flagged) / n if n else None
+        result[field] = {'n': n, 'flagged': flagged, 'flagged_share': share,
+                'sd': sd}
+        if n < MINIMUM_VALUES:
+            continue
+        if share > FLAGGED_LIMIT:
+            problems.append('{0:.0%} of {1} z-scores are flagged'.format(
+                    share, field))
+        low, high = SD_RANGE
+        if sd is not None and not low <= sd <= high:
+            problems.append('{0} standard deviation is {1:.2f}'.format(
+                    field, sd))
+    return result
@@ -0,0 +1,86 @@
+from __future__ import unicode_literals
+import logging
+
+from django.db import transaction
+
+from healthcare.api import client
+from healthcare.backends import comparisons
+
+from nutrition.models import Report
+
+
+__all__ = ['iter_patients', 'reanalyze_patients', 'patient_updated']
+
+
+logger = logging.getLogger(__name__)
+
+
+def iter_patients(since=None, chunk_size=500):
+    """Yields dictionaries mapping global patient ids to patient records.
+
+    If since is given and the healthcare backend can filter patients, only
+    patients updated since then are included. Otherwise every patient with
+    a report is included, chunk_size patients at a time.
+    """
+    if since is not None:
+        lookup = ('updated_date', comparisons.GTE, since)
+        try:
+            patients = client.patients.backend.filter_patients(lookup)
+        except NotImplementedError:
+            logger.debug('Patients cannot be filtered by update time.')
+        else:
+            yield dict([(unicode(p['id']), p) for p in patients])
+            return
+    ids = Report.objects.order_by('global_patient_id')
+    ids = ids.values_list('global_patient_id', flat=True).distinct()
+    chunk = []
+    for global_patient_id in ids.iterator():
+        chunk.append(global_patient_id)
+        if len(chunk) >= chunk_size:
+            yield Report.get_patients(chunk)
+            chunk = []
+    if chunk:
+        yield Report.get_patients(chunk)
+
+
+def reanalyze_patients(patients, batch_size=100):
+    """Re-analyzes reports analyzed with out-of-date patient demographics.
+
+    patients maps global patient ids to their current records. Only reports
+    whose stored demographics fingerprint differs from the patient's
+    current fingerprint (including reports which were never analyzed) are
+    analyzed again, batch_size reports per transaction. Returns the number
+    of reports analyzed.
+    """
+    fingerprints = dict([(unicode(global_patient_id),
+            Report.get_demographics(patient))
+            for global_patient_id, patient in patients.items()])
+    if not fingerprints:
+        return 0
+    reports = Report.objects.filter(global_patient_id__in=list(fingerprints))
+    stale = [pk for pk, global_patient_id, demographics in
+            reports.values_list('pk', 'global_patient_id', 'demographics')
+            if demographics != fingerprints[global_patient_id]]
+    for start in range(0, len(stale), batch_size):
+        with transaction.commit_on_success():
+            batch = Report.objects.filter(pk__in=stale[start:start + batch_size])
+            for report in batch:
+                report._patient = patients[report.global_patient_id]
+                try:
+                    # The report is saved, with its new status, even if
+                    # analysis fails.
+                    report.analyze()
+                except Exception:
+                    logger.debug('Re-analysis of report {0} failed.'.format(
+                            report.pk), exc_info=True)
+    return len(stale)
+
+
+def patient_updated(global_patient_id):
+    """Re-analyzes a patient's reports after their record is changed.
+
+    Call this after updating a patient's birth date or sex in healthcare.
+    Returns the number of reports analyzed.
+    """
+    patients = Report.get_patients([global_patient_id])
+    return reanalyze_patients(patients)
@@ -0,0 +1,209 @@
+from __future__ import unicode_literals
+from collections import defaultdict
+import json
+import logging
+import Queue
+import threading
+import time
+
+from django.db import connection, transaction
+
+from rapidsms.messages import IncomingMessage
+from rapidsms.models import Backend, Connection
+
+from nutrition.handlers import CancelReportHandler, CreateReportHandler
+
+
+__all__ = ['HANDLERS', 'ReplaySummary', 'read_messages', 'replay',
+        'replay_message']
+
+
+logger = logging.getLogger(__name__)
+
+
+# Handlers are tried in this order, as the router would.
+HANDLERS = [CreateReportHandler, CancelReportHandler]
+
+IGNORED = 'ignored'
+
+
+def read_messages(lines, identity='replay'):
+    """Yields an (identity, text) tuple for each message in a log.
+
+    Each line is either a JSON object with text and (optionally) identity
+    keys, an identity and text separated by a tab, or just the text of a
+    message sent by identity. Blank lines and lines starting with # are
+    skipped. Lines are read one at a time, so large logs may be streamed.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        line = line.rstrip('\r\n')
+        if not line.strip() or line.startswith('#'):
+            continue
+        if line.startswith('{'):
+            data = json.loads(line)
+            yield data.get('identity') or identity, data['text']
+        elif '\t' in line:
+            sender, text = line.split('\t', 1)
+            yield sender or identity, text
+        else:
+            yield identity, line
+
+
+def _dispatch(handler_class, msg):
+    """Dispatches msg like KeywordHandler.dispatch, returning its outcome.
+
+    Returns None if the handler does not accept the message.
+    """
+    match = handler_class._keyword().match(msg.text)
+    if match is None:
+        return None
+    handler = handler_class(None, msg)
+    handler.outcome = 'none'
+    text = match.group(1)
+    if text is not None and text.strip():
+        # Replayed messages bypass the admission queue, so that they are
+        # handled in the replay's own transaction.
+        handler.handle_now(text)
+    else:
+        handler.help()
+    return handler.outcome
+
+
+def replay_message(backend, identity, text, dry_run=False, handlers=None):
+    """Feeds a message through the nutrition handlers, without a router.
+
+    Replies are collected but never sent. If dry_run is True, the message's
+    changes are rolled back. Returns the outcome (e.g., 'success' or
+    'form_error', or 'ignored' if no handler accepted the message) and the
+    text of the replies.
+    """
+    handlers = HANDLERS if handlers is None else handlers
+    context = (transaction.commit_manually() if dry_run else
+            transaction.commit_on_success())
+    with context:
+        try:
+            conn, _ = Connection.objects.get_or_create(backend=backend,
+                    identity=identity)
+            msg = IncomingMessage(connection=conn, text=text)
+            outcome = IGNORED
+            for handler_class in handlers:
+                result = _dispatch(handler_class, msg)
+                if result is not None:
+                    outcome = result
+                    break
+        finally:
+            if dry_run:
+                transaction.rollback()
+    return outcome, [response.text for response in msg.responses]
+
+
+class ReplaySummary(object):
+    """Counts the outcomes and times of replayed messages."""
+
+    def __init__(self):
+        self.outcomes = defaultdict(int)
+        self.times = []
+        self.elapsed = None
+        self._lock = threading.Lock()
+        self._start = time.time()
+
+    def add(self, outcome, seconds):
+        with self._lock:
+            self.outcomes[outcome] += 1
+            self.times.append(seconds)
+
+    def finish(self):
+        self.elapsed = time.time() - self._start
+
+    @property
+    def count(self):
+        return len(self.times)
+
+    def percentile(self, percent):
+        """Returns the time taken by the given percentile of messages."""
+        if not self.times:
+            return None
+        times = sorted(self.times)
+        index = min(int(len(times) * percent / 100.0), len(times) - 1)
+        return times[index]
+
+    def lines(self):
+        """Returns the lines of a human-readable summary."""
+        elapsed = self.elapsed or time.time() - self._start
+        rate = self.count / elapsed if elapsed else 0
+        lines = ['Replayed {0} message(s) in {1:.2f} s ({2:.1f} per '
+                'second).'.format(self.count, elapsed, rate)]
+        if self.times:
+            lines.append('Time per message (ms): mean {0:.1f}, median '
+                    '{1:.1f}, 95th percentile {2:.1f}, max {3:.1f}'.format(
+                    1000 * sum(self.times) / self.count,
+                    1000 * self.percentile(50), 1000 * self.percentile(95),
+                    1000 * max(self.times)))
+        for outcome, count in sorted(self.outcomes.items()):
+            lines.append('{0}: {1}'.format(outcome, count))
+        return lines
+
+
+def replay(messages, workers=1, dry_run=False, backend_name='replay',
+        handlers=None, callback=None):
+    """Replays (identity, text) messages and returns a ReplaySummary.
+
+    Messages are sent from connections of the named rapidsms backend. With
+    more than one worker, messages are processed by that many threads;
+    each identity's messages are handled by the same thread, in order, so
+    that, e.g., a cancellation follows the report it cancels. If given,
+    callback is called with the identity, text, outcome and replies of
+    each message.
+    """
+    backend, _ = Backend.objects.get_or_create(name=backend_name)
+    summary = ReplaySummary()
+
+    def process(identity, text):
+        start = time.time()
+        try:
+            outcome, replies = replay_message(backend, identity, text,
+                    dry_run=dry_run, handlers=handlers)
+        except Exception:
+            logger.exception('Unable to replay a message from {0}.'.format(
+                    identity))
+            outcome, replies = 'exception', []
+        summary.add(outcome, time.time() - start)
+        if callback:
+            callback(identity, text, outcome, replies)
+
+    if workers <= 1:
+        for identity, text in messages:
+            process(identity, text)
+        summary.finish()
+        return summary
+
+    # Bounded queues keep the log streaming rather than read into memory.
+    queues = [Queue.Queue(maxsize=100) for i in range(workers)]
+
+    def worker(queue):
+        try:
+            while True:
+                message = queue.get()
+                if message is None:
+                    return
+                process(*message)
+        finally:
+            # Each thread opens its own database connection.
+            connection.close()
+
+    threads = [threading.Thread(target=worker, args=(queue,))
+            for queue in queues]
+    for thread in threads:
+        thread.start()
+    try:
+        for identity, text in messages:
+            queues[hash(identity) % workers].put((identity, text))
+    finally:
+        for queue in queues:
+            queue.put(None)
+        for thread in threads:
+            thread.join()
+    summary.finish()
+    return summary
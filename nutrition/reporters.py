@@ -0,0 +1,77 @@
+from __future__ import unicode_literals
+import time
+
+from django.conf import settings
+from django.utils import importlib
+
+
+__all__ = ['ReporterCache', 'reporters']
+
+
+class ReporterCache(object):
+    """In-process cache of connection -> provider record lookups.
+
+    Most messages come from a small set of reporters, so we remember which
+    provider (if any) is associated with each connection rather than asking
+    the healthcare backend on every message. Each entry is stored with the
+    cache version that was current when its lookup began; invalidate() bumps
+    the version, making every existing entry (and any lookup which is still
+    in flight) stale at once.
+    """
+    max_size = 1000  # Entries kept before the cache is emptied.
+
+    def __init__(self):
+        self.version = 0
+        self._entries = {}
+
+    @property
+    def timeout(self):
+        return getattr(settings, 'NUTRITION_REPORTER_CACHE_TIMEOUT', 300)
+
+    def get(self, connection):
+        """Returns the active provider record associated with connection.
+
+        Returns None if the connection is not associated with an active
+        provider.
+        """
+        if connection is None:
+            return None
+        entry = self._entries.get(connection.pk)
+        if entry is not None:
+            version, expires, provider = entry
+            if version == self.version and expires > time.time():
+                return provider
+
+        version = self.version
+        provider = self.lookup(connection)
+        if len(self._entries) >= self.max_size:
+            self._entries = {}
+        self._entries[connection.pk] = (version, time.time() + self.timeout,
+                provider)
+        return provider
+
+    def invalidate(self):
+        """Discards all cached lookups, e.g., after providers are updated."""
+        self.version += 1
+        self._entries = {}
+
+    def lookup(self, connection):
+        """Retrieves the provider record for connection from healthcare.
+
+        The lookup is delegated to the callable named in
+        NUTRITION_REPORTER_LOOKUP, which accepts a connection and returns a
+        provider record or None. If the setting is None, messages are never
+        associated with a reporter. Inactive providers are ignored.
+        """
+        path = getattr(settings, 'NUTRITION_REPORTER_LOOKUP', None)
+        if not path:
+            return None
+        mod_path, func_name = path.rsplit('.', 1)
+        func = getattr(importlib.import_module(mod_path), func_name)
+        provider = func(connection)
+        if provider and provider.get('status', 'A') == 'A':
+            return provider
+        return None
+
+
+reporters = ReporterCache()
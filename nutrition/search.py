@@ -0,0 +1,136 @@
+from __future__ import unicode_literals
+
+from django.conf import settings
+from django.db import connections
+from django.utils.translation import ugettext_lazy as _
+
+
+__all__ = ['EXACT', 'PREFIX', 'CONTAINS', 'MATCH_MODES', 'filter_reports',
+        'get_trigrams', 'get_query_trigrams', 'index_reports',
+        'use_trigram_indexes']
+
+
+EXACT = 'exact'
+PREFIX = 'prefix'
+CONTAINS = 'contains'
+MATCH_MODES = [
+    (EXACT, _('Exact match')),
+    (PREFIX, _('Starts with')),
+    (CONTAINS, _('Contains')),
+]
+
+# Marks the start of an identifier, so that prefixes can be searched for
+# with the same trigrams as substrings.
+START = '^'
+
+# Codes for the fields whose trigrams are stored in ReportTrigram.
+FIELDS = {
+    'patient_id': 'P',
+    'reporter_id': 'R',
+}
+
+
+def _windows(value):
+    return set([value[i:i + 3] for i in range(len(value) - 2)])
+
+
+def get_trigrams(value):
+    """Returns the set of trigrams stored for an identifier."""
+    if value is None or value == '':
+        return set()
+    return _windows(START + unicode(value).lower())
+
+
+def get_query_trigrams(term, mode):
+    """Returns the trigrams which every match of term must have.
+
+    Returns an empty set if term is too short to be searched for with
+    trigrams.
+    """
+    term = term.lower()
+    if mode == PREFIX:
+        term = START + term
+    return _windows(term)
+
+
+def use_trigram_indexes(using='default'):
+    """Returns whether the database's own trigram indexes should be used.
+
+    This requires PostgreSQL, the pg_trgm extension and the
+    NUTRITION_TRIGRAM_INDEXES setting; otherwise trigrams are maintained in
+    the ReportTrigram table.
+    """
+    return (getattr(settings, 'NUTRITION_TRIGRAM_INDEXES', False) and
+            connections[using].vendor == 'postgresql')
+
+
+def filter_reports(queryset, field, term, mode=EXACT):
+    """Filters reports whose patient_id or reporter_id matches term.
+
+    Prefix and substring matches are case-insensitive. Candidate reports
+    are found using trigram indexes, then checked against the identifier
+    itself.
+    """
+    if mode == EXACT:
+        return queryset.filter(**{field: term})
+    lookup = 'istartswith' if mode == PREFIX else 'icontains'
+    queryset = queryset.filter(**{'{0}__{1}'.format(field, lookup): term})
+    if use_trigram_indexes(queryset.db):
+        # The trigram indexes cover the UPPER() expression used by Django's
+        # case-insensitive lookups.
+        return queryset
+    from nutrition.models import Report, ReportTrigram
+    trigrams = sorted(get_query_trigrams(term, mode))
+    if not trigrams or queryset.model is not Report:
+        # Archived reports are not indexed.
+        return queryset
+    qn = connections[queryset.db].ops.quote_name
+    sql = '{pk} IN (SELECT {report} FROM {table} WHERE {field} = %s AND ' \
+            '{trigram} IN ({params}) GROUP BY {report} ' \
+            'HAVING COUNT(*) = %s)'.format(
+            pk='{0}.{1}'.format(qn(Report._meta.db_table),
+                    qn(Report._meta.pk.column)),
+            table=qn(ReportTrigram._meta.db_table),
+            report=qn(ReportTrigram._meta.get_field('report').column),
+            field=qn('field'), trigram=qn('trigram'),
+            params=', '.join(['%s'] * len(trigrams)))
+    params = [FIELDS[field]] + trigrams + [len(trigrams)]
+    return queryset.extra(where=[sql], params=params)
+
+
+def index_reports(reports, replace=True):
+    """Stores the trigrams of reports.
+
+    reports is a list of (pk, patient_id, reporter_id) tuples. If replace is
+    True, the reports' existing trigrams are deleted first.
+    """
+    from nutrition.models import ReportTrigram
+    if not reports:
+        return
+    if replace:
+        pks = [pk for pk, _, _ in reports]
+        ReportTrigram.objects.filter(report__in=pks).delete()
+    trigrams = []
+    for pk, patient_id, reporter_id in reports:
+        for field, value in (('patient_id', patient_id),
+                ('reporter_id', reporter_id)):
+            for trigram in get_trigrams(value):
+                trigrams.append(ReportTrigram(report_id=pk,
+                        field=FIELDS[field], trigram=trigram))
+    ReportTrigram.objects.bulk_create(trigrams)
+
+
+def report_initialized(sender, instance, **kwargs):
+    # Deferred fields are not loaded.
+    instance._indexed = (instance.__dict__.get('patient_id'),
+            instance.__dict__.get('reporter_id'))
+
+
+def report_saved(sender, instance, created, raw=False, **kwargs):
+    """Keeps the trigrams of a saved report up to date."""
+    ids = (instance.patient_id, instance.reporter_id)
+    if raw or use_trigram_indexes(kwargs.get('using') or 'default'):
+        return
+    if created or ids != getattr(instance, '_indexed', None):
+        index_reports([(instance.pk,) + ids], replace=not created)
+    instance._indexed = ids
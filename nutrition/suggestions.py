@@ -0,0 +1,190 @@
+from __future__ import unicode_literals
+from itertools import islice
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+
+__all__ = ['PatientIdIndex', 'one_edit_apart', 'patient_ids']
+
+
+logger = logging.getLogger(__name__)
+
+
+def one_edit_apart(a, b):
+    """Returns whether b is a one-character typo of a.
+
+    A typo is the insertion, deletion or substitution of one character, or
+    the transposition of two adjacent characters.
+    """
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        if len(diffs) == 1:
+            return True
+        return (len(diffs) == 2 and diffs[1] == diffs[0] + 1 and
+                a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    # b is one character longer; skip the first character that differs.
+    for i in range(len(a)):
+        if a[i] != b[i]:
+            return a[i:] == b[i + 1:]
+    return True
+
+
+def _deletions(value):
+    """Returns value and each string formed by deleting one character."""
+    return set([value] + [value[:i] + value[i + 1:]
+            for i in range(len(value))])
+
+
+class PatientIdIndex(object):
+    """In-process index of patient IDs, used to suggest corrections.
+
+    Each ID is stored under itself and under every string formed by
+    deleting one of its characters. An ID and a one-character typo of it
+    always share one of these keys, so candidate corrections are found
+    with a few dictionary lookups rather than by comparing against every
+    ID. Memory use grows with the total length of the IDs.
+
+    The index is built from the patient IDs of current reports, which are
+    the IDs of the NUTRITION_PATIENT_HEALTHCARE_SOURCE source. Afterwards,
+    only reports created since the last read are read, at most once every
+    NUTRITION_PATIENT_ID_INDEX_REFRESH seconds. If background is True,
+    suggest() starts these reads in a background thread rather than waiting
+    for them, and suggests nothing until the index has first been built.
+    Reports are read without holding the index's lock, so lookups are never
+    held up by a refresh.
+    """
+    background = True
+    # Number of reports added to the index at a time.
+    chunk_size = 1000
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._thread = None
+        self.invalidate()
+
+    @property
+    def refresh_interval(self):
+        return getattr(settings, 'NUTRITION_PATIENT_ID_INDEX_REFRESH', 60)
+
+    @property
+    def ready(self):
+        """Whether the index has been built."""
+        return self._refreshed is not None
+
+    def add(self, patient_id):
+        with self._lock:
+            if not patient_id or patient_id in self._ids:
+                return
+            self._ids.add(patient_id)
+            for key in _deletions(patient_id):
+                self._keys.setdefault(key, set()).add(patient_id)
+
+    def discard(self, patient_id):
+        """Removes an ID, e.g., that of an inactive patient."""
+        with self._lock:
+            if patient_id not in self._ids:
+                return
+            self._ids.discard(patient_id)
+            for key in _deletions(patient_id):
+                ids = self._keys.get(key)
+                if ids is not None:
+                    ids.discard(patient_id)
+                    if not ids:
+                        del self._keys[key]
+
+    def invalidate(self):
+        """Empties the index, so that it is rebuilt when next used."""
+        with self._lock:
+            self._ids = set()
+            self._keys = {}
+            self._last_pk = 0
+            self._refreshed = None
+            # A refresh which is under way discards what it has read.
+            self._generation = object()
+
+    def _due(self):
+        return (self._refreshed is None or
+                time.time() - self._refreshed >= self.refresh_interval)
+
+    def refresh(self, force=False):
+        """Adds the patient IDs of reports created since the last refresh.
+
+        This may be called when a process starts, e.g., from a RapidSMS
+        app's start() method, to build the index ahead of time.
+        """
+        from nutrition.models import Report
+        with self._lock:
+            if not force and not self._due():
+                return
+            generation, last_pk = self._generation, self._last_pk
+        reports = Report.objects.filter(pk__gt=last_pk)
+        reports = reports.order_by('pk').values_list('pk', 'patient_id')
+        rows = reports.iterator()
+        while True:
+            chunk = list(islice(rows, self.chunk_size))
+            with self._lock:
+                if self._generation is not generation:
+                    return
+                for pk, patient_id in chunk:
+                    self.add(patient_id)
+                if chunk:
+                    self._last_pk = max(self._last_pk, chunk[-1][0])
+                else:
+                    self._refreshed = time.time()
+                    return
+
+    def refresh_in_background(self):
+        """Starts a refresh in a new thread, if one is due and not running.
+
+        Returns the thread, or None.
+        """
+        with self._lock:
+            if not self._due() or (self._thread is not None and
+                    self._thread.is_alive()):
+                return None
+            self._thread = threading.Thread(target=self._refresh_thread)
+            self._thread.daemon = True
+            self._thread.start()
+            return self._thread
+
+    def _refresh_thread(self):
+        try:
+            self.refresh()
+        except Exception:
+            logger.exception('Unable to refresh the patient ID index')
+        finally:
+            # The thread opened its own database connection.
+            connection.close()
+
+    def suggest(self, patient_id):
+        """Returns the only known ID which is one typo away from patient_id.
+
+        Returns None if there is no such ID, or more than one, or if the
+        index is still being built.
+        """
+        if self.background:
+            self.refresh_in_background()
+        else:
+            self.refresh()
+        if not patient_id:
+            return None
+        candidates = set()
+        with self._lock:
+            if not self.ready:
+                return None
+            for key in _deletions(patient_id):
+                candidates.update(self._keys.get(key, ()))
+        matches = [candidate for candidate in candidates
+                if one_edit_apart(patient_id, candidate)]
+        return matches[0] if len(matches) == 1 else None
+
+
+patient_ids = PatientIdIndex()
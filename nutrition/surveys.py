@@ -0,0 +1,246 @@
+from __future__ import unicode_literals
+from array import array
+import math
+
+import numpy
+
+from django.db import connections
+
+from nutrition.classification import get_cutoffs
+from nutrition.fields import FixedPointField
+from nutrition.models import Report
+
+
+__all__ = ['WHO', 'SMART', 'GROUPS', 'INDICATORS', 'Sample', 'load_sample',
+        'select_floats', 'summarize', 'survey', 'to_numpy']
+
+
+WHO = 'who'
+SMART = 'smart'
+
+# Z-scores outside these limits are flagged as implausible by WHO Anthro.
+WHO_FLAGS = {
+    'weight4height': (-5, 5),
+    'height4age': (-6, 6),
+    'weight4age': (-6, 5),
+}
+# SMART flags z-scores more than this far from the observed mean.
+SMART_FLAG_RANGE = 3
+
+GROUPS = ('location', 'month')
+
+# Indicator name: (z-score field, whether oedema counts as severe).
+INDICATORS = [
+    ('wasting', 'weight4height', True),
+    ('stunting', 'height4age', False),
+    ('underweight', 'weight4age', False),
+]
+
+ZSCORES = [field for _, field, _ in INDICATORS]
+
+
+class Sample(object):
+    """Columns of report values, as NumPy arrays.
+
+    Unknown z-scores are NaN. group is an integer array whose values index
+    labels, the tuples of the values of the group_by fields of each group.
+    """
+
+    def __init__(self, columns, oedema, group, labels, group_by=()):
+        self.columns = columns
+        self.oedema = oedema
+        self.group = group
+        self.labels = labels
+        self.group_by = list(group_by)
+
+    def __len__(self):
+        return len(self.oedema)
+
+
+def load_sample(queryset, group_by=()):
+    """Loads the z-scores of reports into a Sample in a single pass.
+
+    Cancelled reports are left out. group_by may include 'location', which
+    requires patient records, and 'month', the month in which each report
+    was created.
+    """
+    group_by = list(group_by)
+    unknown = set(group_by) - set(GROUPS)
+    if unknown:
+        raise ValueError('Unknown group(s): {0}.'.format(
+                ', '.join(sorted(unknown))))
+    queryset = queryset.filter(active=True)
+    queryset, fields = select_floats(queryset, ZSCORES)
+    fields += ['oedema']
+    if group_by:
+        fields += ['created', 'global_patient_id']
+    values = [array(str('d')) for field in ZSCORES]
+    oedema = array(str('b'))
+    keys = []
+    nan = float('nan')
+    rows = queryset.values_list(*fields).iterator()
+    for row in rows:
+        for column, value in zip(values, row):
+            column.append(nan if value is None else value)
+        oedema.append(bool(row[3]))
+        if group_by:
+            keys.append((row[5], row[4]))
+    columns = dict((field, to_numpy(column, field))
+            for field, column in zip(ZSCORES, values))
+    oedema = to_numpy(oedema, dtype=numpy.int8).astype(bool)
+    group, labels = _group(keys, group_by, len(oedema))
+    return Sample(columns, oedema, group, labels, group_by)
+
+
+def select_floats(queryset, fields):
+    """Selects numeric fields as floats, if the database can cast them.
+
+    Building a Decimal for each value is the slowest part of loading
+    reports. Returns the queryset and the names to pass to values_list().
+    """
+    connection = connections[queryset.db]
+    if connection.vendor not in ('postgresql', 'sqlite'):
+        return queryset, list(fields)
+    qn = connection.ops.quote_name
+    table = qn(queryset.model._meta.db_table)
+    select = dict(('{0}_float'.format(field),
+            'CAST({0}.{1} AS DOUBLE PRECISION)'.format(table,
+            qn(queryset.model._meta.get_field(field).column)))
+            for field in fields)
+    return (queryset.extra(select=select),
+            ['{0}_float'.format(field) for field in fields])
+
+
+def to_numpy(values, field=None, dtype=numpy.float64):
+    """Converts an array.array of a field's values to a NumPy array.
+
+    Fixed-point values are scaled (see NUTRITION_FIXED_POINT_STORAGE).
+    """
+    # The array's buffer is used without copying it.
+    if not values:
+        column = numpy.empty(0, dtype=dtype)
+    else:
+        column = numpy.frombuffer(values, dtype=dtype)
+    if field is not None:
+        model_field = Report._meta.get_field(field)
+        if isinstance(model_field, FixedPointField):
+            # The stored integers are read.
+            column = column * float(model_field.unit)
+    return column
+
+
+def _group(keys, group_by, count):
+    if not group_by:
+        return numpy.zeros(count, dtype=numpy.intp), [()]
+    locations = {}
+    if 'location' in group_by:
+        ids = set(global_patient_id for global_patient_id, _ in keys)
+        patients = Report.get_patients(list(ids))
+        locations = dict((global_patient_id, patient.get('location'))
+                for global_patient_id, patient in patients.items())
+    indexes = {}
+    group = numpy.empty(count, dtype=numpy.intp)
+    for i, (global_patient_id, created) in enumerate(keys):
+        label = []
+        for name in group_by:
+            if name == 'location':
+                label.append(locations.get(global_patient_id))
+            else:
+                label.append(created.strftime('%Y-%m'))
+        group[i] = indexes.setdefault(tuple(label), len(indexes))
+    labels = sorted(indexes, key=indexes.get)
+    return group, labels
+
+
+def _proportion(count, total, design_effect, z):
+    """Returns a proportion and its Wilson score confidence interval.
+
+    The sample size is divided by the design effect of cluster surveys.
+    """
+    if not total:
+        return None, None, None
+    p = float(count) / total
+    n = total / design_effect
+    centre = (p + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (
+            1 + z * z / n)
+    return p, max(centre - margin, 0.0), min(centre + margin, 1.0)
+
+
+def summarize(sample, flags=WHO, design_effect=1.0, z=1.96):
+    """Returns the survey statistics of each group of a Sample.
+
+    For each indicator, flagged z-scores (see WHO_FLAGS; with SMART flags,
+    those more than SMART_FLAG_RANGE from the group's mean) are excluded,
+    and the prevalence of moderate or severe (global) and severe
+    malnutrition, with confidence intervals of z standard errors, and the
+    mean and standard deviation of the remaining z-scores are computed.
+    Oedema counts as severe wasting, even without a z-score.
+    """
+    if design_effect <= 0:
+        raise ValueError('The design effect must be positive.')
+    cutoffs = get_cutoffs()
+    moderate = float(cutoffs['moderate_zscore'])
+    severe = float(cutoffs['severe_zscore'])
+    groups = len(sample.labels)
+    group = sample.group
+    results = [{'group': dict(zip(sample.group_by, label)), 'reports': 0}
+            for label in sample.labels]
+    reports = numpy.bincount(group, minlength=groups)
+
+    def count(mask):
+        return numpy.bincount(group[mask], minlength=groups)
+
+    for name, field, with_oedema in INDICATORS:
+        zscores = sample.columns[field]
+        known = ~numpy.isnan(zscores)
+        if flags == SMART:
+            totals = numpy.bincount(group[known], weights=zscores[known],
+                    minlength=groups)
+            means = totals / numpy.maximum(count(known), 1)
+            with numpy.errstate(invalid='ignore'):
+                flagged = known & (numpy.abs(zscores - means[group]) >
+                        SMART_FLAG_RANGE)
+        else:
+            low, high = WHO_FLAGS[field]
+            with numpy.errstate(invalid='ignore'):
+                flagged = known & ((zscores < low) | (zscores > high))
+        valid = known & ~flagged
+        oedema = sample.oedema if with_oedema else numpy.zeros_like(valid)
+        with numpy.errstate(invalid='ignore'):
+            globally = valid & (zscores < moderate)
+            severely = valid & (zscores < severe)
+        # Oedematous children are included even without a valid z-score.
+        included = valid | oedema
+        totals = count(included)
+        globals_ = count(globally | oedema)
+        severes = count(severely | oedema)
+        sums = numpy.bincount(group[valid], weights=zscores[valid],
+                minlength=groups)
+        squares = numpy.bincount(group[valid],
+                weights=zscores[valid] ** 2, minlength=groups)
+        ns = count(valid)
+        flagged = count(flagged)
+        for i, result in enumerate(results):
+            result['reports'] = int(reports[i])
+            n = int(ns[i])
+            mean = float(sums[i]) / n if n else None
+            sd = None
+            if n > 1:
+                variance = (squares[i] - n * mean * mean) / (n - 1)
+                sd = math.sqrt(max(variance, 0.0))
+            stats = {'n': int(totals[i]), 'flagged': int(flagged[i]),
+                    'mean': mean, 'sd': sd}
+            for key, counts in (('global', globals_), ('severe', severes)):
+                p, lower, upper = _proportion(counts[i], totals[i],
+                        design_effect, z)
+                stats[key] = {'count': int(counts[i]), 'prevalence': p,
+                        'lower': lower, 'upper': upper}
+            result[name] = stats
+    return results
+
+
+def survey(queryset, group_by=(), flags=WHO, design_effect=1.0, z=1.96):
+    """Loads and summarizes the reports of queryset. See summarize."""
+    return summarize(load_sample(queryset, group_by), flags=flags,
+            design_effect=design_effect, z=z)
@@ -16,11 +16,11 @@ class NutritionReportTable(tables.Table):
     class Meta:
         model = Report
         exclude = ('updated', 'global_patient_id', 'global_reporter_id',
-                'raw_text')
+                'raw_text', 'demographics')
         sequence = ('id', 'created', 'reporter_id', 'patient_id',
                 'age', 'sex', 'location', 'height', 'weight', 'muac', 'oedema',
-                'weight4age', 'height4age', 'weight4height', 'status',
-                'active')
+                'weight4age', 'height4age', 'weight4height', 'wasting',
+                'stunting', 'underweight', 'status', 'active')
 
     def render_active(self, value):
         return 'Active' if value else 'Cancelled'
@@ -36,8 +36,9 @@ class CSVNutritionReportTable(NutritionReportTable):
 
     class Meta:
         model = Report
-        exclude = ('global_patient_id', 'global_reporter_id', 'raw_text')
+        exclude = ('global_patient_id', 'global_reporter_id', 'raw_text',
+                'demographics')
         sequence = ('id', 'created', 'updated', 'reporter_id',
                 'patient_id', 'age', 'sex', 'location', 'height', 'weight',
                 'muac', 'oedema', 'weight4age', 'height4age', 'weight4height',
-                'status')
+                'wasting', 'stunting', 'underweight', 'status')
@@ -1,2 +1,19 @@
+from .admission import *
+from .archive import *
+from .classification import *
+from .columnar import *
+from .counts import *
+from .events import *
+from .exports import *
+from .fields import *
+from .growth import *
 from .handlers import *
+from .lookups import *
+from .profiling import *
+from .quality import *
+from .reanalysis import *
+from .replay import *
+from .search import *
+from .suggestions import *
+from .surveys import *
 from .views import *
@@ -0,0 +1,173 @@
+from __future__ import unicode_literals
+import json
+import mock
+import sys
+import threading
+import traceback
+
+from django.test import TestCase
+from django.test.utils import override_settings
+
+from rapidsms.messages import IncomingMessage
+
+from .. import admission
+from ..handlers import CreateReportHandler
+from ..models import Report
+from .base import NutritionTransactionTestBase
+from .views import NutritionViewTest
+
+
+__all__ = ['AdmissionControllerTest', 'AdmissionHandlerTest',
+        'AdmissionMetricsViewTest']
+
+
+class Connection(object):
+    contact = None
+
+    def __init__(self, pk):
+        self.pk = pk
+
+
+class Handler(object):
+    """Records the order in which messages are handled."""
+
+    def __init__(self, connection, handled, gate=None, reply=None):
+        self.msg = IncomingMessage(connection=connection, text='text')
+        self.handled = handled
+        self.gate = gate
+        self.reply = reply
+        self.started = threading.Event()
+
+    def _message(self, msg_type):
+        return msg_type
+
+    def handle_now(self, text):
+        self.started.set()
+        if self.gate:
+            self.gate.wait()
+        if self.reply is None:
+            raise ValueError('No reply.')
+        self.handled.append(self.reply)
+        self.msg.respond(self.reply)
+
+
+class AdmissionControllerTest(TestCase):
+
+    def setUp(self):
+        self.handled = []
+        self.gate = threading.Event()
+        patcher = mock.patch.object(admission, 'logger')
+        self.logger = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _controller(self, **kwargs):
+        controller = admission.AdmissionController(1, **kwargs)
+        self.addCleanup(controller.stop)
+        self.addCleanup(self.gate.set)
+        return controller
+
+    def _submit(self, controller, pk, reply, gate=None):
+        handler = Handler(Connection(pk), self.handled, gate=gate,
+                reply=reply)
+        original = handler.msg
+        controller.submit(handler, 'text')
+        if gate:
+            # Wait for the worker to be held up by the gate.
+            handler.started.wait()
+        return original
+
+    def test_handled(self):
+        """Shallow queues are waited for, so replies are sent as usual."""
+        controller = self._controller()
+        msg = self._submit(controller, 1, 'done')
+        self.assertEquals([r.text for r in msg.responses], ['done'])
+        metrics = controller.metrics()
+        self.assertEquals(metrics['admitted'], 1)
+        self.assertEquals(metrics['depth'], 0)
+        self.assertTrue(metrics['wait_max'] >= 0)
+
+    def test_error(self):
+        """Exceptions are raised in the submitting thread."""
+        controller = self._controller()
+        try:
+            self._submit(controller, 1, None)
+        except ValueError:
+            tb = sys.exc_info()[2]
+        else:
+            self.fail('ValueError was not raised.')
+        self.assertTrue(self.logger.exception.called)
+        # The traceback is that of the worker thread.
+        functions = [name for _, _, name, _ in traceback.extract_tb(tb)]
+        self.assertEquals(functions[-1], 'handle_now')
+
+    def test_fairness(self):
+        """Waiting messages are taken from each connection in turn."""
+        controller = self._controller(defer_depth=0)
+        self._submit(controller, 0, 'first', gate=self.gate)
+        for pk, reply in ((1, 'a1'), (1, 'a2'), (1, 'a3'), (2, 'b1'),
+                (3, 'c1')):
+            msg = self._submit(controller, pk, reply)
+            self.assertEquals([r.text for r in msg.responses], ['received'])
+        self.assertEquals(controller.metrics()['depth'], 5)
+        self.gate.set()
+        controller.stop()
+        self.assertEquals(self.handled, ['first', 'a1', 'b1', 'c1', 'a2',
+                'a3'])
+        self.assertEquals(controller.metrics()['deferred'], 6)
+
+    def test_full(self):
+        """Messages are turned away once the queue is full."""
+        controller = self._controller(queue_size=2, defer_depth=0)
+        self._submit(controller, 0, 'first', gate=self.gate)
+        self._submit(controller, 1, 'a1')
+        self._submit(controller, 2, 'b1')
+        msg = self._submit(controller, 3, 'c1')
+        self.assertEquals([r.text for r in msg.responses], ['busy'])
+        self.assertTrue(self.logger.warning.called)
+        metrics = controller.metrics()
+        self.assertEquals(metrics['rejected'], 1)
+        self.assertEquals(metrics['depth'], 2)
+        self.gate.set()
+        controller.stop()
+        self.assertEquals(self.handled, ['first', 'a1', 'b1'])
+
+
+class AdmissionHandlerTest(NutritionTransactionTestBase):
+
+    @override_settings(NUTRITION_ADMISSION_CONCURRENCY=2)
+    def test_create_report(self):
+        """Queued reports are created and replied to as usual."""
+        self.addCleanup(admission.get_controller().stop)
+        patient_id = self.create_patient()[0]
+        replies = CreateReportHandler.test('nutrition report {0} wt 12'
+                .format(patient_id))
+        self.assertEquals(len(replies), 1)
+        self.assertTrue(replies[0].startswith('Thanks anonymous.'),
+                replies[0])
+        self.assertEquals(Report.objects.count(), 1)
+        self.assertEquals(admission.get_metrics()['admitted'], 1)
+
+    def test_disabled(self):
+        self.assertEquals(admission.get_controller(), None)
+        self.assertEquals(admission.get_metrics(), {})
+
+
+class AdmissionMetricsViewTest(NutritionViewTest):
+    url_name = 'nutrition_admission_metrics'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_no_permission(self):
+        self.user.user_permissions.all().delete()
+        self.assertEquals(self._get().status_code, 302)
+
+    def test_disabled(self):
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(json.loads(response.content), {})
+
+    def test_metrics(self):
+        metrics = {'depth': 1, 'admitted': 3}
+        with mock.patch.object(admission, 'get_metrics',
+                return_value=metrics):
+            response = self._get()
+        self.assertEquals(json.loads(response.content), metrics)
@@ -0,0 +1,91 @@
+from __future__ import unicode_literals
+import datetime
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from .. import archive, search
+from ..forms import ReportFilterForm
+from ..models import ArchivedReport, Report, ReportTrigram
+from .base import NutritionTestBase
+
+
+__all__ = ['ArchiveTest']
+
+
+class ArchiveTest(NutritionTestBase):
+
+    def _create_old_report(self, days, **kwargs):
+        report = self.create_report(**kwargs)
+        created = now() - datetime.timedelta(days=days)
+        Report.objects.filter(pk=report.pk).update(created=created)
+        return Report.objects.get(pk=report.pk)
+
+    def test_archivable(self):
+        """Cancelled reports, and old reports if configured, are archived."""
+        current = self.create_report()
+        cancelled = self.create_report()
+        cancelled.cancel()
+        old = self._create_old_report(400)
+        self.assertEquals(set(archive.get_archivable()), set([cancelled]))
+        self.assertEquals(set(archive.get_archivable(365)),
+                set([cancelled, old]))
+        with override_settings(NUTRITION_ARCHIVE_AFTER_DAYS=365):
+            self.assertEquals(set(archive.get_archivable()),
+                    set([cancelled, old]))
+
+    def test_archive(self):
+        """Archived reports are moved out of the Report table intact."""
+        current = self.create_report()
+        report = self._create_old_report(400, weight=12, height=90)
+        count = archive.archive_reports(archive.get_archivable(365),
+                batch_size=1)
+        self.assertEquals(count, 1)
+        self.assertEquals(list(Report.objects.all()), [current])
+        archived = ArchivedReport.objects.get()
+        self.assertEquals(archived.pk, report.pk)
+        for field in archive.FIELDS:
+            self.assertEquals(getattr(archived, field),
+                    getattr(report, field))
+        self.assertFalse(ReportTrigram.objects.filter(report=report.pk))
+
+    def test_restore(self):
+        """Restored reports keep their primary keys, dates and trigrams."""
+        report = self._create_old_report(400)
+        archive.archive_reports(archive.get_archivable(365))
+        count = archive.restore_reports(ArchivedReport.objects.all())
+        self.assertEquals(count, 1)
+        self.assertFalse(ArchivedReport.objects.exists())
+        restored = Report.objects.get()
+        for field in archive.FIELDS:
+            self.assertEquals(getattr(restored, field),
+                    getattr(report, field))
+        reports = search.filter_reports(Report.objects.all(), 'patient_id',
+                report.patient_id[1:], search.CONTAINS)
+        self.assertEquals(list(reports), [restored])
+
+    def test_commands(self):
+        report = self.create_report()
+        report.cancel()
+        output = StringIO()
+        call_command('archive_nutrition_reports', stdout=output)
+        self.assertEquals(output.getvalue().strip(), 'Archived 1 report(s).')
+        output = StringIO()
+        call_command('restore_nutrition_reports',
+                patient_id=report.patient_id, stdout=output)
+        self.assertEquals(output.getvalue().strip(), 'Restored 1 report(s).')
+        self.assertTrue(Report.objects.filter(pk=report.pk).exists())
+
+    def test_filter_form(self):
+        """Archived reports are listed instead of current ones on request."""
+        current = self.create_report()
+        report = self.create_report()
+        report.cancel()
+        archive.archive_reports()
+        form = ReportFilterForm({})
+        self.assertEquals(list(form.get_items()), [current])
+        form = ReportFilterForm({'archived': 'on',
+                'patient_id': report.patient_id, 'match': search.PREFIX})
+        self.assertEquals([r.pk for r in form.get_items()], [report.pk])
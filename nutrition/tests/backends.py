@@ -0,0 +1,53 @@
+from __future__ import unicode_literals
+import threading
+import time
+
+from healthcare.backends.dummy import DummyStorage
+
+
+__all__ = ['SlowStorage']
+
+
+class SlowStorage(DummyStorage):
+    """In-memory storage which stands in for a slow, remote backend.
+
+    Each lookup sleeps for latency seconds, and the backend has no batch
+    API, i.e., records cannot be filtered. The highest number of lookups
+    which were in progress at the same time is recorded in peak.
+    """
+
+    def __init__(self, latency=0.05):
+        self.latency = latency
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def _get(self, records, id):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        try:
+            time.sleep(self.latency)
+            # Report stores global identifiers as strings.
+            try:
+                id = int(id)
+            except (TypeError, ValueError):
+                pass
+            return records.get(id)
+        finally:
+            with self._lock:
+                self.active -= 1
+
+    def get_patient(self, id, source=None):
+        if source:
+            return super(SlowStorage, self).get_patient(id, source)
+        return self._get(self._patients, id)
+
+    def get_provider(self, id):
+        return self._get(self._providers, id)
+
+    def filter_patients(self, *lookups):
+        raise NotImplementedError()
+
+    def filter_providers(self, *lookups):
+        raise NotImplementedError()
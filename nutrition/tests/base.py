@@ -1,23 +1,151 @@
 from __future__ import unicode_literals
+import __builtin__
 import datetime
+import functools
+import mock
+from StringIO import StringIO
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connections
+from django.db.backends.util import CursorDebugWrapper
 
-from rapidsms.tests.harness import RapidTest
+from rapidsms.tests.harness import RapidTest, RapidTransactionTest
 
 from healthcare.api import client
 
+from ..counts import report_counts
 from ..models import Report
+from ..reporters import reporters
+from ..suggestions import patient_ids
 
 
-class NutritionTestBase(RapidTest):
+# Reporter lookup for use with the NUTRITION_REPORTER_LOOKUP setting.
+REPORTER_LOOKUP = 'nutrition.tests.base.provider_for_connection'
+
+
+def provider_for_connection(connection):
+    """Test reporter lookup which matches providers by phone number."""
+    for provider in client.providers.backend._providers.values():
+        if provider.get('phone') == connection.identity:
+            return provider
+    return None
+
+
+def missing_module(name):
+    """Patches imports of the named module to raise ImportError, as if an
+    optional dependency of the module were not installed.
+    """
+    real_import = __builtin__.__import__
+
+    def fake_import(module, globals=None, locals=None, fromlist=None,
+            level=-1):
+        names = [module] + ['%s.%s' % (module, item)
+                for item in fromlist or ()]
+        if name in names:
+            raise ImportError('No module named %s' % name)
+        return real_import(module, globals, locals, fromlist, level)
+    return mock.patch('__builtin__.__import__', fake_import)
+
+
+class Budget(object):
+    """Counts database queries and healthcare backend reads.
+
+    May be used as a context manager or a decorator. On exit, an
+    AssertionError is raised if any count exceeds its limit; a limit of None
+    is not checked. Healthcare reads are counted at the storage backend, so
+    batched lookups count once no matter how many records they return::
+
+        with Budget(queries=2, patients=1, providers=0) as budget:
+            ...
+    """
+    _methods = {
+        'patients': ('get_patient', 'filter_patients'),
+        'providers': ('get_provider', 'filter_providers'),
+    }
+
+    def __init__(self, queries=None, patients=None, providers=None,
+            using='default'):
+        self.limits = {
+            'queries': queries,
+            'patients': patients,
+            'providers': providers,
+        }
+        self.using = using
+
+    def __call__(self, func):
+        @functools.wraps(func)
+        def inner(*args, **kwargs):
+            with Budget(using=self.using, **self.limits):
+                return func(*args, **kwargs)
+        return inner
+
+    def __enter__(self):
+        self.counts = dict((name, 0) for name in self.limits)
+        self.queries = []
+        # Queries are counted as they pass through the debug cursor, since
+        # connection.queries is reset at the start of each request.
+        self.connection = connections[self.using]
+        self._use_debug_cursor = self.connection.use_debug_cursor
+        self.connection.use_debug_cursor = True
+        self._patches = [
+            mock.patch.object(CursorDebugWrapper, 'execute',
+                    self._query_counter(CursorDebugWrapper.execute)),
+            mock.patch.object(CursorDebugWrapper, 'executemany',
+                    self._query_counter(CursorDebugWrapper.executemany)),
+        ]
+        for patch in self._patches:
+            patch.start()
+        for name, methods in self._methods.items():
+            for method_name in methods:
+                patch = mock.patch.object(client.backend, method_name,
+                        side_effect=self._counter(name,
+                        getattr(client.backend, method_name)))
+                patch.start()
+                self._patches.append(patch)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        for patch in self._patches:
+            patch.stop()
+        self.counts['queries'] = len(self.queries)
+        self.connection.use_debug_cursor = self._use_debug_cursor
+        if exc_type is not None:
+            return
+        for name, limit in sorted(self.limits.items()):
+            if limit is not None and self.counts[name] > limit:
+                msg = '{0} {1} exceeded the budget of {2}.'.format(
+                        self.counts[name], name, limit)
+                if name == 'queries':
+                    msg += '\n' + '\n'.join(self.queries)
+                raise AssertionError(msg)
+
+    def _query_counter(self, method):
+        def execute(cursor, sql, *args, **kwargs):
+            if cursor.db is self.connection:
+                self.queries.append(sql)
+            return method(cursor, sql, *args, **kwargs)
+        return execute
+
+    def _counter(self, name, method):
+        def count(*args, **kwargs):
+            self.counts[name] += 1
+            return method(*args, **kwargs)
+        return count
+
+
+class NutritionTestMixin(object):
 
     def setUp(self):
         # Before doing anything else, we must clear out the dummy backend
         # as this is not automatically flushed between tests.
         self.clear_healthcare_backends()
-        return super(NutritionTestBase, self).setUp()
+        reporters.invalidate()
+        patient_ids.invalidate()
+        report_counts.invalidate()
+        return super(NutritionTestMixin, self).setUp()
 
     def clear_healthcare_backends(self):
         for registry in (client.patients, client.providers):
@@ -25,10 +153,26 @@ class NutritionTestBase(RapidTest):
             registry.backend._patient_ids = {}
             registry.backend._providers = {}
 
+    def assertBudget(self, queries=None, patients=None, providers=None):
+        """Returns a Budget context manager with the given limits."""
+        return Budget(queries, patients, providers)
+
+    def assertCommandError(self, name, *args, **options):
+        """Asserts that a management command fails with a CommandError.
+
+        Django 1.4's call_command reports the error and exits instead of
+        raising it.
+        """
+        options.setdefault('stderr', StringIO())
+        self.assertRaises((CommandError, SystemExit), call_command, name,
+                *args, **options)
+
     def create_patient(self, patient_id=None, source=None, **kwargs):
+        # Keep the patient young enough for pygrowup's growth tables.
+        birth_date = datetime.date.today() - datetime.timedelta(days=900)
         defaults = {
             'name': self.random_string(25),
-            'birth_date': datetime.date(2010, 3, 14),
+            'birth_date': birth_date,
             'sex': 'M',
         }
         defaults.update(**kwargs)
@@ -40,6 +184,13 @@ class NutritionTestBase(RapidTest):
         client.patients.link(patient['id'], patient_id, source)
         return patient_id, source, patient
 
+    def create_provider(self, **kwargs):
+        defaults = {
+            'name': self.random_string(25),
+        }
+        defaults.update(**kwargs)
+        return client.providers.create(**defaults)
+
     def create_report(self, analyze=True, **kwargs):
         if 'patient_id' not in kwargs:
             patient_id, source, patient = self.create_patient()
@@ -63,3 +214,11 @@ class NutritionTestBase(RapidTest):
         if kwargs:
             User.objects.filter(pk=user.pk).update(**kwargs)
         return User.objects.get(pk=user.pk)
+
+
+class NutritionTestBase(NutritionTestMixin, RapidTest):
+    pass
+
+
+class NutritionTransactionTestBase(NutritionTestMixin, RapidTransactionTest):
+    pass
@@ -0,0 +1,74 @@
+from __future__ import unicode_literals
+from decimal import Decimal
+
+from django.test.utils import override_settings
+
+from ..classification import (SEVERE, MODERATE, NORMAL, classify_wasting,
+        classify_zscore, get_cutoffs)
+from ..forms import ReportFilterForm
+from ..models import Report
+from .base import NutritionTestBase
+
+
+__all__ = ['ClassificationTest', 'ReportClassificationTest']
+
+
+class ClassificationTest(NutritionTestBase):
+
+    def test_zscore(self):
+        self.assertEquals(classify_zscore(None), None)
+        self.assertEquals(classify_zscore(Decimal('-3.01')), SEVERE)
+        self.assertEquals(classify_zscore(Decimal('-3')), MODERATE)
+        self.assertEquals(classify_zscore(Decimal('-2')), NORMAL)
+
+    def test_wasting(self):
+        """SAM is a low weight for height or MUAC, or oedema."""
+        self.assertEquals(classify_wasting(None, None, None), None)
+        self.assertEquals(classify_wasting(None, None, False), None)
+        self.assertEquals(classify_wasting(None, None, True), SEVERE)
+        self.assertEquals(classify_wasting(Decimal('-3.1'), None, False),
+                SEVERE)
+        self.assertEquals(classify_wasting(None, Decimal('11.4'), None),
+                SEVERE)
+        self.assertEquals(classify_wasting(Decimal('-2.5'), Decimal('13'),
+                False), MODERATE)
+        self.assertEquals(classify_wasting(Decimal('0'), Decimal('12'),
+                False), MODERATE)
+        self.assertEquals(classify_wasting(Decimal('0'), None, False),
+                NORMAL)
+
+    @override_settings(NUTRITION_CLASSIFICATION_CUTOFFS={'severe_muac': 12})
+    def test_cutoffs(self):
+        cutoffs = get_cutoffs()
+        self.assertEquals(cutoffs['severe_muac'], Decimal('12'))
+        self.assertEquals(cutoffs['moderate_muac'], Decimal('12.5'))
+        self.assertEquals(classify_wasting(None, Decimal('11.9'), None),
+                SEVERE)
+
+
+class ReportClassificationTest(NutritionTestBase):
+
+    def test_analyze(self):
+        """Analysis should classify the report."""
+        report = self.create_report(weight=Decimal('8'),
+                height=Decimal('90'), muac=Decimal('11'))
+        report = Report.objects.get(pk=report.pk)
+        self.assertEquals(report.wasting, SEVERE)
+        self.assertEquals(report.stunting,
+                classify_zscore(report.height4age))
+        self.assertEquals(report.underweight,
+                classify_zscore(report.weight4age))
+
+    def test_incomplete(self):
+        """Reports without z-scores are classified from MUAC and oedema."""
+        report = self.create_report(oedema=True)
+        self.assertEquals(report.status, Report.INCOMPLETE)
+        self.assertEquals(report.wasting, SEVERE)
+        self.assertEquals(report.stunting, None)
+
+    def test_filter(self):
+        sam = self.create_report(oedema=True)
+        self.create_report(muac=Decimal('12'))
+        self.create_report()
+        form = ReportFilterForm({'wasting': SEVERE})
+        self.assertEquals(list(form.get_items()), [sam])
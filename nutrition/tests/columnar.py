@@ -0,0 +1,176 @@
+from __future__ import unicode_literals
+from io import BytesIO
+import zlib
+
+from django.utils.unittest import skipIf
+
+from ..models import Report
+from .base import NutritionTestBase, missing_module
+from .views import NutritionViewTest
+
+try:
+    import numpy
+    from .. import columnar
+except ImportError:
+    numpy = None
+    pyarrow = None
+else:
+    pyarrow = columnar.pyarrow
+
+
+__all__ = ['ColumnarExportTest', 'ColumnarViewTest',
+        'ColumnarViewWithoutNumPyTest']
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class ColumnarExportTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ColumnarExportTest, self).setUp()
+        patient_id, _, patient = self.create_patient(location='Village')
+        self.report = self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], height=90, weight=12.5,
+                oedema=True, reporter_id='bob')
+        self.create_report(analyze=False)
+        self.create_report(analyze=False, patient_id='missing',
+                global_patient_id='12345', oedema=False)
+
+    def _load(self, **kwargs):
+        data = b''.join(columnar.export(Report.objects.all(), 'npz',
+                **kwargs))
+        return numpy.load(BytesIO(data))
+
+    def test_columns(self):
+        """Values keep their types, and unknown values are masked."""
+        chunks = list(columnar.ReportColumns(
+                Report.objects.all()))
+        self.assertEquals(len(chunks), 1)
+        columns = chunks[0]
+        self.assertEquals(columns.keys()[0], 'id')
+        self.assertEquals(columns['id'].dtype, numpy.int64)
+        self.assertEquals(columns['weight'].dtype, numpy.float64)
+        self.assertEquals(columns['weight'][0], 12.5)
+        self.assertTrue(columns['weight'].mask[1])
+        self.assertEquals(columns['created'].dtype,
+                numpy.dtype('datetime64[us]'))
+        self.assertEquals(list(columns['oedema'].mask), [False, True, False])
+        self.assertEquals(columns['status'][0], Report.ANALYZED)
+        self.assertEquals(columns['location'][0], 'Village')
+        self.assertTrue(columns['location'].mask[2])
+        self.assertEquals(columns['age'][0], 29)
+
+    def test_row_groups(self):
+        """Reports are read in a single query, a chunk at a time."""
+        with self.assertBudget(queries=1, patients=3):
+            chunks = list(columnar.ReportColumns(Report.objects.all(),
+                    row_group_size=2))
+        self.assertEquals([len(chunk['id']) for chunk in chunks], [2, 1])
+
+    def test_npz(self):
+        for row_group_size in (1, None):
+            data = self._load(row_group_size=row_group_size)
+            self.assertEquals(sorted(data.files),
+                    sorted(columnar.ReportColumns.fields +
+                    columnar.ReportColumns.patient_fields))
+            self.assertEquals(list(data['id']), list(Report.objects.order_by(
+                    'pk').values_list('pk', flat=True)))
+            self.assertEquals(data['weight'][0], 12.5)
+            self.assertTrue(numpy.isnan(data['weight'][1]))
+            # Oedema, which may be unknown, is a float.
+            self.assertEquals(data['oedema'].dtype, numpy.float64)
+            self.assertEquals(data['oedema'][0], 1)
+            self.assertTrue(numpy.isnan(data['oedema'][1]))
+            self.assertEquals(data['oedema'][2], 0)
+            self.assertEquals(data['active'].dtype, bool)
+            self.assertEquals(list(data['reporter_id']), ['bob', '', ''])
+            self.assertEquals(data['reporter_id'].dtype.kind, 'U')
+
+    def test_empty(self):
+        data = b''.join(columnar.export(Report.objects.none(), 'npz'))
+        self.assertEquals(len(numpy.load(BytesIO(data))['id']), 0)
+
+    def test_unknown_format(self):
+        self.assertRaises(ValueError, columnar.export, Report.objects.all(),
+                'xls')
+        if pyarrow is None:
+            self.assertEquals(columnar.get_formats(), ['npz'])
+            self.assertRaises(ValueError, columnar.export,
+                    Report.objects.all(), 'parquet')
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed.')
+    def test_parquet(self):
+        import pyarrow.parquet
+        data = b''.join(columnar.export(Report.objects.all(), 'parquet',
+                row_group_size=2))
+        parquet = pyarrow.parquet.ParquetFile(pyarrow.BufferReader(data))
+        self.assertEquals(parquet.num_row_groups, 2)
+        table = parquet.read()
+        self.assertEquals(table.column('weight').to_pylist(),
+                [12.5, None, None])
+        self.assertEquals(table.column('oedema').to_pylist(),
+                [True, None, False])
+
+    @skipIf(pyarrow is None, 'pyarrow is not installed.')
+    def test_arrow(self):
+        data = b''.join(columnar.export(Report.objects.all(), 'arrow',
+                row_group_size=2))
+        batches = list(pyarrow.ipc.open_stream(pyarrow.BufferReader(data)))
+        self.assertEquals([batch.num_rows for batch in batches], [2, 1])
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEquals(table.column('reporter_id').to_pylist(),
+                ['bob', None, None])
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class ColumnarViewTest(NutritionViewTest):
+    url_name = 'columnar_nutrition_reports'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_no_permission(self):
+        self.user.user_permissions.all().delete()
+        self.assertEquals(self._get().status_code, 302)
+
+    def test_npz(self):
+        self.create_report(weight=12.5, reporter_id='bob')
+        self.create_report(weight=11, reporter_id='alice')
+        response = self._get(get_kwargs={'format': 'npz',
+                'reporter_id': 'bob'})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Disposition'],
+                'attachment; filename=nutrition_reports.npz')
+        data = numpy.load(BytesIO(self._content(response)))
+        self.assertEquals(list(data['weight']), [12.5])
+
+    def test_default_format(self):
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        extension = columnar.FORMATS[columnar.get_formats()[0]][0]
+        self.assertTrue(response['Content-Disposition'].endswith(extension))
+
+    def test_gzip(self):
+        self.create_report(weight=12.5)
+        response = self._get(get_kwargs={'format': 'npz',
+                'compress': 'gzip'})
+        self.assertEquals(response['Content-Disposition'],
+                'attachment; filename=nutrition_reports.npz.gz')
+        content = zlib.decompress(self._content(response),
+                16 + zlib.MAX_WBITS)
+        self.assertEquals(list(numpy.load(BytesIO(content))['weight']),
+                [12.5])
+
+    def test_errors(self):
+        for params in ({'format': 'xls'}, {'start_date': 'bad'},
+                {'compress': 'zip'}):
+            self.assertEquals(self._get(get_kwargs=params).status_code, 400)
+
+
+class ColumnarViewWithoutNumPyTest(NutritionViewTest):
+    url_name = 'columnar_nutrition_reports'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_numpy_missing(self):
+        with missing_module('nutrition.columnar'):
+            response = self._get(get_kwargs={'format': 'npz'})
+        self.assertEquals(response.status_code, 501)
+        self.assertContains(response, 'no formats are available',
+                status_code=501)
@@ -0,0 +1,98 @@
+from __future__ import unicode_literals
+import mock
+
+from django.db import connection
+from django.test.utils import override_settings
+
+from ..counts import report_counts
+from ..models import Report
+from .base import NutritionTestBase, NutritionTransactionTestBase
+
+
+__all__ = ['ReportCountsTest', 'ReportCountEstimateTest']
+
+
+class ReportCountsTest(NutritionTestBase):
+
+    def _count(self, **filters):
+        queryset = Report.objects.filter(**filters)
+        return report_counts.get(queryset, filters.items())
+
+    def test_cached(self):
+        """Counts should be cached for each set of filters."""
+        report = self.create_report()
+        self.create_report()
+        self.assertEquals(self._count(), (2, False))
+        self.assertEquals(self._count(patient_id=report.patient_id),
+                (1, False))
+        with self.assertBudget(queries=0):
+            self.assertEquals(self._count(patient_id=report.patient_id),
+                    (1, False))
+
+    def test_invalidated_on_create(self):
+        self.create_report()
+        self.assertEquals(self._count(), (1, False))
+        self.create_report()
+        self.assertEquals(self._count(), (2, False))
+
+    def test_invalidated_on_status_change(self):
+        report = self.create_report(analyze=False)
+        self.assertEquals(self._count(status=Report.UNANALYZED), (1, False))
+        report.status = Report.ANALYZED
+        report.save()
+        self.assertEquals(self._count(status=Report.UNANALYZED), (0, False))
+
+    def test_invalidated_on_delete(self):
+        report = self.create_report()
+        self.assertEquals(self._count(), (1, False))
+        report.delete()
+        self.assertEquals(self._count(), (0, False))
+
+    def test_unfiltered_change(self):
+        """Changes to unfiltered fields should not discard counts."""
+        report = self.create_report()
+        version = report_counts.version
+        report = Report.objects.get(pk=report.pk)
+        report.weight = 15
+        report.save()
+        self.assertEquals(report_counts.version, version)
+
+    def test_invalidated_on_cancel(self):
+        """Both ways of cancelling a report discard counts."""
+        report = self.create_report()
+        self.assertEquals(self._count(active=True), (1, False))
+        report.cancel()
+        self.assertEquals(self._count(active=True), (0, False))
+        self.create_report(patient_id=report.patient_id,
+                global_patient_id=report.global_patient_id)
+        self.assertEquals(self._count(active=True), (1, False))
+        Report.objects.cancel_latest(report.patient_id)
+        self.assertEquals(self._count(active=True), (0, False))
+
+    def test_estimate_threshold(self):
+        """Small estimates should not be used."""
+        self.create_report()
+        with mock.patch.object(report_counts, 'estimate', return_value=5):
+            self.assertEquals(self._count(), (1, False))
+
+
+class ReportCountEstimateTest(NutritionTransactionTestBase):
+    # ANALYZE commits the current transaction in SQLite.
+
+    def tearDown(self):
+        connection.cursor().execute('DROP TABLE IF EXISTS sqlite_stat1')
+        super(ReportCountEstimateTest, self).tearDown()
+
+    @override_settings(NUTRITION_COUNT_ESTIMATE_THRESHOLD=2)
+    def test_estimate(self):
+        """Unfiltered counts should be estimated from table statistics."""
+        for i in range(3):
+            report = self.create_report()
+        self.assertEquals(report_counts.estimate(Report), None)
+        connection.cursor().execute('ANALYZE')
+        self.assertEquals(report_counts.estimate(Report), 3)
+        queryset = Report.objects.all()
+        self.assertEquals(report_counts.get(queryset, []), (3, True))
+        queryset = Report.objects.filter(patient_id=report.patient_id)
+        filters = [('patient_id', report.patient_id)]
+        self.assertEquals(report_counts.get(queryset, filters), (1, False))
@@ -0,0 +1,113 @@
+from __future__ import unicode_literals
+import datetime
+import json
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+from django.utils.timezone import now
+
+from .. import events
+from ..archive import archive_reports, restore_reports
+from ..models import ArchivedReport, Report, ReportEvent
+from .base import NutritionTestBase
+
+
+__all__ = ['ReportEventTest']
+
+
+class ReportEventTest(NutritionTestBase):
+
+    def _kinds(self, report):
+        return list(ReportEvent.objects.filter(report_id=report.pk)
+                .order_by('pk').values_list('kind', 'status'))
+
+    def test_created(self):
+        """Creating and analyzing a report logs an event for each."""
+        report = self.create_report(weight=12, height=90)
+        self.assertEquals(self._kinds(report), [
+            (ReportEvent.CREATED, Report.UNANALYZED),
+            (ReportEvent.ANALYZED, Report.ANALYZED),
+        ])
+
+    def test_status_changed(self):
+        """Changing a report's status logs an event."""
+        report = self.create_report(analyze=False)
+        report.status = Report.SUSPECT
+        report.save()
+        report.save()  # Saving an unchanged report logs nothing.
+        self.assertEquals(self._kinds(report), [
+            (ReportEvent.CREATED, Report.UNANALYZED),
+            (ReportEvent.STATUS_CHANGED, Report.SUSPECT),
+        ])
+
+    def test_cancelled(self):
+        report = self.create_report(analyze=False)
+        self.assertTrue(report.cancel())
+        self.assertFalse(Report.objects.get(pk=report.pk).cancel())
+        self.assertEquals(self._kinds(report), [
+            (ReportEvent.CREATED, Report.UNANALYZED),
+            (ReportEvent.CANCELLED, Report.UNANALYZED),
+        ])
+
+    def test_archive(self):
+        """Archiving and restoring reports logs no events."""
+        report = self.create_report(analyze=False)
+        report.cancel()
+        archive_reports()
+        restore_reports(ArchivedReport.objects.all())
+        self.assertEquals(len(self._kinds(report)), 2)
+
+    @override_settings(NUTRITION_EVENT_PAGE_SIZE=3, NUTRITION_EVENT_LAG=0)
+    def test_paging(self):
+        """Events are read in pages, in sequence order."""
+        for i in range(2):
+            self.create_report(weight=12, height=90)
+        pks = list(ReportEvent.objects.order_by('pk').values_list('pk',
+                flat=True))
+        self.assertEquals(len(pks), 4)
+        page = events.get_page()
+        self.assertEquals([e['sequence'] for e in page['events']], pks[:3])
+        self.assertEquals(page['next'], pks[2])
+        self.assertTrue(page['more'])
+        page = events.get_page(page['next'])
+        self.assertEquals([e['sequence'] for e in page['events']], pks[3:])
+        self.assertFalse(page['more'])
+        page = events.get_page(page['next'])
+        self.assertEquals(page, {'events': [], 'next': pks[3],
+                'more': False})
+
+    @override_settings(NUTRITION_EVENT_PAGE_SIZE=3)
+    def test_limit(self):
+        """Page sizes are capped at NUTRITION_EVENT_PAGE_SIZE."""
+        self.assertEquals(events.get_page_size(), 3)
+        self.assertEquals(events.get_page_size(2), 2)
+        self.assertEquals(events.get_page_size(10), 3)
+        self.assertEquals(events.get_page_size(0), 1)
+
+    def test_lag(self):
+        """Recent events are not read, nor are any which follow them."""
+        for i in range(2):
+            self.create_report(weight=12, height=90)
+        pks = list(ReportEvent.objects.order_by('pk').values_list('pk',
+                flat=True))
+        self.assertEquals(events.get_events(), [])
+        old = now() - datetime.timedelta(seconds=events.get_lag() + 1)
+        ReportEvent.objects.exclude(pk=pks[2]).update(time=old)
+        self.assertEquals([e.pk for e in events.get_events()], pks[:2])
+        self.assertFalse(events.get_page(pks[1])['more'])
+        ReportEvent.objects.update(time=old)
+        self.assertEquals([e.pk for e in events.get_events(pks[1])],
+                pks[2:])
+
+    @override_settings(NUTRITION_EVENT_LAG=0)
+    def test_command(self):
+        report = self.create_report(analyze=False)
+        first = ReportEvent.objects.get(report_id=report.pk)
+        report.cancel()
+        stdout = StringIO()
+        call_command('nutrition_events', after=first.pk, stdout=stdout)
+        page = json.loads(stdout.getvalue())
+        self.assertEquals(len(page['events']), 1)
+        self.assertEquals(page['events'][0]['report'], report.pk)
+        self.assertEquals(page['events'][0]['type'], ReportEvent.CANCELLED)
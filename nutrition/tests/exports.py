@@ -0,0 +1,181 @@
+from __future__ import unicode_literals
+from decimal import Decimal
+import zlib
+
+from django.test.utils import override_settings
+
+from ..exports import (ReportRecords, ReportRows, accepts_gzip,
+        get_compression_level, gzip_stream, stream_csv)
+from ..models import Report
+from ..tables import CSVNutritionReportTable
+from .base import NutritionTestBase
+
+
+__all__ = ['ReportRecordsTest', 'ReportRowsTest', 'StreamTest']
+
+
+class ReportRowsTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ReportRowsTest, self).setUp()
+        patient_id, _, patient = self.create_patient(location='Village')
+        self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], height=90,
+                weight=12.5, muac=13.2, oedema=True, reporter_id='bob')
+        self.create_report(oedema=False, reporter_id='')
+        self.create_report(analyze=False, status=None)
+        patient_id, _, patient = self.create_patient(birth_date=None, sex='')
+        self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], weight=11)
+        report = self.create_report(analyze=False, patient_id='missing',
+                global_patient_id='12345')
+        report.cancel()
+
+    def _table_rows(self, order_by=None):
+        """Returns the rows exported by CSVNutritionReportTable."""
+        table = CSVNutritionReportTable(Report.objects.all(),
+                order_by=order_by)
+        Report.prefetch_patients(table.data.queryset)
+        headers = [name.title() for name in table.columns.names()]
+        return [headers] + [list(row) for row in table.rows]
+
+    def test_matches_table(self):
+        """Rows should match those rendered by django_tables2."""
+        self.assertEquals(list(ReportRows(Report.objects.all())),
+                self._table_rows())
+
+    def test_patient_fields(self):
+        rows = list(ReportRows(Report.objects.all()))
+        headers, first = rows[0], rows[1]
+        self.assertEquals(first[headers.index('Location')], 'Village')
+        self.assertEquals(first[headers.index('Sex')], 'M')
+        self.assertEquals(first[headers.index('Age')], 29)
+
+    def test_order_by(self):
+        """The table's sort parameter should be respected."""
+        rows = list(ReportRows(Report.objects.all(), order_by='-id'))
+        self.assertEquals(rows, self._table_rows(order_by='-id'))
+        self.assertEquals([row[0] for row in rows[1:]], [5, 4, 3, 2, 1])
+
+    def test_bad_order_by(self):
+        """Unknown or unorderable columns should be ignored."""
+        rows = list(ReportRows(Report.objects.all(), order_by='age,bad'))
+        self.assertEquals([row[0] for row in rows[1:]], [1, 2, 3, 4, 5])
+
+    def test_chunks(self):
+        """Patients should be retrieved for each chunk of reports."""
+        rows = ReportRows(Report.objects.all())
+        rows.chunk_size = 2
+        with self.assertBudget(queries=1, patients=3):
+            exported = list(rows)
+        self.assertEquals(exported, self._table_rows())
+
+
+class ReportRecordsTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ReportRecordsTest, self).setUp()
+        patient_id, _, patient = self.create_patient(location='Village')
+        self.report = self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], height=90, weight=12.5)
+        for i in range(4):
+            self.create_report(analyze=False)
+
+    def test_fields(self):
+        """Only the chosen fields are returned, with the id first."""
+        records = list(ReportRecords(Report.objects.all(),
+                fields=['weight', 'status']))
+        self.assertEquals(len(records), 5)
+        self.assertEquals(records[0].keys(), ['id', 'weight', 'status'])
+        self.assertEquals(records[0], {'id': self.report.pk,
+                'weight': Decimal('12.5'), 'status': Report.ANALYZED})
+
+    def test_default_fields(self):
+        records = list(ReportRecords(Report.objects.all()))
+        self.assertEquals(tuple(records[0].keys()), ReportRecords.fields)
+
+    def test_unknown_field(self):
+        self.assertRaises(ValueError, ReportRecords, Report.objects.all(),
+                fields=['raw_text'])
+
+    def test_no_patients(self):
+        """Patients are not retrieved unless a patient field is chosen."""
+        with self.assertBudget(queries=1, patients=0):
+            list(ReportRecords(Report.objects.all(), fields=['status']))
+
+    def test_patient_fields(self):
+        records = ReportRecords(Report.objects.all(),
+                fields=['sex', 'age', 'location'])
+        records.chunk_size = 2
+        with self.assertBudget(queries=1, patients=3):
+            first = list(records)[0]
+        self.assertEquals(first, {'id': self.report.pk, 'sex': 'M',
+                'age': 29, 'location': 'Village'})
+
+    @override_settings(NUTRITION_API_PAGE_SIZE=2)
+    def test_cursor(self):
+        """Pages follow one another by cursor, in primary key order."""
+        pks = list(Report.objects.order_by('pk').values_list('pk',
+                flat=True))
+        pages = []
+        cursor = None
+        while True:
+            records = ReportRecords(Report.objects.all(), fields=['id'],
+                    cursor=cursor, limit=10)
+            pages.append([record['id'] for record in records])
+            cursor = records.next
+            if cursor is None:
+                break
+        self.assertEquals(pages, [pks[:2], pks[2:4], pks[4:]])
+
+    def test_bad_cursor(self):
+        self.assertRaises(ValueError, ReportRecords, Report.objects.all(),
+                cursor='1')
+
+
+class StreamTest(NutritionTestBase):
+
+    def _chunks(self):
+        yield b'first'
+        for i in range(1000):
+            yield 'row {0}\n'.format(i)
+        raise AssertionError('Every chunk was read before any output.')
+
+    def test_csv(self):
+        rows = [['Id', 'Name']] + [[i, 'caf\xe9'] for i in range(1000)]
+        chunks = list(stream_csv(iter(rows), buffer_size=1024))
+        # The headers are sent on their own.
+        self.assertEquals(chunks[0], b'Id,Name\r\n')
+        self.assertTrue(len(chunks) > 2)
+        self.assertTrue(all(len(chunk) < 1100 for chunk in chunks))
+        self.assertEquals(b''.join(chunks).splitlines()[1],
+                '0,caf\xe9'.encode('utf-8'))
+
+    def test_gzip(self):
+        chunks = ['row {0}\n'.format(i) for i in range(5000)]
+        data = b''.join(gzip_stream(iter(chunks), level=1, flush_size=1024))
+        self.assertEquals(zlib.decompress(data, 16 + zlib.MAX_WBITS),
+                ''.join(chunks).encode('utf-8'))
+        self.assertTrue(len(data) < len(''.join(chunks)) / 2)
+
+    def test_gzip_first_bytes(self):
+        """The first chunk is sent before the rest are read."""
+        stream = gzip_stream(self._chunks())
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self.assertEquals(decompressor.decompress(next(stream)), b'first')
+
+    def test_compression_level(self):
+        self.assertEquals(get_compression_level(), 6)
+        self.assertEquals(get_compression_level('9'), 9)
+        with override_settings(NUTRITION_EXPORT_GZIP_LEVEL=1):
+            self.assertEquals(get_compression_level(), 1)
+        for level in (0, 10, 'bad'):
+            self.assertRaises(ValueError, get_compression_level, level)
+
+    def test_accepts_gzip(self):
+        for header in ('gzip', 'deflate, gzip;q=0.5', 'x-gzip', '*',
+                'identity, *;q=0.1', 'GZIP ; Q=1'):
+            self.assertTrue(accepts_gzip(header), header)
+        for header in ('', 'identity', 'gzip;q=0', 'gzip;q=0.0, *',
+                'deflate, *;q=0', 'gzip;q=bad'):
+            self.assertFalse(accepts_gzip(header), header)
@@ -0,0 +1,85 @@
+from __future__ import unicode_literals
+from decimal import Decimal
+import json
+
+from django.core import serializers
+from django.db import models
+from django.db.models import F
+
+from ..fields import FixedPointField
+from .base import NutritionTestBase
+
+
+__all__ = ['FixedPointFieldTest']
+
+
+class FixedPointModel(models.Model):
+    tenths = FixedPointField(max_digits=4, decimal_places=1, null=True,
+            blank=True)
+    hundredths = FixedPointField(max_digits=4, decimal_places=2, null=True,
+            blank=True)
+
+    class Meta:
+        app_label = 'nutrition'
+
+
+class FixedPointFieldTest(NutritionTestBase):
+
+    def test_stored_as_integers(self):
+        obj = FixedPointModel.objects.create(tenths=12, hundredths='-1.236')
+        self.assertEquals(obj.tenths_fixed, 120)
+        self.assertEquals(obj.hundredths_fixed, -124)
+        values = FixedPointModel.objects.values_list('tenths', 'hundredths')
+        self.assertEquals(list(values), [(120, -124)])
+
+    def test_decimal_attribute(self):
+        FixedPointModel.objects.create(tenths=Decimal('12.5'))
+        obj = FixedPointModel.objects.get()
+        self.assertEquals(obj.tenths, Decimal('12.5'))
+        self.assertTrue(isinstance(obj.tenths, Decimal))
+        self.assertEquals(obj.hundredths, None)
+        obj.tenths = 3
+        self.assertEquals(obj.tenths_fixed, 30)
+
+    def test_lookups(self):
+        """Lookups are given Decimal values, not stored integers."""
+        obj = FixedPointModel.objects.create(tenths=Decimal('12.5'))
+        objects = FixedPointModel.objects.all()
+        self.assertEquals(list(objects.filter(tenths=Decimal('12.5'))), [obj])
+        self.assertEquals(list(objects.filter(tenths__gt=12)), [obj])
+        self.assertEquals(list(objects.filter(tenths__in=['12.5'])), [obj])
+        self.assertEquals(list(objects.filter(tenths__range=(13, 14))), [])
+        self.assertEquals(list(objects.filter(hundredths__isnull=True)),
+                [obj])
+
+    def test_update(self):
+        """update() is given numbers, not stored integers."""
+        FixedPointModel.objects.create(tenths=1)
+        FixedPointModel.objects.update(tenths=Decimal('12.5'), hundredths=3)
+        obj = FixedPointModel.objects.get()
+        self.assertEquals(obj.tenths, Decimal('12.5'))
+        self.assertEquals(obj.hundredths_fixed, 300)
+        FixedPointModel.objects.update(tenths=F('tenths') + 1)
+        self.assertEquals(FixedPointModel.objects.get().tenths_fixed, 126)
+
+    def test_save(self):
+        """Saving a loaded object keeps its stored integers."""
+        FixedPointModel.objects.create(tenths=Decimal('12.5'))
+        obj = FixedPointModel.objects.get()
+        obj.full_clean()
+        obj.save()
+        self.assertEquals(FixedPointModel.objects.get().tenths_fixed, 125)
+
+    def test_serialization(self):
+        """Serialized objects hold the Decimal values."""
+        FixedPointModel.objects.create(tenths=Decimal('12.5'))
+        data = serializers.serialize('json', FixedPointModel.objects.all())
+        self.assertEquals(json.loads(data)[0]['fields']['tenths'], '12.5')
+        FixedPointModel.objects.all().delete()
+        for obj in serializers.deserialize('json', data):
+            obj.save()
+        self.assertEquals(FixedPointModel.objects.get().tenths_fixed, 125)
+
+    def test_form_field(self):
+        field = FixedPointModel._meta.get_field('tenths').formfield()
+        self.assertEquals(field.clean('12.5'), Decimal('12.5'))
@@ -0,0 +1,50 @@
+from __future__ import unicode_literals
+import decimal
+from decimal import Decimal
+import mock
+import threading
+
+from .. import growth
+from .base import NutritionTestBase
+
+
+__all__ = ['GrowthTest']
+
+
+class GrowthTest(NutritionTestBase):
+
+    def test_shared_calculator(self):
+        """Growth tables should only be loaded once."""
+        self.assertTrue(growth.get_calculator() is growth.get_calculator())
+
+    def test_thread_calculator(self):
+        """Each thread has a calculator, which shares the growth tables."""
+        calculator = growth.get_calculator()
+        results = []
+
+        def run():
+            results.append((growth.get_calculator(), decimal.getcontext()))
+
+        thread = threading.Thread(target=run)
+        thread.start()
+        thread.join()
+        other, context = results[0]
+        self.assertFalse(other is calculator)
+        self.assertTrue(other.context is context)
+        self.assertFalse(calculator.context is context)
+        tables = [name for name, value in vars(calculator).items()
+                if isinstance(value, dict)]
+        self.assertTrue(tables)
+        for name in tables:
+            self.assertTrue(getattr(other, name) is getattr(calculator, name))
+
+    def test_lazy_calculator(self):
+        """The calculator should be created on first use."""
+        with mock.patch.object(growth, '_calculator', None):
+            with mock.patch('pygrowup.pygrowup.Calculator') as Calculator:
+                Calculator.return_value.wfa.return_value = Decimal('-1.5')
+                growth.warm_up()
+                report = self.create_report(analyze=False, weight=12)
+                report.analyze(save=False)
+        self.assertEquals(Calculator.call_count, 1)
+        self.assertTrue(Calculator.return_value.wfa.called)
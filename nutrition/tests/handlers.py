@@ -2,18 +2,25 @@ from __future__ import unicode_literals
 import datetime
 from decimal import Decimal
 import mock
+import threading
 from pygrowup.exceptions import InvalidMeasurement
 
+from django.db import connection
+from django.test.utils import override_settings
+
 from rapidsms.messages import IncomingMessage
 
 from healthcare.api import client
 
 from ..handlers import CancelReportHandler, CreateReportHandler
 from ..models import Report
-from .base import NutritionTestBase
+from ..reporters import reporters
+from .base import (NutritionTestBase, NutritionTransactionTestBase,
+        provider_for_connection, REPORTER_LOOKUP)
 
 
-__all__ = ['CancelReportHandlerTest', 'CreateReportHandlerTest']
+__all__ = ['CancelReportHandlerTest', 'CancelReportConcurrencyTest',
+        'CreateReportHandlerTest']
 
 
 class CancelReportHandlerTest(NutritionTestBase):
@@ -28,8 +35,8 @@ class CancelReportHandlerTest(NutritionTestBase):
                 global_patient_id=self.patient['id'], status='A',
                 analyze=False)
 
-    def _send(self, text):
-        return self.Handler.test(text)
+    def _send(self, text, identity=None):
+        return self.Handler.test(text, identity=identity)
 
     def test_wrong_prefix(self):
         """Handler should not reply to an incorrect keyword."""
@@ -69,13 +76,49 @@ class CancelReportHandlerTest(NutritionTestBase):
         self.assertTrue(Report.objects.get().active)
         self.assertEquals(Report.objects.get().status, Report.ANALYZED)
 
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_registered_reporter(self):
+        """Reporter may cancel the patient's latest report they sent."""
+        provider = self.create_provider(name='Jordan', phone='5551234')
+        report = self.create_report(patient_id=self.patient_id,
+                global_patient_id=self.patient['id'], status='A',
+                reporter_id=provider['id'], global_reporter_id=provider['id'],
+                analyze=False)
+        replies = self._send('nutrition cancel asdf', identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks Jordan.'), reply)
+        self.assertTrue(Report.objects.get(pk=self.report.pk).active)
+        self.assertFalse(Report.objects.get(pk=report.pk).active)
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_other_reporter(self):
+        """Reporter may not cancel reports sent by somebody else."""
+        self.create_provider(name='Jordan', phone='5551234')
+        replies = self._send('nutrition cancel asdf', identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue('Sorry, asdf does not have any ' in reply, reply)
+        self.assertTrue(Report.objects.get().active)
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
     def test_unregistered_reporter(self):
-        """Reporter must be registered."""
-        pass  # TODO
+        """Unregistered reporters may cancel reports anonymously."""
+        replies = self._send('nutrition cancel asdf', identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks anonymous.'), reply)
+        self.assertFalse(Report.objects.get().active)
 
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
     def test_inactive_reporter(self):
-        """Reporter must be active."""
-        pass  # TODO
+        """Inactive reporters are treated as anonymous."""
+        self.create_provider(name='Jordan', phone='5551234', status='I')
+        replies = self._send('nutrition cancel asdf', identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks anonymous.'), reply)
+        self.assertFalse(Report.objects.get().active)
 
     def test_unregistered_patient(self):
         """Report patient must be registered."""
@@ -114,16 +157,29 @@ class CancelReportHandlerTest(NutritionTestBase):
         self.assertEquals(Report.objects.count(), 0)
 
     def test_no_uncancelled_reports(self):
-        """Handler should still succeed if report is already cancelled."""
+        """Handler should not re-cancel a report that is already cancelled."""
         Report.objects.all().update(active=False)
         replies = self._send('nutrition cancel asdf')
         self.assertEquals(len(replies), 1)
         reply = replies[0]
-        self.assertTrue(reply.startswith('Thanks'), reply)
+        self.assertTrue('Sorry, asdf does not have any active ' in reply,
+                reply)
         self.assertEquals(Report.objects.count(), 1)
         self.assertFalse(Report.objects.get().active)
         self.assertEquals(Report.objects.get().status, Report.ANALYZED)
 
+    def test_cancel_latest_active_report(self):
+        """Handler should skip reports which are already cancelled."""
+        self.report2 = self.create_report(patient_id=self.patient_id,
+                global_patient_id=self.patient['id'], status='A',
+                active=False, analyze=False)
+        replies = self._send('nutrition cancel asdf')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks'), reply)
+        self.assertFalse(Report.objects.get(pk=self.report.pk).active)
+        self.assertFalse(Report.objects.get(pk=self.report2.pk).active)
+
     def test_cancel_latest_report(self):
         """Handler should cancel the patient's most recent report."""
         self.report2 = self.create_report(patient_id=self.patient_id,
@@ -155,18 +211,75 @@ class CancelReportHandlerTest(NutritionTestBase):
         self.assertEquals(Report.objects.get().status, Report.ANALYZED)
 
 
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_budget(self):
+        """Cancelling should use a fixed number of queries and lookups."""
+        provider = self.create_provider(phone='5551234')
+        for i in range(5):
+            self.create_report(patient_id=self.patient_id,
+                    global_patient_id=self.patient['id'],
+                    global_reporter_id=provider['id'], analyze=False)
+        conn = self.lookup_connections(['5551234'])[0]
+        msg = IncomingMessage(conn, 'nutrition cancel asdf')
+        reporters.get(conn)  # Reporter lookups are cached.
+        with self.assertBudget(queries=3, patients=1, providers=0):
+            self.Handler.dispatch(self.router, msg)
+        self.assertTrue(msg.responses[0].text.startswith('Thanks'))
+
+
+class CancelReportConcurrencyTest(NutritionTransactionTestBase):
+    """Concurrent cancellations against a shared database."""
+
+    def test_concurrent_cancel(self):
+        """Each report should be cancelled exactly once."""
+        patient_id, source, patient = self.create_patient('asdf')
+        reports = [self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], analyze=False)
+                for i in range(5)]
+        cancelled, missing, errors = [], [], []
+        start = threading.Event()
+
+        def cancel():
+            start.wait()
+            try:
+                report = Report.objects.cancel_latest(patient_id)
+                cancelled.append(report.pk)
+            except Report.DoesNotExist:
+                missing.append(True)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=cancel) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        start.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEquals(errors, [])
+        self.assertEquals(sorted(cancelled), sorted(r.pk for r in reports))
+        self.assertEquals(len(missing), 3)
+        self.assertFalse(Report.objects.filter(active=True).exists())
+
+
 class CreateReportHandlerTest(NutritionTestBase):
     """Tests for KeywordHandler to add a nutrition report."""
     Handler = CreateReportHandler
 
     def setUp(self):
         super(CreateReportHandlerTest, self).setUp()
+        # KeywordHandler.test caches a mock backend on the handler class,
+        # which does not survive the rollback at the end of each test.
+        if hasattr(self.Handler, '_mock_backend'):
+            del self.Handler._mock_backend
         self.patient_id = 'asdf'
         self.patient_id, self.source, self.patient = self.create_patient(
                 self.patient_id)
 
-    def _send(self, text):
-        return self.Handler.test(text)
+    def _send(self, text, identity=None):
+        return self.Handler.test(text, identity=identity)
 
     def test_wrong_prefix(self):
         """Handler should not reply to an incorrect prefix."""
@@ -216,13 +329,65 @@ class CreateReportHandlerTest(NutritionTestBase):
                 'understand your report.'), reply)
         self.assertEquals(Report.objects.count(), 0)
 
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_registered_reporter(self):
+        """Report should record the reporter who sent the message."""
+        provider = self.create_provider(name='Jordan', phone='5551234')
+        replies = self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks Jordan.'), reply)
+        report = Report.objects.get()
+        self.assertEquals(long(report.reporter_id), provider['id'])
+        self.assertEquals(long(report.global_reporter_id), provider['id'])
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
     def test_unregistered_reporter(self):
-        """Reporter must be registered."""
-        pass  # TODO
+        """Unregistered reporters may send reports anonymously."""
+        replies = self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks anonymous.'), reply)
+        report = Report.objects.get()
+        self.assertEquals(report.reporter_id, None)
+        self.assertEquals(report.global_reporter_id, None)
 
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
     def test_inactive_reporter(self):
-        """Reporter must be active."""
-        pass  # TODO
+        """Inactive reporters are treated as anonymous."""
+        self.create_provider(name='Jordan', phone='5551234', status='I')
+        replies = self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                identity='5551234')
+        self.assertEquals(len(replies), 1)
+        reply = replies[0]
+        self.assertTrue(reply.startswith('Thanks anonymous.'), reply)
+        self.assertEquals(Report.objects.get().reporter_id, None)
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_reporter_cached(self):
+        """Reporter lookups should be cached per connection."""
+        self.create_provider(name='Jordan', phone='5551234')
+        with mock.patch(REPORTER_LOOKUP,
+                wraps=provider_for_connection) as method:
+            for i in range(3):
+                self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                        identity='5551234')
+        self.assertEquals(method.call_count, 1)
+        self.assertEquals(Report.objects.filter(reporter_id=None).count(), 0)
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_reporter_cache_invalidated(self):
+        """Invalidating the cache should cause the reporter to be re-read."""
+        replies = self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                identity='5551234')
+        self.assertTrue(replies[0].startswith('Thanks anonymous.'))
+        self.create_provider(name='Jordan', phone='5551234')
+        reporters.invalidate()
+        replies = self._send('nutrition report asdf w 10 h 50 m 10 o Y',
+                identity='5551234')
+        self.assertTrue(replies[0].startswith('Thanks Jordan.'), replies[0])
 
     def test_unregistered_patient(self):
         """Report patient must be registered."""
@@ -633,3 +798,14 @@ class CreateReportHandlerTest(NutritionTestBase):
         self.assertEquals(report.muac, 10)
         self.assertTrue(report.oedema)
         self.assertEquals(report.status, Report.ERROR)
+
+    @override_settings(NUTRITION_REPORTER_LOOKUP=REPORTER_LOOKUP)
+    def test_budget(self):
+        """Reporting should use a fixed number of queries and lookups."""
+        self.create_provider(phone='5551234')
+        conn = self.lookup_connections(['5551234'])[0]
+        msg = IncomingMessage(conn, 'nutrition report asdf w 10 h 50 m 10')
+        reporters.get(conn)  # Reporter lookups are cached.
+        with self.assertBudget(queries=3, patients=1, providers=0):
+            self.Handler.dispatch(self.router, msg)
+        self.assertTrue(msg.responses[0].text.startswith('Thanks'))
@@ -0,0 +1,83 @@
+from __future__ import unicode_literals
+import mock
+import time
+
+from django.test.utils import override_settings
+
+from healthcare.api import client
+
+from .. import lookups
+from ..models import Report
+from .backends import SlowStorage
+from .base import NutritionTestBase
+
+
+__all__ = ['ConcurrentLookupTest']
+
+
+class ConcurrentLookupTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ConcurrentLookupTest, self).setUp()
+        self.backend = SlowStorage(latency=0.05)
+        patchers = [mock.patch.object(client.patients, 'backend',
+                self.backend), mock.patch.object(client.providers, 'backend',
+                self.backend)]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_get_patients(self):
+        """Records should be returned by id; missing ids are omitted."""
+        patient_ids = [self.create_patient()[2]['id'] for i in range(3)]
+        ids = [unicode(patient_id) for patient_id in patient_ids]
+        patients = lookups.get_patients(ids + ['12345'])
+        self.assertEquals(sorted(patients.keys()), sorted(ids))
+        for patient_id in ids:
+            self.assertEquals(unicode(patients[patient_id]['id']), patient_id)
+
+    def test_get_providers(self):
+        provider = self.create_provider()
+        providers = lookups.get_providers([provider['id']])
+        self.assertEquals(providers, {provider['id']: provider})
+
+    def test_bounded_concurrency(self):
+        """Lookups should overlap, up to the concurrency limit."""
+        ids = [self.create_patient()[2]['id'] for i in range(10)]
+        start = time.time()
+        lookups.get_patients(ids, concurrency=4)
+        elapsed = time.time() - start
+        self.assertEquals(self.backend.peak, 4)
+        self.assertTrue(elapsed < 10 * self.backend.latency, elapsed)
+
+    @override_settings(NUTRITION_HEALTHCARE_CONCURRENCY=1)
+    def test_serial(self):
+        """Lookups should run one at a time if concurrency is 1."""
+        ids = [self.create_patient()[2]['id'] for i in range(3)]
+        self.assertEquals(len(lookups.get_patients(ids)), 3)
+        self.assertEquals(self.backend.peak, 1)
+
+    def test_failed_lookup(self):
+        """A failed lookup should not prevent the others."""
+        patient = self.create_patient()[2]
+        get_patient = self.backend.get_patient
+
+        def flaky(id, source=None):
+            if id == 'bad':
+                raise Exception('Lookup failed.')
+            return get_patient(id, source)
+
+        with mock.patch.object(self.backend, 'get_patient', flaky):
+            patients = lookups.get_patients([patient['id'], 'bad'])
+        self.assertEquals(patients.keys(), [patient['id']])
+
+    def test_prefetch_patients(self):
+        """Reports should be prefetched without a batch backend API."""
+        for i in range(5):
+            self.create_report(analyze=False)
+        reports = list(Report.objects.all())
+        Report.prefetch_patients(reports)
+        self.assertTrue(self.backend.peak > 1)
+        for report in reports:
+            self.assertEquals(report._patient['id'],
+                    int(report.global_patient_id))
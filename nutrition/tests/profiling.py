@@ -0,0 +1,116 @@
+from __future__ import unicode_literals
+import os
+import shutil
+from StringIO import StringIO
+import tempfile
+
+from django.core.management import call_command
+from django.test.utils import override_settings
+
+from ..handlers import CancelReportHandler, CreateReportHandler
+from .. import profiling
+from .base import NutritionTestBase
+
+
+__all__ = ['HandlerProfilingTest']
+
+
+class HandlerProfilingTest(NutritionTestBase):
+
+    def setUp(self):
+        super(HandlerProfilingTest, self).setUp()
+        self.directory = tempfile.mkdtemp()
+        self.patient_id, _, self.patient = self.create_patient('asdf')
+        self._old_rate = os.environ.pop('NUTRITION_PROFILE_RATE', None)
+        # KeywordHandler.test caches a mock backend on the handler class,
+        # which does not survive the rollback at the end of each test.
+        for handler in (CancelReportHandler, CreateReportHandler):
+            if hasattr(handler, '_mock_backend'):
+                del handler._mock_backend
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+        if self._old_rate is not None:
+            os.environ['NUTRITION_PROFILE_RATE'] = self._old_rate
+        super(HandlerProfilingTest, self).tearDown()
+
+    def _settings(self, **kwargs):
+        defaults = {
+            'NUTRITION_PROFILE_DIR': self.directory,
+            'NUTRITION_PROFILE_RATE': 1,
+        }
+        defaults.update(kwargs)
+        return override_settings(**defaults)
+
+    def test_disabled(self):
+        """No profiles should be saved by default."""
+        with self._settings(NUTRITION_PROFILE_RATE=0):
+            CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        self.assertEquals(os.listdir(self.directory), [])
+
+    def test_profile_tags(self):
+        """Profiles should be tagged with the keyword and outcome."""
+        with self._settings():
+            CreateReportHandler.test('nutrition report asdf w 10 h 50')
+            CancelReportHandler.test('nutrition cancel fakeid')
+        names = sorted(os.listdir(self.directory))
+        self.assertEquals(len(names), 2)
+        self.assertTrue(names[0].endswith('-report-success.prof'), names)
+        self.assertTrue(names[1].endswith('-cancel-form_error.prof'), names)
+        self.assertEquals(len(profiling.list_profiles(self.directory,
+                keyword='cancel')), 1)
+        self.assertEquals(len(profiling.list_profiles(self.directory,
+                outcome='success')), 1)
+
+    def test_environment_variable(self):
+        """The environment variable should take precedence over settings."""
+        os.environ['NUTRITION_PROFILE_RATE'] = '1'
+        try:
+            with self._settings(NUTRITION_PROFILE_RATE=0):
+                CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        finally:
+            del os.environ['NUTRITION_PROFILE_RATE']
+        self.assertEquals(len(os.listdir(self.directory)), 1)
+
+    def test_rotation(self):
+        """Only the most recent profiles should be kept."""
+        with self._settings(NUTRITION_PROFILE_KEEP=2):
+            for i in range(3):
+                CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        self.assertEquals(len(os.listdir(self.directory)), 2)
+
+    def test_summary_command(self):
+        """The command should merge and summarize saved profiles."""
+        with self._settings():
+            for i in range(2):
+                CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        stdout = StringIO()
+        call_command('summarize_nutrition_profiles', directory=self.directory,
+                limit=5, stdout=stdout)
+        output = stdout.getvalue()
+        self.assertTrue(output.startswith('Merged 2 profile(s).\n'), output)
+        self.assertTrue('_process' in output, output)
+
+    def test_summary_command_no_profiles(self):
+        """The command should fail if there is nothing to summarize."""
+        self.assertCommandError('summarize_nutrition_profiles',
+                directory=self.directory)
+
+    def test_other_files(self):
+        """Files whose names are not those of saved profiles are ignored."""
+        other = os.path.join(self.directory, 'other.prof')
+        open(other, 'w').close()
+        with self._settings(NUTRITION_PROFILE_KEEP=1):
+            for i in range(2):
+                CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        self.assertEquals(len(profiling.list_profiles(self.directory)), 1)
+        self.assertEquals(profiling.list_profiles(self.directory,
+                keyword='report', outcome='success'),
+                profiling.list_profiles(self.directory))
+        self.assertTrue(os.path.exists(other))
+
+    def test_keep_none(self):
+        """With NUTRITION_PROFILE_KEEP=0, no profiles are kept."""
+        with self._settings(NUTRITION_PROFILE_KEEP=0):
+            CreateReportHandler.test('nutrition report asdf w 10 h 50')
+        self.assertEquals(os.listdir(self.directory), [])
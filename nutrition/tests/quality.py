@@ -0,0 +1,151 @@
+from __future__ import unicode_literals
+import json
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.utils.unittest import skipIf
+
+from ..models import Report
+from .base import NutritionTestBase, missing_module
+from .views import NutritionViewTest
+
+try:
+    import numpy
+    from .. import quality
+except ImportError:
+    numpy = None
+
+
+__all__ = ['DataQualityTest', 'DataQualityViewTest',
+        'DataQualityViewWithoutNumPyTest']
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class DataQualityTest(NutritionTestBase):
+
+    def _create(self, reporter_id='alice', location='North', **kwargs):
+        patient_id, _, patient = self.create_patient(location=location)
+        return self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], reporter_id=reporter_id,
+                analyze=False, **kwargs)
+
+    def test_digit_preference(self):
+        self.assertEquals(quality.digit_preference([5] * 10), 0)
+        self.assertAlmostEquals(quality.digit_preference([10] + [0] * 9),
+                100)
+        self.assertEquals(quality.digit_preference([0] * 10), None)
+
+    def test_terminal_digits(self):
+        for weight in ('10.0', '11.0', '12.5', '9.3'):
+            self._create(weight=Decimal(weight))
+        self._create()  # No measurements.
+        results = quality.check_quality(Report.objects.all())
+        self.assertEquals(len(results), 1)
+        self.assertEquals(results[0]['group'], {'reporter': 'alice'})
+        self.assertEquals(results[0]['reports'], 5)
+        weight = results[0]['weight']
+        self.assertEquals(weight['n'], 4)
+        self.assertEquals(weight['digits'], [2, 0, 0, 1, 0, 1, 0, 0, 0, 0])
+        self.assertAlmostEquals(weight['heaping'], 0.75)
+        self.assertEquals(results[0]['height']['n'], 0)
+        self.assertEquals(results[0]['height']['preference'], None)
+
+    def test_zscores(self):
+        for zscore in ('-1', '0', '1', '5.5'):
+            self._create(weight4height=Decimal(zscore))
+        stats = quality.check_quality(Report.objects.all())[0]
+        stats = stats['weight4height']
+        self.assertEquals(stats['n'], 4)
+        self.assertEquals(stats['flagged'], 1)
+        self.assertAlmostEquals(stats['flagged_share'], 0.25)
+        self.assertAlmostEquals(stats['sd'], 1)
+
+    def test_groups(self):
+        """Statistics are summed over chunks of reports."""
+        self._create(reporter_id='alice', location='North',
+                weight=Decimal('10.0'))
+        self._create(reporter_id='bob', location='North',
+                weight=Decimal('10.1'))
+        self._create(reporter_id='alice', location='South',
+                weight=Decimal('10.2'))
+        results = quality.check_quality(Report.objects.all(),
+                group_by=['reporter', 'location'], chunk_size=2)
+        groups = dict((tuple(sorted(result['group'].items())), result)
+                for result in results)
+        self.assertEquals(len(groups), 3)
+        south = groups[(('location', 'South'), ('reporter', 'alice'))]
+        self.assertEquals(south['weight']['digits'][2], 1)
+        results = quality.check_quality(Report.objects.all(), chunk_size=1)
+        alice = [result for result in results
+                if result['group'] == {'reporter': 'alice'}][0]
+        self.assertEquals(alice['reports'], 2)
+        self.assertEquals(alice['weight']['digits'][:3], [1, 0, 1])
+        self.assertRaises(ValueError, quality.check_quality,
+                Report.objects.all(), group_by=['bad'])
+
+    def test_problems(self):
+        """Reporters who round measurements are found."""
+        for i in range(quality.MINIMUM_VALUES):
+            self._create(reporter_id='alice',
+                    weight=Decimal('{0}.0'.format(10 + i % 5)))
+            self._create(reporter_id='bob',
+                    weight=Decimal('10.{0}'.format(i % 10)))
+        results = dict((result['group']['reporter'], result) for result in
+                quality.check_quality(Report.objects.all()))
+        self.assertEquals(len(results['alice']['problems']), 1)
+        self.assertTrue('weight' in results['alice']['problems'][0])
+        self.assertEquals(results['bob']['problems'], [])
+
+    def test_command(self):
+        self._create(weight=Decimal('10.0'), weight4height=Decimal('-1'))
+        stdout = StringIO()
+        call_command('nutrition_data_quality', 'status=U', json=True,
+                stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        self.assertEquals(results[0]['weight']['n'], 1)
+        stdout = StringIO()
+        call_command('nutrition_data_quality', stdout=stdout)
+        self.assertTrue('alice; 1 report(s)' in stdout.getvalue())
+        stdout = StringIO()
+        call_command('nutrition_data_quality', problems=True, stdout=stdout)
+        self.assertEquals(stdout.getvalue(), '')
+        self.assertCommandError('nutrition_data_quality', group_by='bad')
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class DataQualityViewTest(NutritionViewTest):
+    url_name = 'nutrition_data_quality'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_no_permission(self):
+        self.user.user_permissions.all().delete()
+        self.assertEquals(self._get().status_code, 302)
+
+    def test_quality(self):
+        self.create_report(analyze=False, reporter_id='alice',
+                muac=Decimal('11.5'))
+        response = self._get(get_kwargs={'group_by': 'reporter,location'})
+        self.assertEquals(response.status_code, 200)
+        groups = json.loads(response.content)['groups']
+        self.assertEquals(len(groups), 1)
+        self.assertEquals(groups[0]['group']['reporter'], 'alice')
+        self.assertEquals(groups[0]['muac']['digits'][5], 1)
+        response = self._get(get_kwargs={'problems': '1'})
+        self.assertEquals(json.loads(response.content)['groups'], [])
+
+    def test_errors(self):
+        for params in ({'group_by': 'bad'}, {'start_date': 'bad'}):
+            self.assertEquals(self._get(get_kwargs=params).status_code, 400)
+
+
+class DataQualityViewWithoutNumPyTest(NutritionViewTest):
+    url_name = 'nutrition_data_quality'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_numpy_missing(self):
+        with missing_module('nutrition.quality'):
+            response = self._get()
+        self.assertEquals(response.status_code, 501)
+        self.assertEquals(response.content,
+                b'NumPy is required for data quality checks.')
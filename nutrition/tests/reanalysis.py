@@ -0,0 +1,73 @@
+from __future__ import unicode_literals
+import datetime
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from healthcare.api import client
+
+from .. import reanalysis
+from ..models import Report
+from .base import NutritionTestBase
+
+
+__all__ = ['ReanalysisTest']
+
+
+class ReanalysisTest(NutritionTestBase):
+
+    def _create_report(self, **patient_kwargs):
+        patient_id, source, patient = self.create_patient(**patient_kwargs)
+        return self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], weight=Decimal('12'),
+                height=Decimal('90'))
+
+    def _reanalyze_all(self):
+        return sum([reanalysis.reanalyze_patients(patients)
+                for patients in reanalysis.iter_patients()])
+
+    def test_fingerprint(self):
+        report = self._create_report()
+        self.assertEquals(report.demographics,
+                Report.get_demographics(report.patient))
+        self.assertNotEquals(report.demographics,
+                Report.get_demographics(dict(report.patient, sex='F')))
+
+    def test_unchanged(self):
+        """Reports of unchanged patients are not analyzed again."""
+        self._create_report()
+        self.assertEquals(self._reanalyze_all(), 0)
+
+    def test_sex_corrected(self):
+        """Incomplete reports are analyzed once the patient's sex is set."""
+        report = self._create_report(sex=None)
+        self.assertEquals(report.status, Report.INCOMPLETE)
+        other = self._create_report()
+        updated = other.updated
+        client.patients.update(int(report.global_patient_id), sex='F')
+        self.assertEquals(self._reanalyze_all(), 1)
+        report = Report.objects.get(pk=report.pk)
+        self.assertEquals(report.status, Report.ANALYZED)
+        self.assertEquals(Report.objects.get(pk=other.pk).updated, updated)
+
+    def test_patient_updated(self):
+        """The hook re-analyzes one patient's reports."""
+        report = self._create_report()
+        birth_date = datetime.date.today() - datetime.timedelta(days=400)
+        client.patients.update(int(report.global_patient_id),
+                birth_date=birth_date)
+        self.assertEquals(reanalysis.patient_updated(
+                report.global_patient_id), 1)
+        reanalyzed = Report.objects.get(pk=report.pk)
+        self.assertNotEquals(reanalyzed.weight4age, report.weight4age)
+        self.assertEquals(reanalysis.patient_updated(
+                report.global_patient_id), 0)
+
+    def test_command(self):
+        report = self._create_report(sex=None)
+        client.patients.update(int(report.global_patient_id), sex='M')
+        output = StringIO()
+        call_command('reanalyze_nutrition_reports', hours=1, stdout=output)
+        self.assertEquals(output.getvalue().strip(),
+                'Re-analyzed 1 report(s).')
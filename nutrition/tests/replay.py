@@ -0,0 +1,109 @@
+from __future__ import unicode_literals
+import os
+import tempfile
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from .. import replay
+from ..models import Report
+from .base import NutritionTestBase, NutritionTransactionTestBase
+
+
+__all__ = ['ReplayTest', 'ReplayTransactionTest']
+
+
+class ReplayTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ReplayTest, self).setUp()
+        self.patient_id = self.create_patient()[0]
+
+    def test_read_messages(self):
+        lines = [
+            b'# A comment\n',
+            b'nutrition report abc\n',
+            b'5551234\tnutrition cancel abc\r\n',
+            b'\n',
+            b'{"identity": "5555678", "text": "nutrition report \\u00e9"}\n',
+        ]
+        self.assertEquals(list(replay.read_messages(lines, identity='x')), [
+            ('x', 'nutrition report abc'),
+            ('5551234', 'nutrition cancel abc'),
+            ('5555678', 'nutrition report \xe9'),
+        ])
+
+    def test_replay(self):
+        """Messages are handled in order and their outcomes counted."""
+        messages = [
+            ('5551234', 'nutrition report {0} wt 12'.format(self.patient_id)),
+            ('5551234', 'nutrition report unknown wt 12'),
+            ('5551234', 'hello'),
+            ('5551234', 'nutrition cancel {0}'.format(self.patient_id)),
+        ]
+        replies = []
+        summary = replay.replay(messages,
+                callback=lambda *args: replies.append(args))
+        self.assertEquals(summary.count, 4)
+        self.assertEquals(dict(summary.outcomes), {'success': 2,
+                'form_error': 1, 'ignored': 1})
+        self.assertEquals([r[2] for r in replies], ['success', 'form_error',
+                'ignored', 'success'])
+        self.assertTrue(replies[0][3][0].startswith('Thanks anonymous.'))
+        self.assertEquals(replies[2][3], [])
+        report = Report.objects.get()
+        self.assertFalse(report.active)
+        self.assertEquals(report.raw_text, messages[0][1])
+
+    def test_summary(self):
+        summary = replay.ReplaySummary()
+        for i in range(1, 21):
+            summary.add('success', i / 1000.0)
+        summary.finish()
+        self.assertEquals(summary.percentile(50), 0.011)
+        self.assertEquals(summary.percentile(95), 0.020)
+        lines = summary.lines()
+        self.assertTrue(lines[0].startswith('Replayed 20 message(s)'))
+        self.assertTrue('median 11.0' in lines[1], lines[1])
+        self.assertEquals(lines[2], 'success: 20')
+
+    def test_command(self):
+        fd, path = tempfile.mkstemp()
+        self.addCleanup(os.remove, path)
+        with os.fdopen(fd, 'wb') as log:
+            log.write('nutrition report {0} wt 12\n'.format(self.patient_id))
+            log.write('5551234\tnutrition report {0} h 80\n'.format(
+                    self.patient_id))
+        stdout = StringIO()
+        call_command('replay_nutrition_messages', path, stdout=stdout)
+        self.assertTrue('success: 2' in stdout.getvalue())
+        self.assertEquals(Report.objects.count(), 2)
+
+
+class ReplayTransactionTest(NutritionTransactionTestBase):
+
+    def setUp(self):
+        super(ReplayTransactionTest, self).setUp()
+        self.patient_id = self.create_patient()[0]
+
+    def test_dry_run(self):
+        """A dry run handles messages without keeping their reports."""
+        messages = [('replay', 'nutrition report {0} wt 12'.format(
+                self.patient_id))]
+        summary = replay.replay(messages, dry_run=True)
+        self.assertEquals(dict(summary.outcomes), {'success': 1})
+        self.assertEquals(Report.objects.count(), 0)
+
+    def test_workers(self):
+        """Each identity's messages are handled in order by one worker."""
+        messages = []
+        for i in range(6):
+            identity = '55500{0}'.format(i)
+            messages.append((identity, 'nutrition report {0} wt 12'.format(
+                    self.patient_id)))
+            messages.append((identity, 'nutrition cancel {0}'.format(
+                    self.patient_id)))
+        summary = replay.replay(messages, workers=3)
+        self.assertEquals(dict(summary.outcomes), {'success': 12})
+        self.assertEquals(Report.objects.count(), 6)
+        self.assertFalse(Report.objects.filter(active=True).exists())
@@ -0,0 +1,121 @@
+from __future__ import unicode_literals
+from StringIO import StringIO
+
+from django.core.management import call_command
+
+from .. import search
+from ..forms import ReportFilterForm
+from ..models import Report, ReportTrigram
+from .base import NutritionTestBase
+
+
+__all__ = ['ReportSearchTest', 'ReportFilterFormMatchTest']
+
+
+class ReportSearchTest(NutritionTestBase):
+
+    def setUp(self):
+        super(ReportSearchTest, self).setUp()
+        self.abc = self.create_report(analyze=False, patient_id='ABC123',
+                reporter_id='rep-1')
+        self.xab = self.create_report(analyze=False, patient_id='XABC9',
+                reporter_id='rep-2')
+        self.other = self.create_report(analyze=False, patient_id='ZZZ999',
+                reporter_id='other')
+
+    def _search(self, term, mode, field='patient_id'):
+        reports = search.filter_reports(Report.objects.all(), field, term,
+                mode)
+        return set(reports)
+
+    def test_trigrams(self):
+        self.assertEquals(search.get_trigrams('AbC1'),
+                set(['^ab', 'abc', 'bc1']))
+        self.assertEquals(search.get_trigrams(None), set())
+        self.assertEquals(search.get_query_trigrams('abc', search.PREFIX),
+                set(['^ab', 'abc']))
+        self.assertEquals(search.get_query_trigrams('ab', search.CONTAINS),
+                set())
+
+    def test_exact(self):
+        self.assertEquals(self._search('ABC123', search.EXACT),
+                set([self.abc]))
+        self.assertEquals(self._search('ABC', search.EXACT), set())
+
+    def test_prefix(self):
+        self.assertEquals(self._search('abc1', search.PREFIX),
+                set([self.abc]))
+        self.assertEquals(self._search('rep', search.PREFIX, 'reporter_id'),
+                set([self.abc, self.xab]))
+
+    def test_contains(self):
+        self.assertEquals(self._search('bc', search.CONTAINS),
+                set([self.abc, self.xab]))
+        self.assertEquals(self._search('ABC', search.CONTAINS),
+                set([self.abc, self.xab]))
+        self.assertEquals(self._search('c9', search.CONTAINS),
+                set([self.xab]))
+
+    def test_trigrams_are_candidates_only(self):
+        """Matches must contain the term, not just each of its trigrams."""
+        report = self.create_report(analyze=False, patient_id='ABCDxBCDE')
+        self.assertEquals(self._search('ABCDE', search.CONTAINS), set())
+        self.assertEquals(self._search('BCDE', search.CONTAINS),
+                set([report]))
+
+    def test_reindexed_on_change(self):
+        self.abc.patient_id = 'QQQ777'
+        self.abc.save()
+        self.assertEquals(self._search('ABC', search.PREFIX), set())
+        self.assertEquals(self._search('QQ7', search.CONTAINS),
+                set([self.abc]))
+
+    def test_unchanged_not_reindexed(self):
+        report = Report.objects.get(pk=self.abc.pk)
+        report.weight = 12
+        # Django checks that the row exists, then updates it.
+        with self.assertBudget(queries=2):
+            report.save()
+
+    def test_deleted(self):
+        self.abc.delete()
+        self.assertFalse(ReportTrigram.objects.filter(report=self.abc.pk))
+
+    def test_rebuild(self):
+        """The management command should rebuild every report's trigrams."""
+        ReportTrigram.objects.all().delete()
+        output = StringIO()
+        call_command('index_nutrition_report_ids', batch_size=2,
+                stdout=output)
+        self.assertEquals(output.getvalue().strip(), 'Indexed 3 report(s).')
+        self.assertEquals(self._search('abc', search.CONTAINS),
+                set([self.abc, self.xab]))
+
+
+class ReportFilterFormMatchTest(NutritionTestBase):
+
+    def test_default_match(self):
+        form = ReportFilterForm({'patient_id': 'ABC'})
+        self.assertTrue(form.is_valid())
+        self.assertEquals(form.cleaned_data['match'], search.EXACT)
+
+    def test_filters(self):
+        """The match mode is only a filter when an ID is given."""
+        form = ReportFilterForm({'match': search.PREFIX})
+        self.assertTrue(form.is_valid())
+        self.assertEquals(form.get_filters(), [])
+        form = ReportFilterForm({'patient_id': 'AB', 'match': search.PREFIX})
+        self.assertTrue(form.is_valid())
+        self.assertEquals(form.get_filters(),
+                [('match', search.PREFIX), ('patient_id', 'AB')])
+
+    def test_items(self):
+        report = self.create_report(analyze=False, patient_id='ABC123')
+        self.create_report(analyze=False, patient_id='XYZ123')
+        form = ReportFilterForm({'patient_id': 'abc', 'match': search.PREFIX})
+        self.assertEquals(list(form.get_items()), [report])
+
+    def test_bad_match(self):
+        form = ReportFilterForm({'patient_id': 'ABC', 'match': 'bad'})
+        self.assertFalse(form.is_valid())
+        self.assertTrue('match' in form.errors)
@@ -0,0 +1,117 @@
+from __future__ import unicode_literals
+import mock
+import threading
+
+from django.test.utils import override_settings
+
+from healthcare.api import client
+
+from ..handlers import CancelReportHandler, CreateReportHandler
+from ..suggestions import PatientIdIndex, one_edit_apart, patient_ids
+from .base import NutritionTestBase, NutritionTransactionTestBase
+
+
+__all__ = ['PatientIdIndexTest', 'PatientIdBackgroundTest',
+        'PatientIdSuggestionTest']
+
+
+class PatientIdIndexTest(NutritionTestBase):
+
+    def test_one_edit_apart(self):
+        for typo in ('1235', '124', '01234', '1243', '1x34', '2134'):
+            self.assertTrue(one_edit_apart('1234', typo), typo)
+        for other in ('1234', '4321', '1', '123456', '2143', '1xy4'):
+            self.assertFalse(one_edit_apart('1234', other), other)
+
+    def test_suggest(self):
+        index = PatientIdIndex()
+        for patient_id in ('ABC123', 'XYZ789', 'XYZ780'):
+            index.add(patient_id)
+        index.refresh(force=True)
+        self.assertEquals(index.suggest('ABC124'), 'ABC123')
+        self.assertEquals(index.suggest('AB123'), 'ABC123')
+        self.assertEquals(index.suggest('BAC123'), 'ABC123')
+        self.assertEquals(index.suggest('ABC123'), None)  # Not a typo.
+        self.assertEquals(index.suggest('XYZ781'), None)  # Ambiguous.
+        self.assertEquals(index.suggest('QQQ000'), None)
+        index.discard('ABC123')
+        self.assertEquals(index.suggest('ABC124'), None)
+
+    def test_refresh(self):
+        """IDs are read from reports, incrementally."""
+        index = PatientIdIndex()
+        index.background = False
+        self.create_report(patient_id='ABC123', analyze=False)
+        with self.assertBudget(queries=1):
+            self.assertEquals(index.suggest('ABC124'), 'ABC123')
+        self.create_report(patient_id='DEF456', analyze=False)
+        with self.assertBudget(queries=0):
+            self.assertEquals(index.suggest('DEF457'), None)
+        with override_settings(NUTRITION_PATIENT_ID_INDEX_REFRESH=0):
+            with self.assertBudget(queries=1):
+                self.assertEquals(index.suggest('DEF457'), 'DEF456')
+
+
+class PatientIdBackgroundTest(NutritionTransactionTestBase):
+
+    def test_background(self):
+        """The index is built in the background, without waiting for it."""
+        self.create_report(patient_id='ABC123', analyze=False)
+        index = PatientIdIndex()
+        gate = threading.Event()
+        refresh = index.refresh
+
+        def wait():
+            gate.wait()
+            refresh()
+
+        with mock.patch.object(index, 'refresh', wait):
+            self.assertEquals(index.suggest('ABC124'), None)
+            self.assertFalse(index.ready)
+            thread = index._thread
+            self.assertEquals(index.refresh_in_background(), None)
+            gate.set()
+            thread.join()
+        self.assertTrue(index.ready)
+        self.assertEquals(index.suggest('ABC124'), 'ABC123')
+        self.assertEquals(index.refresh_in_background(), None)  # Not due.
+
+
+@override_settings(NUTRITION_SUGGEST_PATIENT_IDS=True)
+class PatientIdSuggestionTest(NutritionTestBase):
+
+    def setUp(self):
+        super(PatientIdSuggestionTest, self).setUp()
+        patcher = mock.patch.object(patient_ids, 'background', False)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patient_id, source, self.patient = self.create_patient('ABC123')
+        self.create_report(patient_id=patient_id,
+                global_patient_id=self.patient['id'], analyze=False)
+
+    def test_report(self):
+        replies = CreateReportHandler.test('nutrition report ABC124 wt 12')
+        self.assertEquals(len(replies), 1)
+        self.assertTrue(replies[0].endswith('Did you mean ABC123?'),
+                replies[0])
+
+    def test_cancel(self):
+        replies = CancelReportHandler.test('nutrition cancel ABD123')
+        self.assertTrue(replies[0].endswith('Did you mean ABC123?'),
+                replies[0])
+
+    @override_settings(NUTRITION_SUGGEST_PATIENT_IDS=False)
+    def test_disabled(self):
+        replies = CreateReportHandler.test('nutrition report ABC124 wt 12')
+        self.assertFalse('Did you mean' in replies[0], replies[0])
+
+    def test_inactive(self):
+        client.patients.update(self.patient['id'], status='I')
+        replies = CreateReportHandler.test('nutrition report ABC124 wt 12')
+        self.assertFalse('Did you mean' in replies[0], replies[0])
+        self.assertEquals(patient_ids.suggest('ABC124'), None)  # Discarded.
+
+    def test_no_suggestion(self):
+        replies = CreateReportHandler.test('nutrition report ZZZ999 wt 12')
+        self.assertFalse('Did you mean' in replies[0], replies[0])
+        self.assertTrue(patient_ids.suggest('ABC124'))
@@ -0,0 +1,152 @@
+from __future__ import unicode_literals
+import datetime
+import json
+from decimal import Decimal
+from StringIO import StringIO
+
+from django.core.management import call_command
+from django.utils.unittest import skipIf
+
+from ..models import Report
+from .base import NutritionTestBase, missing_module
+from .views import NutritionViewTest
+
+try:
+    import numpy
+    from .. import surveys
+except ImportError:
+    numpy = None
+
+
+__all__ = ['SurveyTest', 'SurveyViewTest', 'SurveyViewWithoutNumPyTest']
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class SurveyTest(NutritionTestBase):
+
+    def _create(self, location='North', **kwargs):
+        patient_id, _, patient = self.create_patient(location=location)
+        return self.create_report(patient_id=patient_id,
+                global_patient_id=patient['id'], analyze=False, **kwargs)
+
+    def test_prevalence(self):
+        for zscore in ('-3.5', '-2.5', '0', '1'):
+            self._create(weight4height=Decimal(zscore))
+        self._create(oedema=True)  # Severe wasting without a z-score.
+        results = surveys.survey(Report.objects.all())
+        self.assertEquals(len(results), 1)
+        self.assertEquals(results[0]['group'], {})
+        self.assertEquals(results[0]['reports'], 5)
+        wasting = results[0]['wasting']
+        self.assertEquals(wasting['n'], 5)
+        self.assertEquals(wasting['global']['count'], 3)
+        self.assertAlmostEquals(wasting['global']['prevalence'], 0.6)
+        self.assertEquals(wasting['severe']['count'], 2)
+        self.assertAlmostEquals(wasting['mean'], -1.25)
+        self.assertAlmostEquals(wasting['sd'], numpy.std([-3.5, -2.5, 0, 1],
+                ddof=1))
+        self.assertTrue(wasting['global']['lower'] < 0.6 <
+                wasting['global']['upper'])
+        self.assertEquals(results[0]['stunting']['n'], 0)
+        self.assertEquals(results[0]['stunting']['mean'], None)
+
+    def test_confidence_interval(self):
+        p, lower, upper = surveys._proportion(50, 100, 1.0, 1.96)
+        self.assertAlmostEquals(lower, 0.4038, places=4)
+        self.assertAlmostEquals(upper, 0.5962, places=4)
+        wider = surveys._proportion(50, 100, 2.0, 1.96)
+        self.assertTrue(wider[1] < lower and wider[2] > upper)
+        self.assertRaises(ValueError, surveys.summarize,
+                surveys.load_sample(Report.objects.all()), design_effect=0)
+
+    def test_who_flags(self):
+        """Implausible z-scores are excluded."""
+        self._create(weight4height=Decimal('-1'))
+        self._create(weight4height=Decimal('5.5'))
+        wasting = surveys.survey(Report.objects.all())[0]['wasting']
+        self.assertEquals(wasting['n'], 1)
+        self.assertEquals(wasting['flagged'], 1)
+        self.assertEquals(wasting['mean'], -1)
+
+    def test_smart_flags(self):
+        """SMART flags z-scores far from the observed mean."""
+        for zscore in ('0', '0', '0', '0', '4.5'):
+            self._create(height4age=Decimal(zscore))
+        stunting = surveys.survey(Report.objects.all(),
+                flags=surveys.SMART)[0]['stunting']
+        self.assertEquals(stunting['flagged'], 1)
+        stunting = surveys.survey(Report.objects.all())[0]['stunting']
+        self.assertEquals(stunting['flagged'], 0)
+
+    def test_cancelled(self):
+        self._create(weight4age=Decimal('-4')).cancel()
+        self.assertEquals(surveys.survey(Report.objects.all())[0]['reports'],
+                0)
+
+    def test_group_by(self):
+        self._create(location='North', weight4age=Decimal('-2.5'))
+        self._create(location='North', weight4age=Decimal('0'))
+        report = self._create(location='South', weight4age=Decimal('1'))
+        month = datetime.date(2013, 1, 15)
+        Report.objects.filter(pk=report.pk).update(created=month)
+        results = surveys.survey(Report.objects.all(),
+                group_by=['location', 'month'])
+        this_month = report.created.strftime('%Y-%m')
+        self.assertEquals([(r['group'], r['reports']) for r in results], [
+            ({'location': 'North', 'month': this_month}, 2),
+            ({'location': 'South', 'month': '2013-01'}, 1),
+        ])
+        self.assertEquals(results[0]['underweight']['global']['count'], 1)
+        self.assertEquals(results[1]['underweight']['global']['count'], 0)
+        self.assertRaises(ValueError, surveys.survey, Report.objects.all(),
+                group_by=['bad'])
+
+    def test_command(self):
+        self._create(weight4height=Decimal('-2.5'))
+        self._create(status=Report.ANALYZED, weight4height=Decimal('0'))
+        stdout = StringIO()
+        call_command('nutrition_survey', 'status=A', group_by='location',
+                stdout=stdout)
+        lines = stdout.getvalue().splitlines()
+        self.assertEquals(lines[0], 'location: North; 1 report(s)')
+        self.assertTrue(lines[1].startswith('  wasting: n=1, flagged=0, '
+                'global 0.0%'), lines[1])
+        stdout = StringIO()
+        call_command('nutrition_survey', json=True, stdout=stdout)
+        results = json.loads(stdout.getvalue())
+        self.assertEquals(results[0]['wasting']['global']['count'], 1)
+
+
+@skipIf(numpy is None, 'NumPy is not installed.')
+class SurveyViewTest(NutritionViewTest):
+    url_name = 'nutrition_survey'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_no_permission(self):
+        self.user.user_permissions.all().delete()
+        self.assertEquals(self._get().status_code, 302)
+
+    def test_survey(self):
+        self.create_report(analyze=False, weight4height=Decimal('-3.5'))
+        response = self._get(get_kwargs={'group_by': 'month'})
+        self.assertEquals(response.status_code, 200)
+        groups = json.loads(response.content)['groups']
+        self.assertEquals(len(groups), 1)
+        self.assertEquals(groups[0]['wasting']['severe']['count'], 1)
+
+    def test_errors(self):
+        for params in ({'flags': 'bad'}, {'group_by': 'bad'},
+                {'design_effect': 'bad'}, {'start_date': 'bad'}):
+            self.assertEquals(self._get(get_kwargs=params).status_code, 400)
+
+
+class SurveyViewWithoutNumPyTest(NutritionViewTest):
+    url_name = 'nutrition_survey'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_numpy_missing(self):
+        with missing_module('nutrition.surveys'):
+            response = self._get()
+        self.assertEquals(response.status_code, 501)
+        self.assertEquals(response.content,
+                b'NumPy is required for survey statistics.')
@@ -1,20 +1,29 @@
 from __future__ import unicode_literals
+import json
 from urllib import urlencode
 from cStringIO import StringIO
+import datetime
+import mock
+import zlib
 
 from nutrition.unicsv import UnicodeCSVReader
 
 from django.contrib.auth.models import Permission
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
+from django.test.utils import override_settings
 
 from healthcare.api import client
 
+from ..archive import archive_reports
+from ..counts import report_counts
 from ..views import CSVNutritionReportList, NutritionReportList
-from ..models import Report
+from ..models import Report, ReportEvent
 from .base import NutritionTestBase
 
 
-__all__ = ['NutritionReportListViewTest', 'CSVNutritionReportListViewTest']
+__all__ = ['NutritionReportListViewTest', 'CSVNutritionReportListViewTest',
+        'JSONNutritionReportListViewTest', 'NutritionEventListViewTest']
 
 
 class NutritionViewTest(NutritionTestBase):
@@ -50,6 +59,12 @@ class NutritionViewTest(NutritionTestBase):
             url = '{0}?{1}'.format(url, urlencode(get_kwargs))
         return url
 
+    def _content(self, response):
+        """Returns the content of a streaming or regular response."""
+        if getattr(response, 'streaming', False):
+            return b''.join(response.streaming_content)
+        return response.content
+
     def _get(self, url_name=None, url_args=None, url_kwargs=None,
             get_kwargs=None, url=None, *args, **kwargs):
         """Convenience wrapper for self.client.get.
@@ -105,6 +120,83 @@ class NutritionReportListViewTest(NutritionViewTest):
         page = response.context['table'].page
         self.assertEquals(page.object_list.data.count(), 1)
 
+    def test_budget(self):
+        """Query and lookup counts should not grow with the number of rows."""
+        for num_reports in (3, 25):
+            for i in range(num_reports):
+                self.create_report()
+            with self.assertBudget(queries=8, patients=1, providers=0):
+                response = self._get()
+            self.assertEquals(response.status_code, 200)
+
+    @override_settings(NUTRITION_COUNT_ESTIMATE_THRESHOLD=1000)
+    def test_estimated_count(self):
+        """Estimated counts of unfiltered reports should be shown as such."""
+        report = self.create_report()
+        with mock.patch.object(report_counts, 'estimate', return_value=5000):
+            response = self._get()
+            self.assertContains(response, 'of about 5000.')
+            params = {'patient_id': report.patient_id}
+            response = self._get(get_kwargs=params)
+            self.assertContains(response, 'of 1.')
+
+    def test_conditional_get(self):
+        """Unchanged pages should not be rendered again."""
+        report = self.create_report()
+        response = self._get()
+        self.assertEquals(response.status_code, 200)
+        etag = response['ETag']
+        with self.assertBudget(queries=5, patients=0, providers=0):
+            response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 304)
+        self.assertEquals(response['ETag'], etag)
+
+        report.cancel()
+        response = self._get(HTTP_IF_NONE_MATCH=etag)
+        self.assertEquals(response.status_code, 200)
+        self.assertNotEquals(response['ETag'], etag)
+
+    def test_if_modified_since(self):
+        self.create_report()
+        response = self._get()
+        last_modified = response['Last-Modified']
+        response = self._get(HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEquals(response.status_code, 304)
+
+    def test_etag_parameters(self):
+        """ETags should depend on the normalized parameters."""
+        self.create_report()
+        etag = self._get()['ETag']
+        empty = {'patient_id': '', 'reporter_id': '', 'status': ''}
+        self.assertEquals(self._get(get_kwargs=empty)['ETag'], etag)
+        other = {'status': Report.ANALYZED}
+        self.assertNotEquals(self._get(get_kwargs=other)['ETag'], etag)
+        self.assertNotEquals(self._get(get_kwargs={'page': 2})['ETag'], etag)
+
+    def test_no_reports_etag(self):
+        """Last-Modified should be omitted if there are no reports."""
+        response = self._get()
+        self.assertTrue(response.has_header('ETag'))
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    @override_settings(NUTRITION_REPORT_LIST_CACHE_TIMEOUT=60)
+    def test_cached_table(self):
+        """The rendered table should be cached until reports change."""
+        cache.clear()
+        report = self.create_report()
+        response = self._get()
+        self.assertTrue('table' in response.context)
+        with self.assertBudget(patients=0, providers=0):
+            response = self._get()
+        self.assertFalse('table' in response.context)
+        self.assertContains(response, report.patient_id)
+        self.assertContains(response, '<table')
+
+        other = self.create_report()
+        response = self._get()
+        self.assertTrue('table' in response.context)
+        self.assertContains(response, other.patient_id)
+
     def test_filter_reporter(self):
         """Reports should be filtered by reporter."""
         params = {'reporter_id': 'hello'}
@@ -156,6 +248,28 @@ class NutritionReportListViewTest(NutritionViewTest):
         self.assertEquals(queryset.count(), 1)
         self.assertEquals(queryset.get(), report)
 
+    def test_filter_active(self):
+        """Reports should be filtered by whether they are cancelled."""
+        report = self.create_report(analyze=False)
+        cancelled = self.create_report(analyze=False)
+        cancelled.cancel()
+        queryset, form = self._extract(self._get(
+                get_kwargs={'active': 'yes'}))
+        self.assertEquals(list(queryset), [report])
+        queryset, form = self._extract(self._get(
+                get_kwargs={'active': 'no'}))
+        self.assertEquals(list(queryset), [cancelled])
+
+    def test_filter_active_count(self):
+        """Cancelling a report changes the count of active reports."""
+        report = self.create_report(analyze=False)
+        self.assertContains(self._get(get_kwargs={'active': 'yes'}), 'of 1.')
+        Report.objects.cancel_latest(report.patient_id)
+        response = self._get(get_kwargs={'active': 'yes'})
+        self.assertNotContains(response, 'of 1.')
+        queryset, form = self._extract(response)
+        self.assertEquals(queryset.count(), 0)
+
     def test_filter_bad_status(self):
         """Form has error & no results returned if invalid status is given."""
         report = self.create_report()
@@ -165,13 +279,69 @@ class NutritionReportListViewTest(NutritionViewTest):
         self.assertEquals(queryset.count(), 0)
         self.assertTrue('status' in form.errors)
 
+    def _create_on(self, *args):
+        report = self.create_report()
+        created = datetime.datetime(*args)
+        Report.objects.filter(pk=report.pk).update(created=created)
+        return report
+
+    def test_filter_dates(self):
+        """Reports should be filtered by the day on which they were created."""
+        self._create_on(2013, 1, 31, 23, 59)
+        first = self._create_on(2013, 2, 1, 0, 0)
+        last = self._create_on(2013, 2, 28, 23, 59)
+        self._create_on(2013, 3, 1, 0, 0)
+        params = {'start_date': '2013-02-01', 'end_date': '2013-02-28'}
+        response = self._get(get_kwargs=params)
+        self.assertEquals(response.status_code, 200)
+        queryset, form = self._extract(response)
+        self.assertEquals(set(queryset), set([first, last]))
+
+    def test_filter_open_date_range(self):
+        """Either end of the date range may be left open."""
+        old = self._create_on(2012, 12, 31, 12, 0)
+        new = self._create_on(2013, 1, 1, 12, 0)
+        queryset, form = self._extract(self._get(
+                get_kwargs={'start_date': '2013-01-01'}))
+        self.assertEquals(list(queryset), [new])
+        queryset, form = self._extract(self._get(
+                get_kwargs={'end_date': '2012-12-31'}))
+        self.assertEquals(list(queryset), [old])
+
+    def test_filter_bad_date_range(self):
+        """Form has error & no results returned if the range is reversed."""
+        self.create_report()
+        params = {'start_date': '2013-02-01', 'end_date': '2013-01-01'}
+        response = self._get(get_kwargs=params)
+        self.assertEquals(response.status_code, 200)
+        queryset, form = self._extract(response)
+        self.assertEquals(queryset.count(), 0)
+        self.assertTrue(form.non_field_errors())
+
+    def test_archived(self):
+        """Only archived reports should be listed on request."""
+        report = self.create_report()
+        report.cancel()
+        archive_reports()
+        queryset, form = self._extract(self._get())
+        self.assertEquals(queryset.count(), 0)
+        response = self._get(get_kwargs={'archived': 'on'})
+        self.assertEquals(response.status_code, 200)
+        queryset, form = self._extract(response)
+        self.assertEquals([r.pk for r in queryset], [report.pk])
+        self.assertContains(response, report.patient_id)
+
 
 class CSVNutritionReportListViewTest(NutritionViewTest):
     url_name = 'csv_nutrition_reports'
     perm_names = [('nutrition', 'view_report')]
 
     def _extract(self, response):
-        reader = UnicodeCSVReader(StringIO(response.content))
+        content = self._content(response)
+        if (response.get('Content-Encoding') == 'gzip' or
+                response['Content-Type'] == 'application/x-gzip'):
+            content = zlib.decompress(content, 16 + zlib.MAX_WBITS)
+        reader = UnicodeCSVReader(StringIO(content))
         return [line for line in reader]
 
     def _check_report(self, response, *reports):
@@ -179,7 +349,7 @@ class CSVNutritionReportListViewTest(NutritionViewTest):
         csv = self._extract(response)
         self.assertEquals(len(csv), 1 + len(reports))  # include headers row
 
-        num_columns = 17
+        num_columns = 20
         headers, data = csv[0], csv[1:]
         self.assertEquals(len(headers), num_columns)
         for line in data:
@@ -206,6 +376,16 @@ class CSVNutritionReportListViewTest(NutritionViewTest):
         response = self._get()
         self._check_report(response, report)
 
+    def test_budget(self):
+        """Query and lookup counts should not grow with the number of rows."""
+        for num_reports in (3, 25):
+            for i in range(num_reports):
+                self.create_report()
+            with self.assertBudget(queries=5, patients=1, providers=0):
+                response = self._get()
+                self._content(response)
+            self.assertEquals(response.status_code, 200)
+
     def test_filter_reporter(self):
         """Reports export should be filtered by reporter."""
         params = {'reporter_id': 'hello'}
@@ -242,6 +422,37 @@ class CSVNutritionReportListViewTest(NutritionViewTest):
         response = self._get(get_kwargs=params)
         self._check_report(response, report)
 
+    def test_gzip_file(self):
+        """With compress=gzip, the export is downloaded as a gzip file."""
+        report = self.create_report()
+        response = self._get(get_kwargs={'compress': 'gzip', 'level': '9'})
+        self.assertEquals(response['Content-Type'], 'application/x-gzip')
+        self.assertEquals(response['Content-Disposition'],
+                'attachment; filename=nutrition_reports.csv.gz')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self._check_report(response, report)
+
+    def test_gzip_encoding(self):
+        """If enabled, Accept-Encoding chooses gzip Content-Encoding."""
+        report = self.create_report()
+        response = self._get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with self.settings(NUTRITION_EXPORT_GZIP=True):
+            response = self._get(HTTP_ACCEPT_ENCODING='gzip, deflate')
+            plain = self._get(HTTP_ACCEPT_ENCODING='identity')
+            refused = self._get(HTTP_ACCEPT_ENCODING='gzip;q=0, deflate')
+        self.assertEquals(response['Content-Encoding'], 'gzip')
+        self.assertEquals(response['Content-Type'], 'text/csv')
+        self.assertTrue('Accept-Encoding' in response['Vary'])
+        self.assertFalse(plain.has_header('Content-Encoding'))
+        self.assertFalse(refused.has_header('Content-Encoding'))
+        self._check_report(response, report)
+
+    def test_gzip_errors(self):
+        for params in ({'compress': 'zip'}, {'compress': 'gzip', 'level': 0},
+                {'compress': 'gzip', 'level': 'bad'}):
+            self.assertEquals(self._get(get_kwargs=params).status_code, 400)
+
     def test_filter_bad_status(self):
         """Invalid status causes redirect to regular list view."""
         report = self.create_report()
@@ -252,3 +463,93 @@ class CSVNutritionReportListViewTest(NutritionViewTest):
         form = response.context['form']
         self.assertEquals(queryset.count(), 0)
         self.assertTrue('status' in form.errors)
+
+
+class JSONNutritionReportListViewTest(NutritionViewTest):
+    url_name = 'json_nutrition_reports'
+    perm_names = [('nutrition', 'view_report')]
+
+    def _extract(self, response):
+        self.assertEquals(response['Content-Type'], 'application/json')
+        return json.loads(self._content(response))
+
+    def test_no_permission(self):
+        """Permission is required to get the reports as JSON."""
+        self.user.user_permissions.all().delete()
+        response = self._get()
+        self.assertEquals(response.status_code, 302)  # redirect to login
+
+    def test_filters(self):
+        """Reports are filtered with the form used by the reports list."""
+        report = self.create_report(weight='12.5', height=90)
+        self.create_report(analyze=False)
+        response = self._get(get_kwargs={'status': Report.ANALYZED,
+                'fields': 'patient_id, weight,sex'})
+        self.assertEquals(response.status_code, 200)
+        data = self._extract(response)
+        self.assertEquals(data, {'reports': [{'id': report.pk,
+                'patient_id': report.patient_id, 'weight': '12.5',
+                'sex': 'M'}], 'next': None})
+
+    def test_cursor(self):
+        reports = [self.create_report(analyze=False) for i in range(3)]
+        data = self._extract(self._get(get_kwargs={'limit': 2}))
+        self.assertEquals([r['id'] for r in data['reports']],
+                [r.pk for r in reports[:2]])
+        data = self._extract(self._get(get_kwargs={'limit': 2,
+                'cursor': data['next']}))
+        self.assertEquals([r['id'] for r in data['reports']],
+                [reports[2].pk])
+        self.assertEquals(data['next'], None)
+
+    def test_errors(self):
+        """Invalid filters, fields or cursors are rejected."""
+        for params in ({'start_date': 'bad'}, {'fields': 'bad'},
+                {'cursor': 'bad'}, {'limit': 'bad'}):
+            response = self._get(get_kwargs=params)
+            self.assertEquals(response.status_code, 400)
+            self.assertTrue(json.loads(response.content)['errors'])
+
+    def test_gzip(self):
+        """JSON may be compressed on the fly."""
+        self.create_report()
+        response = self._get(get_kwargs={'compress': 'gzip'})
+        self.assertEquals(response['Content-Type'], 'application/x-gzip')
+        content = zlib.decompress(self._content(response),
+                16 + zlib.MAX_WBITS)
+        self.assertEquals(len(json.loads(content)['reports']), 1)
+        response = self._get(get_kwargs={'compress': 'zip'})
+        self.assertEquals(response.status_code, 400)
+
+
+class NutritionEventListViewTest(NutritionViewTest):
+    url_name = 'nutrition_events'
+    perm_names = [('nutrition', 'view_report')]
+
+    def test_no_permission(self):
+        """Permission is required to read report events."""
+        self.user.user_permissions.all().delete()
+        response = self._get()
+        self.assertEquals(response.status_code, 302)  # redirect to login
+
+    @override_settings(NUTRITION_EVENT_LAG=0)
+    def test_events(self):
+        report = self.create_report(analyze=False)
+        report.cancel()
+        pks = list(ReportEvent.objects.order_by('pk').values_list('pk',
+                flat=True))
+        response = self._get(get_kwargs={'limit': 1})
+        self.assertEquals(response.status_code, 200)
+        self.assertEquals(response['Content-Type'], 'application/json')
+        page = json.loads(response.content)
+        self.assertEquals([e['sequence'] for e in page['events']], pks[:1])
+        self.assertTrue(page['more'])
+        response = self._get(get_kwargs={'after': page['next']})
+        page = json.loads(response.content)
+        self.assertEquals([e['sequence'] for e in page['events']], pks[1:])
+        self.assertEquals(page['events'][0]['type'], ReportEvent.CANCELLED)
+        self.assertFalse(page['more'])
+
+    def test_bad_cursor(self):
+        response = self._get(get_kwargs={'after': 'abc'})
+        self.assertEquals(response.status_code, 400)
@@ -13,4 +13,28 @@ urlpatterns = patterns('',
         views.CSVNutritionReportList.as_view(),
         name='csv_nutrition_reports',
     ),
+    url(r'^columns/$',
+        views.ColumnarNutritionReportList.as_view(),
+        name='columnar_nutrition_reports',
+    ),
+    url(r'^json/$',
+        views.JSONNutritionReportList.as_view(),
+        name='json_nutrition_reports',
+    ),
+    url(r'^survey/$',
+        views.NutritionSurvey.as_view(),
+        name='nutrition_survey',
+    ),
+    url(r'^quality/$',
+        views.NutritionDataQuality.as_view(),
+        name='nutrition_data_quality',
+    ),
+    url(r'^events/$',
+        views.NutritionEventList.as_view(),
+        name='nutrition_events',
+    ),
+    url(r'^admission/$',
+        views.NutritionAdmissionMetrics.as_view(),
+        name='nutrition_admission_metrics',
+    ),
 )
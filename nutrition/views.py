@@ -1,19 +1,53 @@
 from __future__ import unicode_literals
+import calendar
+import hashlib
+import json
 import re
 
-from nutrition.unicsv import UnicodeCSVWriter
-
+from django.conf import settings
 from django.contrib.auth.decorators import permission_required
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.urlresolvers import reverse
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import (HttpResponse, HttpResponseNotModified,
+        HttpResponseBadRequest, HttpResponseRedirect)
+from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
 from django.utils.decorators import method_decorator
+from django.utils.http import (http_date, parse_etags, parse_http_date_safe,
+        quote_etag, urlencode)
+from django.utils.safestring import mark_safe
 from django.views.generic import View
 from django.views.generic.base import TemplateView
 
 from django_tables2 import RequestConfig
 
+from nutrition import admission, events
+from nutrition.counts import CountedPaginator, report_counts
+from nutrition import exports
+from nutrition.exports import ReportRecords, ReportRows
 from nutrition.forms import ReportFilterForm
-from nutrition.tables import NutritionReportTable, CSVNutritionReportTable
+from nutrition.models import Report
+from nutrition.tables import NutritionReportTable
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:  # Django < 1.5
+    StreamingHttpResponse = None
+
+
+def streaming_response(content, **kwargs):
+    """Returns a response which sends an iterator of bytes as it is read.
+
+    Django 1.4 has no StreamingHttpResponse, but its HttpResponse also
+    consumes an iterator as the response is sent, unless a middleware
+    reads the response's content first.
+    """
+    if StreamingHttpResponse is None:
+        return HttpResponse(content, **kwargs)
+    return StreamingHttpResponse(content, **kwargs)
 
 
 class NutritionReportMixin(object):
@@ -28,33 +62,183 @@ class NutritionReportMixin(object):
 
 
 class NutritionReportList(NutritionReportMixin, TemplateView):
-    """Displays a paginated list of all nutrition reports."""
+    """Displays a paginated list of all nutrition reports.
+
+    Responses carry ETag and Last-Modified headers derived from the version
+    of the reports table and the normalized filter, page and sort
+    parameters, so that a client refreshing an unchanged page receives a
+    304 Not Modified response. If NUTRITION_REPORT_LIST_CACHE_TIMEOUT is
+    set, the rendered table is also cached with the same key.
+    """
     template_name = 'nutrition/report_list.html'
+    table_fragment_template_name = 'nutrition/report_table.html'
     table_template_name = 'django_tables2/bootstrap-tables.html'
     items_per_page = 20
+    cache_key_prefix = 'nutrition-report-list'
+
+    def get(self, request, *args, **kwargs):
+        self.version = Report.objects.get_version()
+        self.params = self.get_params()
+        etag, last_modified = self.get_etag(), self.get_last_modified()
+        if self.is_not_modified(etag, last_modified):
+            response = HttpResponseNotModified()
+        else:
+            response = super(NutritionReportList, self).get(request, *args,
+                    **kwargs)
+        response['ETag'] = quote_etag(etag)
+        if last_modified is not None:
+            response['Last-Modified'] = http_date(last_modified)
+        patch_cache_control(response, private=True, max_age=0)
+        patch_vary_headers(response, ['Cookie'])
+        return response
+
+    def get_params(self):
+        """Returns the normalized filter, page and sort parameters."""
+        if self.form.is_valid():
+            filters = self.form.get_filters()
+        else:
+            filters = [(k, v) for k, v in self.request.GET.iterlists()
+                    if k not in ('page', 'sort')]
+        return {
+            'filters': sorted(filters),
+            'page': self.request.GET.get('page') or '1',
+            'sort': self.request.GET.get('sort') or '',
+        }
+
+    def get_key(self):
+        """Identifies the rendered table, regardless of the user."""
+        key = repr((self.version, sorted(self.params.items())))
+        return hashlib.md5(key.encode('utf-8')).hexdigest()
+
+    def get_etag(self):
+        # The page layout includes details of the logged in user.
+        etag = '{0}-{1}'.format(self.get_key(), self.request.user.pk)
+        return hashlib.md5(etag.encode('utf-8')).hexdigest()
+
+    def get_last_modified(self):
+        """Returns when a report was last updated, in seconds since epoch."""
+        last_updated = self.version[0]
+        if last_updated is None:
+            return None
+        if timezone.is_naive(last_updated):
+            last_updated = timezone.make_aware(last_updated,
+                    timezone.get_default_timezone())
+        return calendar.timegm(last_updated.utctimetuple())
+
+    def is_not_modified(self, etag, last_modified):
+        if_none_match = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if if_none_match:
+            etags = parse_etags(if_none_match)
+            return etag in etags or '*' in etags
+        if_modified_since = self.request.META.get('HTTP_IF_MODIFIED_SINCE')
+        if if_modified_since and last_modified is not None:
+            if_modified_since = parse_http_date_safe(if_modified_since)
+            return bool(if_modified_since and
+                    last_modified <= if_modified_since)
+        return False
 
     def get_table(self):
         table = NutritionReportTable(self.items,
                 template=self.table_template_name)
-        paginate = {'per_page': self.items_per_page}
+        count, self.count_estimated = report_counts.get(self.items,
+                self.params['filters'])
+        paginate = {
+            'klass': CountedPaginator,
+            'per_page': self.items_per_page,
+            'count': count,
+        }
         RequestConfig(self.request, paginate=paginate).configure(table)
+        # Evaluates the page's queryset, which is then reused for rendering.
+        Report.prefetch_patients(table.page.object_list.data)
         return table
 
+    def get_table_html(self):
+        """Renders the table, or retrieves it from the cache."""
+        timeout = getattr(settings, 'NUTRITION_REPORT_LIST_CACHE_TIMEOUT', 0)
+        key = '{0}-{1}'.format(self.cache_key_prefix, self.get_key())
+        if timeout:
+            html = cache.get(key)
+            if html is not None:
+                return mark_safe(html)
+        self.table = self.get_table()
+        csv_params = self.params['filters']
+        if self.params['sort']:
+            csv_params = csv_params + [('sort', self.params['sort'])]
+        context = {
+            'table': self.table,
+            'count_estimated': self.count_estimated,
+            'csv_query': urlencode(csv_params, doseq=True),
+        }
+        html = render_to_string(self.table_fragment_template_name, context,
+                context_instance=RequestContext(self.request))
+        if timeout:
+            cache.set(key, html, timeout)
+        return html
+
     def get_context_data(self, *args, **kwargs):
-        return {
+        context = {
             'form': self.form,
-            'table': self.get_table(),
+            'table_html': self.get_table_html(),
         }
+        if hasattr(self, 'table'):
+            context['table'] = self.table
+        return context
 
 
-class CSVNutritionReportList(NutritionReportMixin, View):
-    """Export filtered reports to a CSV file."""
-    filename = 'nutrition_reports'
+class CompressedExportMixin(object):
+    """Compresses streamed exports with gzip, if asked to.
 
-    def get_table(self):
-        table = CSVNutritionReportTable(self.items)
-        RequestConfig(self.request).configure(table)
-        return table
+    With compress=gzip, the export is downloaded as a gzip file. Otherwise,
+    if NUTRITION_EXPORT_GZIP is set and the client accepts gzip, the
+    response is sent with a gzip Content-Encoding, which browsers decode.
+    level overrides NUTRITION_EXPORT_GZIP_LEVEL.
+    """
+
+    def get_compression(self):
+        """Returns the compression level and whether to send a .gz file.
+
+        The level is None if the export is not to be compressed. Raises
+        ValueError if the compress or level parameter is invalid.
+        """
+        compress = self.request.GET.get('compress')
+        if compress not in (None, '', 'gzip'):
+            raise ValueError('compress must be gzip.')
+        level = exports.get_compression_level(
+                self.request.GET.get('level') or None)
+        if compress:
+            return level, True
+        accepted = self.request.META.get('HTTP_ACCEPT_ENCODING', '')
+        if (getattr(settings, 'NUTRITION_EXPORT_GZIP', False) and
+                exports.accepts_gzip(accepted)):
+            return level, False
+        return None, False
+
+    def export_response(self, content, content_type, level=None,
+            as_file=False, filename=None):
+        """Returns a response which streams content, an iterator of bytes.
+
+        If level is not None, content is compressed as it is sent.
+        """
+        if level is not None:
+            content = exports.gzip_stream(content, level)
+            if as_file:
+                content_type = 'application/x-gzip'
+                filename = filename and filename + '.gz'
+        response = streaming_response(content, content_type=content_type)
+        if filename:
+            response['Content-Disposition'] = 'attachment; filename=%s' % (
+                    filename)
+        if level is not None and not as_file:
+            response['Content-Encoding'] = 'gzip'
+        if getattr(settings, 'NUTRITION_EXPORT_GZIP', False):
+            patch_vary_headers(response, ('Accept-Encoding',))
+        return response
+
+
+class CSVNutritionReportList(CompressedExportMixin, NutritionReportMixin,
+        View):
+    """Streams filtered reports as a CSV file."""
+    filename = 'nutrition_reports'
 
     def get(self, request, *args, **kwargs):
         # Redirect to the plain reports list if form is invalid.
@@ -63,21 +247,179 @@ class CSVNutritionReportList(NutritionReportMixin, View):
             if request.GET:
                 url = '{0}?{1}'.format(url, request.GET.urlencode())
             return HttpResponseRedirect(url)
+        try:
+            level, as_file = self.get_compression()
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
 
-        response = HttpResponse(content_type='text/csv')
-        content_disposition = 'attachment; filename=%s.csv' % self.filename
-        response['Content-Disposition'] = content_disposition
-        writer = UnicodeCSVWriter(response)
-        writer.writerows(self.get_rows())
-        return response
+        return self.export_response(exports.stream_csv(self.get_rows()),
+                'text/csv', level, as_file, '%s.csv' % self.filename)
 
     def get_rows(self):
-        table = self.get_table()
-        headers = [col.title() for col in table.columns.names()]
-        rows = [headers]
-        for item in table.rows:
-            row = []
-            for cell in item:
-                row.append(cell)
-            rows.append(row)
-        return rows
+        return ReportRows(self.items, order_by=self.request.GET.get('sort'))
+
+
+class ColumnarNutritionReportList(CompressedExportMixin,
+        NutritionReportMixin, View):
+    """Streams filtered reports in a columnar format, for analysis.
+
+    The format parameter may be parquet or arrow, which require pyarrow, or
+    npz; by default, the first available of these is used. See
+    nutrition.columnar, which requires NumPy.
+    """
+    filename = 'nutrition_reports'
+
+    def get(self, request, *args, **kwargs):
+        try:
+            from nutrition import columnar
+        except ImportError:
+            # Even npz needs NumPy, so no format can be written.
+            return HttpResponse('NumPy is required for columnar exports; '
+                    'no formats are available.', status=501,
+                    content_type='text/plain')
+        if not self.form.is_valid():
+            return HttpResponseBadRequest(self.form.errors.as_text())
+        formats = columnar.get_formats()
+        format = request.GET.get('format') or formats[0]
+        if format not in formats:
+            return HttpResponseBadRequest('format must be one of: {0}.'.format(
+                    ', '.join(formats)))
+        try:
+            level, as_file = self.get_compression()
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
+        extension, content_type, _ = columnar.FORMATS[format]
+        return self.export_response(columnar.export(self.items, format),
+                content_type, level, as_file,
+                '%s.%s' % (self.filename, extension))
+
+
+class JSONNutritionReportList(CompressedExportMixin, NutritionReportMixin,
+        View):
+    """Streams a page of filtered reports as JSON.
+
+    Clients may choose fields with a comma-separated fields parameter and
+    page through reports by passing back the next cursor. Patient records
+    are only retrieved if a patient field (age, sex or location) is chosen.
+    """
+
+    def get(self, request, *args, **kwargs):
+        if not self.form.is_valid():
+            return self.error(self.form.errors)
+        fields = [name.strip() for name in
+                request.GET.get('fields', '').split(',') if name.strip()]
+        limit = request.GET.get('limit')
+        if limit and not limit.isdigit():
+            return self.error({'limit': ['Enter a whole number.']})
+        try:
+            records = ReportRecords(self.items, fields=fields,
+                    cursor=request.GET.get('cursor'),
+                    limit=int(limit) if limit else None)
+            level, as_file = self.get_compression()
+        except ValueError as e:
+            return self.error({'__all__': [unicode(e)]})
+        return self.export_response(self.stream(records), 'application/json',
+                level, as_file)
+
+    def error(self, errors):
+        errors = dict([(name, [unicode(e) for e in messages])
+                for name, messages in errors.items()])
+        return HttpResponseBadRequest(json.dumps({'errors': errors}),
+                content_type='application/json')
+
+    def stream(self, records):
+        yield '{"reports": ['
+        for i, record in enumerate(records):
+            yield (',' if i else '') + json.dumps(record,
+                    cls=DjangoJSONEncoder)
+        # The cursor is known once every report has been written.
+        yield '], "next": {0}}}'.format(json.dumps(records.next))
+
+
+class NutritionSurvey(NutritionReportMixin, View):
+    """Returns survey statistics of the filtered reports as JSON.
+
+    See nutrition.surveys, which requires NumPy.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            from nutrition import surveys
+        except ImportError:
+            return HttpResponse('NumPy is required for survey statistics.',
+                    status=501, content_type='text/plain')
+        if not self.form.is_valid():
+            return HttpResponseBadRequest(self.form.errors.as_text())
+        group_by = [name.strip() for name in
+                request.GET.get('group_by', '').split(',') if name.strip()]
+        flags = request.GET.get('flags') or surveys.WHO
+        if flags not in (surveys.WHO, surveys.SMART):
+            return HttpResponseBadRequest('flags must be who or smart.')
+        try:
+            design_effect = float(request.GET.get('design_effect') or 1)
+            results = surveys.survey(self.items, group_by=group_by,
+                    flags=flags, design_effect=design_effect)
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
+        return HttpResponse(json.dumps({'groups': results}),
+                content_type='application/json')
+
+
+class NutritionDataQuality(NutritionReportMixin, View):
+    """Returns data quality checks of the filtered reports as JSON.
+
+    See nutrition.quality, which requires NumPy.
+    """
+
+    def get(self, request, *args, **kwargs):
+        try:
+            from nutrition import quality
+        except ImportError:
+            return HttpResponse('NumPy is required for data quality checks.',
+                    status=501, content_type='text/plain')
+        if not self.form.is_valid():
+            return HttpResponseBadRequest(self.form.errors.as_text())
+        group_by = [name.strip() for name in
+                request.GET.get('group_by', 'reporter').split(',')
+                if name.strip()]
+        try:
+            results = quality.check_quality(self.items, group_by=group_by)
+        except ValueError as e:
+            return HttpResponseBadRequest(unicode(e))
+        if request.GET.get('problems'):
+            results = [result for result in results if result['problems']]
+        return HttpResponse(json.dumps({'groups': results}),
+                content_type='application/json')
+
+
+class NutritionEventList(View):
+    """Returns a page of report events, as JSON, for incremental consumers."""
+
+    @method_decorator(permission_required('nutrition.view_report'))
+    def dispatch(self, request, *args, **kwargs):
+        return super(NutritionEventList, self).dispatch(request, *args,
+                **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        try:
+            after = int(request.GET.get('after') or 0)
+            limit = request.GET.get('limit')
+            limit = int(limit) if limit else None
+        except ValueError:
+            return HttpResponseBadRequest('after and limit must be integers.')
+        page = events.get_page(after, limit)
+        return HttpResponse(json.dumps(page, cls=DjangoJSONEncoder),
+                content_type='application/json')
+
+
+class NutritionAdmissionMetrics(View):
+    """Returns this process's admission queue metrics as JSON."""
+
+    @method_decorator(permission_required('nutrition.view_report'))
+    def dispatch(self, request, *args, **kwargs):
+        return super(NutritionAdmissionMetrics, self).dispatch(request,
+                *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return HttpResponse(json.dumps(admission.get_metrics()),
+                content_type='application/json')
@@ -1,6 +1,8 @@
 #!/usr/bin/env python
 import optparse
+import os
 import sys
+import tempfile
 
 from django.conf import settings
 
@@ -11,6 +13,10 @@ if not settings.configured:
             'default': {
                 'ENGINE': 'django.db.backends.sqlite3',
                 'NAME': ':memory:',
+                # Use a file-backed test database so that tests may share it
+                # between threads.
+                'TEST_NAME': os.path.join(tempfile.gettempdir(),
+                        'nutrition-tests-{0}.db'.format(os.getpid())),
             }
         },
         HEALTHCARE_STORAGE_BACKEND='healthcare.backends.dummy.DummyStorage',
@@ -41,6 +47,9 @@ if not settings.configured:
 
         NUTRITION_PATIENT_HEALTHCARE_SOURCE='nutrition',
         NUTRITION_REPORTER_HEALTHCARE_SOURCE='nutrition',
+        # Set to run the tests with fixed-point storage of measurements.
+        NUTRITION_FIXED_POINT_STORAGE=bool(os.environ.get(
+                'NUTRITION_FIXED_POINT_STORAGE')),
     )
 
 